@@ -10,14 +10,21 @@ from utils import fetch_twse_institutional_data, get_stock_data, get_latest_pric
 from broker import PaperBroker
 from strategy import check_strategy, calculate_indicators, get_signal, get_strategy_status
 from backtest import BacktestEngine
-from data_manager import save_data, load_data
+from data_manager import save_data, load_data, persist_coordinator
 from stock_map import get_stock_name, STOCK_NAMES
 from ui_resources import ST_STYLE, MANUAL_TEXT
-from utils import fetch_twse_institutional_data, get_stock_data, get_latest_price, get_realtime_quote, get_top_movers_batch, get_sector_performance, get_fundamental_data, fetch_shareholding_data, get_financial_statement, get_dividend_history, get_recent_news
+from utils import fetch_twse_institutional_data, get_stock_data, get_latest_price, get_realtime_quote, get_top_movers_batch, get_sector_performance, get_fundamental_data, fetch_shareholding_data, get_financial_statement, get_dividend_history, get_recent_news, get_price_snapshot, get_chart_data
 from broker import PaperBroker
 from strategy import check_strategy, calculate_indicators, get_signal, get_strategy_status
 from backtest import BacktestEngine
-from data_manager import save_data, load_data
+from optimizer import optimize, best_by_ticker
+from bot_engine import run_bot_cycle, merge_bot_config, BarTracker
+from bot_runner import runner_status
+from bot_inbox import bot_inbox
+from market_hub import market_hub
+from model_registry import model_registry
+from instrumentation import metrics, span
+from data_manager import save_data, load_data, persist_coordinator, pending_edits, apply_edits, state_version
 from stock_map import get_stock_name, STOCK_NAMES
 from ui_resources import ST_STYLE, MANUAL_TEXT
 from auth import render_login_ui
@@ -30,8 +37,11 @@ st.set_page_config(page_title="台股智投旗艦版", layout="wide", page_icon=
 # --- UI Theme Injection ---
 st.markdown(ST_STYLE, unsafe_allow_html=True)
 
+BOT_FALLBACK_INTERVAL = 50 # Seconds between in-page bot scans (below the pages' 60s refresh)
+
 def persist():
-    save_data(
+    # Coalesced: saved once by flush_persist() at the end of the run (or the start of the next one)
+    persist_coordinator.mark_dirty(
         st.session_state.broker, 
         st.session_state.watchlists, 
         st.session_state.trade_log,
@@ -39,13 +49,100 @@ def persist():
         username=st.session_state.get('username', 'default')
     )
 
+def flush_persist(force=False):
+    username = st.session_state.get('username', 'default')
+    if persist_coordinator.flush(username, force=force) and runner_status():
+        # The runner applied the edits: continue from its state (fills included)
+        load_user_state(username)
+
+def runner_owns(username):
+    """True while a live bot runner is the only writer of the user's saved state."""
+    return bool(runner_status()) and state_version(username) is not None
+
+def save_user_state(broker, watchlists, trade_log, bot_config, username="default"):
+    """save_data(), or while the runner owns the account, send it the config edits instead."""
+    if not runner_owns(username):
+        return save_data(broker, watchlists, trade_log, bot_config, username=username)
+    entry = pending_edits(watchlists, trade_log, bot_config, username)
+    if entry:
+        cmd_id = bot_inbox.submit(username, {"op": "edit", "entry": entry})
+        if bot_inbox.wait(username, cmd_id) is None:
+            print(f"Bot Runner Edit Timeout {username}: queued")
+    return False
+
+persist_coordinator.save = save_user_state
+
+def place_order(side, symbol, price, qty):
+    """
+    Manual order: executed by the bot runner while it owns the account, else
+    in this session. Returns (ok, msg); ok is None while the order is pending.
+    """
+    username = st.session_state.username
+    if runner_owns(username):
+        flush_persist(force=True)
+        cmd_id = bot_inbox.submit(username, {"op": "trade", "side": side, "symbol": symbol, "price": float(price), "qty": int(qty)})
+        reply = bot_inbox.wait(username, cmd_id)
+        if reply is None:
+            if bot_inbox.cancel(username, cmd_id):
+                return False, "背景機器人服務未回應，委託已取消"
+            # Claimed by the runner: it is being filled (or rejected) right now
+            return None, "委託處理中，請稍後重新整理確認結果"
+        load_user_state(username)
+        return reply["ok"], reply["msg"]
+    order = st.session_state.broker.buy if side == "buy" else st.session_state.broker.sell
+    s, m = order(symbol, price, qty)
+    if s: persist()
+    return s, m
+
+def render_diagnostics():
+    """Hidden page (?diag=1): stage latency percentiles of this process."""
+    st.title("🩺 Diagnostics")
+    summary = metrics.summary()
+    if not summary:
+        st.info("No timings recorded yet.")
+    else:
+        rows = [{"Stage": stage, "Count": s["count"], "Errors": s["errors"],
+                 **{k: f"{s[k]*1000:.1f} ms" for k in ("mean", "p50", "p90", "p99", "max")},
+                 "Last Error": s["last_error"]} for stage, s in summary.items()]
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    runner = runner_status()
+    if runner:
+        st.caption(f"Bot runner: {runner.get('state')} | cycles {runner.get('cycles', 0)} | subscribers {runner.get('subscribers', {})}")
+    st.caption(f"Market hub: {market_hub.fetches} batched downloads | subscribers {market_hub.subscriber_counts()}")
+    st.caption(f"Model registry: {model_registry.stats}")
+    c1, c2 = st.columns(2)
+    if c1.button("💾 Export metrics file"):
+        if metrics.export(): st.success("Metrics written")
+    c2.download_button("⬇️ Download metrics", metrics.to_text(), file_name="metrics.txt")
+
 def main_app():
     # Auto-refresh moved to page specific logic
 
+    runner = runner_status()
+    username = st.session_state.get('username', 'default')
+    if st.session_state.get('runner_live') and not runner:
+        # The runner stopped: take over from what it saved, keeping this session's unsaved edits
+        entry = pending_edits(st.session_state.watchlists, st.session_state.trade_log, st.session_state.bot_config, username)
+        persist_coordinator.discard(username)
+        load_user_state(username)
+        if entry:
+            apply_edits({"watchlists": st.session_state.watchlists, "trade_log": st.session_state.trade_log,
+                         "bot_config": st.session_state.bot_config}, entry)
+            persist()
+    st.session_state.runner_live = bool(runner)
+
+    # Changes from a run that ended in st.rerun() (which skips the end-of-run flush)
+    flush_persist()
+
+    if st.query_params.get("diag") == "1":
+        render_diagnostics()
+        return
     
     # --- Global Sidebar ---
     st.sidebar.title(f"👤 {st.session_state.get('username', 'User')}")
     if st.sidebar.button("登出"):
+        flush_persist(force=True)
+        market_hub.unsubscribe(st.session_state.get('username', 'default'))
         st.session_state['logged_in'] = False
         st.rerun()
         
@@ -91,10 +188,18 @@ def main_app():
     # ==========================================
     if page == "🤖 智能機器人":
         st.title("🤖 智能自動交易機器人")
-        st.info("⚠️ 請保持此頁面開啟，機器人才能持續監控盤勢。")
+        if runner:
+            st.success(f"🛰️ 背景機器人服務運行中 (最後心跳: {datetime.datetime.fromtimestamp(runner['heartbeat']):%H:%M:%S})，關閉此頁面不影響運作。")
+        else:
+            st.info("⚠️ 請保持此頁面開啟，機器人才能持續監控盤勢。(或執行 python bot_runner.py 於背景運行)")
         
         # Auto-refresh for Bot (60s to save quota)
         count = st_autorefresh(interval=60000, key="bot_refresh")
+        # The runner trades on the saved state: pick up its fills (unless this session has unsaved edits)
+        if runner and count > st.session_state.get('last_sync_count', -1) \
+                and not persist_coordinator.is_dirty(st.session_state.get('username', 'default')):
+            st.session_state.last_sync_count = count
+            load_user_state(st.session_state.username)
     elif page == "🔬 個股研究室":
         st.title("🔬 個股全方位研究室")
         st.caption("整合基本面、籌碼面與 AI 智能分析 (Integrating Fundamentals, Chips & AI)")
@@ -370,7 +475,9 @@ def main_app():
         count = st_autorefresh(interval=30000, key="trading_refresh")
         
         # --- 1. KPI Cards (Top Row) ---
-        acc = st.session_state.broker.get_account_summary(current_prices={c: get_latest_price(c) for c in st.session_state.broker.inventory})
+        # One batched quote for every open position (shared by KPIs and the inventory tab)
+        inv_prices = get_price_snapshot(st.session_state.broker.held_symbols())
+        acc = st.session_state.broker.get_account_summary(current_prices=inv_prices)
         
         # Check colors for PnL
         u_pnl = acc['Unrealized_PnL']
@@ -438,8 +545,8 @@ def main_app():
 
             # Chart Logic
             with st.container(): # Pseudo Card
-                # Fetch Data
-                df = get_stock_data(target, period=period, interval=interval)
+                # Fetch Data (coarser timeframes are resampled locally from 1m / daily bars)
+                df = get_chart_data(target, period=period, interval=interval)
                 
                 if not df.empty:
                     # --- Indicator Calculation (On Histogram/Table, not persisted to DB) ---
@@ -594,14 +701,16 @@ def main_app():
              col_buy, col_sell = st.columns(2)
              with col_buy:
                  if st.button("🔴 買進", use_container_width=True):
-                     s, m = st.session_state.broker.buy(target, curr_p, qty)
-                     if s: st.success("委託成功"); st.toast(f"已買入 {target} {qty}張"); persist(); time.sleep(1); st.rerun()
+                     s, m = place_order("buy", target, curr_p, qty)
+                     if s: st.success("委託成功"); st.toast(f"已買入 {target} {qty}張"); time.sleep(1); st.rerun()
+                     elif s is None: st.warning(m)
                      else: st.error(m)
                      
              with col_sell:
                  if st.button("🟢 賣出", use_container_width=True):
-                     s, m = st.session_state.broker.sell(target, curr_p, qty)
-                     if s: st.success("委託成功"); st.toast(f"已賣出 {target} {qty}張"); persist(); time.sleep(1); st.rerun()
+                     s, m = place_order("sell", target, curr_p, qty)
+                     if s: st.success("委託成功"); st.toast(f"已賣出 {target} {qty}張"); time.sleep(1); st.rerun()
+                     elif s is None: st.warning(m)
                      else: st.error(m)
                      
              # Information
@@ -618,7 +727,7 @@ def main_app():
             inv_data = []
             for s, v in st.session_state.broker.inventory.items():
                 if v['qty'] != 0:
-                     cur = get_latest_price(s)
+                     cur = inv_prices.get(s, 0.0)
                      cost = v['cost']
                      mkt_val = cur * v['qty']
                      # PnL logic for table
@@ -726,49 +835,38 @@ def main_app():
             detailed_reports = [] # To store figures and dataframes for sequential rendering
             
             total_stocks = len(target_tickers)
-            main_prog = st.progress(0, text=f"開始執行 {total_stocks} 檔股票 AI 預測...")
+            from batch_predict import run_batch, plan_workers
+            from prophet.serialize import model_from_json
             
-            from prediction_engine import train_xgboost, train_lstm, train_prophet
+            # Tickers run in parallel worker processes; results arrive as each one finishes
+            n_workers, _ = plan_workers(total_stocks)
+            main_prog = st.progress(0, text=f"開始執行 {total_stocks} 檔股票 AI 預測 ({n_workers} 個工作程序)...")
             
-            for idx, ticker in enumerate(target_tickers):
+            for idx, res in enumerate(run_batch(target_tickers, lookback_years, forecast_days)):
+                ticker = res['ticker']
                 stock_name = get_stock_name(ticker)
-                main_prog.progress((idx) / total_stocks, text=f"正在分析 ({idx+1}/{total_stocks}): {ticker} {stock_name} ...")
+                main_prog.progress((idx + 1) / total_stocks, text=f"已完成 ({idx+1}/{total_stocks}): {ticker} {stock_name}")
+                metrics.record("predict.ticker", res['seconds'])
+                if n_workers > 1:
+                    # Counted in the workers' registries; in-process runs already counted here
+                    for status in res.get('registry', {}).values():
+                        model_registry.stats[status] += 1
                 
                 try:
-                    # 1. Data Prep
-                    feature_df = prepare_data(ticker, period=f"{lookback_years}y")
-                    
-                    if feature_df.empty:
+                    if res.get('error') == "no data":
                         st.warning(f"⚠️ {ticker} 無法取得數據，跳過。")
                         continue
+                    if 'error' in res:
+                        raise RuntimeError(res['error'])
                         
-                    last_close = float(feature_df['Close'].iloc[-1])
-                    last_date = feature_df.index[-1]
-                    
-                    # 2. XGBoost
-                    xgb_predictions = []
-                    # Enhanced Feature Set
-                    features = ['Close', 'MA5', 'MA20', 'RSI', 'MACD', 'MACD_Hist', 'K', 'D', 'UpperB', 'LowerB', 'PctChange', 'VolChange', 'VIX']
-                    latest_features = feature_df.iloc[-1:][features]
-                    
-                    for d in range(1, forecast_days + 1):
-                        model_x, results_x, mae_x, rmse_x, mape_x, f_imp_x = train_xgboost(feature_df, horizon=d)
-                        
-                        # Capture T+1 Backtest Data for Visualization
-                        if d == 1:
-                            backtest_xgb = results_x
-                            
-                        next_pred = model_x.predict(latest_features)[0]
-                        conf_score = max(0, 100 * (1 - mape_x))
-                        xgb_predictions.append({"Day": f"T+{d}", "Price": next_pred, "Conf": conf_score, "MAE": mae_x, "Imp": f_imp_x})
-                        
-                    # 3. LSTM
-                    model_l, results_l, mae_l, rmse_l, mape_l, future_prices_l, history_l = train_lstm(
-                        feature_df, forecast_days=forecast_days, seq_length=60, epochs=10
-                    )
-                    
-                    # 4. Prophet (NEW)
-                    prophet_forecast, future_prices_p, model_p, mae_p = train_prophet(feature_df, forecast_days=forecast_days)
+                    last_close = res['last_close']
+                    last_date = res['last_date']
+                    xgb_predictions = res['xgb_predictions']
+                    mape_x = res['mape_x']
+                    backtest_xgb = res['backtest_xgb']
+                    future_prices_l, mae_l, mape_l, results_l = res['future_prices_l'], res['mae_l'], res['mape_l'], res['backtest_lstm']
+                    prophet_forecast, future_prices_p, mae_p = res['prophet_forecast'], res['future_prices_p'], res['mae_p']
+                    model_p = model_from_json(res['prophet_model_json'])
                     
                     # --- Aggregate T+1 Results ---
                     t1_xgb = xgb_predictions[0]['Price']
@@ -813,8 +911,8 @@ def main_app():
                     fig = go.Figure()
                     
                     # History (Last 90 days)
-                    hist_data = feature_df.iloc[-90:]
-                    fig.add_trace(go.Scatter(x=hist_data.index, y=hist_data['Close'], name='歷史股價', line=dict(color='gray', width=2)))
+                    hist_data = res['history']
+                    fig.add_trace(go.Scatter(x=hist_data.index, y=hist_data, name='歷史股價', line=dict(color='gray', width=2)))
                     
                     # Future Dates
                     future_dates = [last_date + datetime.timedelta(days=i) for i in range(1, forecast_days+1)]
@@ -834,7 +932,7 @@ def main_app():
                     fig.update_layout(title=f"{ticker} {stock_name} - 三大 AI 模型預測走勢", template="plotly_dark", height=400)
                     
                     # Collect Metrics
-                    metrics = {
+                    model_errors = {
                         "MAE_XGB": xgb_predictions[0]['MAE'],
                         "MAE_LSTM": mae_l,
                         "MAE_Prophet": mae_p
@@ -846,10 +944,10 @@ def main_app():
                         "change_pct": change_pct, # Key for sorting
                         "fig": fig,
                         "comp_df": pd.DataFrame(comp_data),
-                        "loss_history": history_l.history['loss'] if history_l else [],
+                        "loss_history": res['loss_history'],
                         "mape_x": mape_x,
                         "mape_l": mape_l,
-                        "f_imp": xgb_predictions[0]['Imp'], # Added Feature Importance
+                        "f_imp": res['f_imp'], # Added Feature Importance
                         "prophet_model": model_p,
                         "prophet_forecast": prophet_forecast,
                         "backtest_xgb": backtest_xgb,
@@ -1006,7 +1104,7 @@ def main_app():
     # ==========================================
     if page == "🤖 智能機器人":
         st.markdown("### 💰 量化帳戶")
-        acc = st.session_state.broker.get_account_summary()
+        acc = st.session_state.broker.get_account_summary(current_prices=get_price_snapshot(st.session_state.broker.held_symbols()))
         c1, c2, c3 = st.columns(3)
         c1.metric("總資產", f"${acc['Total_Assets']/10000:.1f}萬")
         c2.metric("現金", f"${acc['Balance']/10000:.1f}萬")
@@ -1092,31 +1190,34 @@ def main_app():
                  persist(); st.success("參數已更新")
         with c_ctrl:
             st.subheader("📡 運行控制")
-            if st.session_state.get('bot_active'):
-                st.info(f"🟢 機器人運行中 (Loop: {st.session_state.get('last_run_count', 0)})")
-                if st.button("⏹️ 停止"): st.session_state.bot_active=False; persist(); st.rerun()
+            if st.session_state.bot_config.get('active'):
+                if runner:
+                    st.info(f"🟢 機器人運行中 (背景服務 Loop: {runner.get('cycles', 0)})")
+                else:
+                    st.info(f"🟢 機器人運行中 (Loop: {st.session_state.get('last_run_count', 0)})")
+                if st.button("⏹️ 停止"): st.session_state.bot_config['active']=False; market_hub.unsubscribe(st.session_state.username); persist(); st.rerun()
             else:
                 st.error("🔴 已停止")
-                if st.button("▶️ 啟動"): st.session_state.bot_active=True; persist(); st.rerun()
+                if st.button("▶️ 啟動"): st.session_state.bot_config['active']=True; persist(); st.rerun()
                 
         if st.button("🚀 執行策略最佳化"):
-            prog = st.progress(0)
-            best_map = {}
-            strats = ["MA_Cross", "RSI_Strategy", "MACD_Strategy", "KD_Strategy", "Bollinger_Strategy"]
+            prog = st.progress(0, text="下載歷史資料...")
             
             # Use current targets from session state
             opt_targets = st.session_state.bot_config.get('targets', [])
+            opt_data = {s_code: get_stock_data(s_code, period="1y") for s_code in opt_targets}
             
-            for i, s_code in enumerate(opt_targets):
-                b_ret = -999; b_strat = "MA_Cross"
-                df = get_stock_data(s_code, period="1y")
-                if not df.empty:
-                    for strat_n in strats:
-                        e = BacktestEngine(1000000); eq, tr = e.run_backtest(df, strat_n); kp = e.calculate_kpis(eq, tr)
-                        if kp['Total Return'] > b_ret: b_ret = kp['Total Return']; b_strat = strat_n
-                best_map[s_code] = b_strat
-                prog.progress((i+1)/len(opt_targets))
-            st.session_state.bot_config['strategies'] = best_map; persist(); st.success("Optimized")
+            # (ticker x strategy x params) grid on a process pool
+            opt_table = optimize(opt_data, progress=lambda done, total: prog.progress(done / total, text=f"回測中 {done}/{total}"))
+            best = best_by_ticker(opt_table)
+            
+            best_map = {s_code: best.get(s_code, ("MA_Cross", {}))[0] for s_code in opt_targets}
+            param_map = {s_code: best[s_code][1] for s_code in opt_targets if s_code in best}
+            st.session_state.bot_config['strategies'] = best_map
+            st.session_state.bot_config['strategy_params'] = param_map
+            persist(); st.success("Optimized")
+            if not opt_table.empty:
+                st.dataframe(opt_table[opt_table['Rank'] <= 3].astype({'Params': str}))
 
         st.write("狀態:")
         rows = []
@@ -1164,7 +1265,7 @@ def main_app():
                 df=get_stock_data(t,period="2y")
                 if not df.empty:
                     e=BacktestEngine(1000000)
-                    eq,tr=e.run_backtest(df,s)
+                    eq,tr=e.run_backtest(df,s,vectorized=True)
                     k=e.calculate_kpis(eq,tr)
             
                     k1, k2, k3, k4 = st.columns(4)
@@ -1183,115 +1284,75 @@ def main_app():
     # ==========================================
     # BOT EXECUTION LOOP (Moved to End for Non-Blocking UI)
     # ==========================================
-    if st.session_state.get("bot_active", False):
-        # Only run if count updated (throttling)
-        # Note: 'count' variable is from st_autorefresh at top of function
-        running_needed = False
-        if "last_run_count" not in st.session_state: st.session_state.last_run_count = -1
-        if count > st.session_state.last_run_count:
-            running_needed = True
-            st.session_state.last_run_count = count
-            
+    # In-page fallback (any page); with a live bot_runner.py the scans run there instead
+    if st.session_state.bot_config.get('active') and not runner:
+        # Pages without their own auto-refresh still rerun once a minute
+        if page not in ("🤖 智能機器人", "🖥️ 模擬操盤室"):
+            st_autorefresh(interval=60000, key="bot_fallback_refresh")
+        # Throttled by time: the pages rerun on different schedules
+        running_needed = time.time() - st.session_state.get('last_bot_run', 0) >= BOT_FALLBACK_INTERVAL
         if running_needed:
+            st.session_state.last_bot_run = time.time()
+            st.session_state.last_run_count = st.session_state.get('last_run_count', 0) + 1
+
             # Status Indicator for user feedback without blocking early render
             with st.status("🤖 機器人掃描市場中...", expanded=False) as status:
-                targets = st.session_state.bot_config.get('targets', [])
-                cap_limit = st.session_state.bot_config.get('cap_limit_per_stock', 1000000)
-                sl_pct = st.session_state.bot_config.get('sl_pct', 10.0) / 100.0
-                tp_pct = st.session_state.bot_config.get('tp_pct', 20.0) / 100.0
-                
-                for symbol in targets:
-                    status.write(f"正在分析 {symbol}...")
-                    strat = st.session_state.bot_config.get('strategies', {}).get(symbol, "MA_Cross")
-                    try:
-                        df_bot = get_stock_data(symbol, period="6mo")
-                        if not df_bot.empty:
-                            df_bot = calculate_indicators(df_bot)
-                            curr_row = df_bot.iloc[-1]
-                            prev_row = df_bot.iloc[-2]
-                            
-                            sig = get_signal(curr_row, prev_row, strat)
-                            # Get Price safely
-                            current_price = float(curr_row['Close'])
+                if "bar_tracker" not in st.session_state: st.session_state.bar_tracker = BarTracker()
+                # Bars are shared with every other bot through the market hub
+                market_hub.subscribe(st.session_state.username, st.session_state.bot_config.get('targets', []), period="6mo")
+                msgs = run_bot_cycle(
+                    st.session_state.broker,
+                    st.session_state.bot_config,
+                    st.session_state.trade_log,
+                    progress=lambda symbol: status.write(f"正在分析 {symbol}..."),
+                    tracker=st.session_state.bar_tracker
+                )
+                for msg in msgs:
+                    st.toast(msg, icon="🔔")
+                if msgs:
+                    persist()
+                status.update(label="🤖 掃描完成", state="complete", expanded=False)
 
-                            inv = st.session_state.broker.inventory.get(symbol, {'qty': 0, 'cost': 0})
-                            curr_qty = inv['qty']
-                            avg_cost = inv['cost']
-                            
-                            executed = False
-                            msg = ""
-                            
-                            # SL/TP Check
-                            if curr_qty != 0:
-                                 if curr_qty > 0: pnl_pct = (current_price - avg_cost) / avg_cost
-                                 else: pnl_pct = (avg_cost - current_price) / avg_cost
-                                 
-                                 if pnl_pct < -sl_pct:
-                                      s, m = st.session_state.broker.sell(symbol, current_price, abs(curr_qty), action="現股賣出") if curr_qty > 0 else st.session_state.broker.buy(symbol, current_price, abs(curr_qty), action="融券回補")
-                                      if s: msg=f"🛡️ 觸發停損 ({pnl_pct*100:.1f}%)! 強制平倉 {symbol}: {m}"; executed=True
-                                 elif pnl_pct > tp_pct:
-                                      s, m = st.session_state.broker.sell(symbol, current_price, abs(curr_qty), action="現股賣出") if curr_qty > 0 else st.session_state.broker.buy(symbol, current_price, abs(curr_qty), action="融券回補")
-                                      if s: msg=f"💰 觸發停利 ({pnl_pct*100:.1f}%)! 強制平倉 {symbol}: {m}"; executed=True
+    # One save for everything this run changed (e.g. all bot fills above)
+    flush_persist()
 
-                            # Strategy Signal Check
-                            if not executed:
-                                if sig == 1: # Buy
-                                    custom_qty = st.session_state.bot_config.get('buy_qty', {}).get(symbol, 1000)
-                                    exposure = curr_qty * current_price
-                                    if (cap_limit - exposure) > current_price * custom_qty:
-                                        s, m = st.session_state.broker.buy(symbol, current_price, custom_qty, action="現股買進")
-                                        if s: msg=f"🤖 Bot買進 {symbol} ({strat}): {m}"; executed=True
-                                elif sig == -1: # Sell
-                                    if curr_qty > 0:
-                                        s, m = st.session_state.broker.sell(symbol, current_price, curr_qty, action="現股賣出")
-                                        if s: msg=f"🤖 Bot賣出 {symbol} ({strat}): {m}"; executed=True
-                            
-                            if executed:
-                                st.toast(msg, icon="🔔")
-                                st.session_state.trade_log.append(f"[{datetime.datetime.now()}] {msg}")
-                                persist()
-                    except Exception as e:
-                        print(f"Bot Error {symbol}: {e}")
-                        pass
-                status.update(label="🤖 掃描完成", state="complete", expanded=False)
+def load_user_state(username):
+    """(Re)loads the user's saved state into the session."""
+    data = load_data(username)
+    # Restore State Logic (Simplified copy from old init)
+    st.session_state.broker = PaperBroker(initial_balance=10000000) # Reset then load
+    
+    if data:
+        st.session_state.broker.restore_state(
+            data.get("balance", 10000000), 
+            data.get("inventory", {}), 
+            data.get("transaction_history", [])
+        )
+        st.session_state.watchlists = data.get("watchlists", {
+            "我的自選股": ["2330.TW", "2317.TW"], 
+            "高股息": ["0056.TW", "00878.TW"]
+        })
+        st.session_state.trade_log = data.get("trade_log", [])
+        # Config Merge
+        st.session_state.bot_config = merge_bot_config(data.get("bot_config", {}))
+    else:
+         # Fresh User Defaults
+         st.session_state.watchlists = {"我的自選股": []}
+         st.session_state.bot_config = merge_bot_config({})
+         st.session_state.trade_log = []
+         
+    if st.session_state.get('active_list') not in st.session_state.watchlists:
+        st.session_state.active_list = list(st.session_state.watchlists.keys())[0] if st.session_state.watchlists else "我的自選股"
 
 # --- Entry Point ---
 if st.session_state.get('logged_in'):
     # Initialize User Data if first load for this user
     if "data_loaded_user" not in st.session_state or st.session_state.data_loaded_user != st.session_state.username:
-        data = load_data(st.session_state.username)
-        # Restore State Logic (Simplified copy from old init)
-        st.session_state.broker = PaperBroker(initial_balance=10000000) # Reset then load
-        
-        if data:
-            st.session_state.broker.restore_state(
-                data.get("balance", 10000000), 
-                data.get("inventory", {}), 
-                data.get("transaction_history", [])
-            )
-            st.session_state.watchlists = data.get("watchlists", {
-                "我的自選股": ["2330.TW", "2317.TW"], 
-                "高股息": ["0056.TW", "00878.TW"]
-            })
-            st.session_state.trade_log = data.get("trade_log", [])
-            # Config Merge
-            loaded_conf = data.get("bot_config", {})
-            default_conf = {"targets": [], "cap_limit_per_stock": 1000000, "strategies": {}, "sl_pct": 10.0, "tp_pct": 20.0, "buy_qty": {}}
-            if not loaded_conf: loaded_conf = default_conf
-            else:
-                 for k, v in default_conf.items():
-                     if k not in loaded_conf: loaded_conf[k] = v
-                 if 'buy_qty' not in loaded_conf: loaded_conf['buy_qty'] = {}
-            st.session_state.bot_config = loaded_conf
-        else:
-             # Fresh User Defaults
-             st.session_state.watchlists = {"我的自選股": []}
-             st.session_state.bot_config = {"targets": [], "cap_limit_per_stock": 1000000, "strategies": {}, "sl_pct": 10.0, "tp_pct": 20.0, "buy_qty": {}}
-             st.session_state.trade_log = []
-             
-        st.session_state.active_list = list(st.session_state.watchlists.keys())[0] if st.session_state.watchlists else "我的自選股"
+        load_user_state(st.session_state.username)
         st.session_state.data_loaded_user = st.session_state.username
 
-    main_app()
+    with span("page.render"):
+        main_app()
+    metrics.export(min_interval=30)
 else:
     render_login_ui()
@@ -1,10 +1,18 @@
 import json
 import os
 import hashlib
+import threading
+import time
 import streamlit as st
+import sqlite_store
 
 USER_DB_FILE = "users.json"
 
+# Seconds before the cached cloud user list is refetched
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+# Unknown usernames (e.g. registered on another instance) refetch at most this often
+USER_MISS_REFRESH = float(os.environ.get("USER_MISS_REFRESH", "10"))
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -21,52 +29,115 @@ def save_users(users):
     with open(USER_DB_FILE, "w", encoding='utf-8') as f:
         json.dump(users, f)
 
+class UserDirectory:
+    """
+    In-process username -> password hash lookup for login and registration.
+    The cloud Users sheet is fetched only when the cached copy is older than
+    `ttl` (or, for an unknown username, `miss_refresh`); users.json is reread
+    only when the file changes. Registrations are written through to both.
+    """
+    def __init__(self, sheet_name="Stock_Bot_Log", ttl=USER_CACHE_TTL, miss_refresh=USER_MISS_REFRESH):
+        self.sheet_name = sheet_name
+        self.ttl = ttl
+        self.miss_refresh = miss_refresh
+        self._cloud = None      # {username: hash} from the last fetch
+        self._cloud_at = 0.0
+        self._local = {}
+        self._local_stamp = None # (mtime_ns, size) of users.json when read
+        self._lock = threading.Lock()
+
+    def _cloud_users(self, username):
+        # Called with self._lock held
+        age = time.time() - self._cloud_at
+        if self._cloud is None or age >= self.ttl or (username not in self._cloud and age >= self.miss_refresh):
+            try:
+                from gsheet_handler import gsheet_logger
+                users = gsheet_logger.fetch_all_users(self.sheet_name)
+            except Exception as e:
+                print(f"Cloud Login Error: {e}")
+                users = {}
+            # fetch_all_users returns {} on errors: keep the last good copy, retry later
+            if users or self._cloud is None:
+                self._cloud = users
+            self._cloud_at = time.time()
+        return self._cloud
+
+    def _local_users(self):
+        # Called with self._lock held
+        try:
+            st_ = os.stat(USER_DB_FILE)
+            stamp = (st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            self._local, self._local_stamp = {}, None
+            return self._local
+        if stamp != self._local_stamp:
+            self._local, self._local_stamp = load_users(), stamp
+        return self._local
+
+    def lookup(self, username):
+        """Returns (cloud_hash, local_hash); None where the user is unknown."""
+        with self._lock:
+            return self._cloud_users(username).get(username), self._local_users().get(username)
+
+    def local_users(self):
+        with self._lock:
+            return dict(self._local_users())
+
+    def add(self, username, password_hash, cloud=False):
+        """Write-through after a successful registration (local file always, cloud if it was written)."""
+        with self._lock:
+            self._local_users()[username] = password_hash
+            if cloud and self._cloud is not None:
+                self._cloud[username] = password_hash
+
+    def invalidate(self):
+        with self._lock:
+            self._cloud, self._cloud_at = None, 0.0
+            self._local, self._local_stamp = {}, None
+
+# Global Instance
+user_directory = UserDirectory()
+
 def login_user(username, password):
-    # 1. Try Cloud Auth
-    try:
-        from gsheet_handler import gsheet_logger
-        cloud_users = gsheet_logger.fetch_all_users("Stock_Bot_Log")
-        if username in cloud_users:
-            if cloud_users[username] == hash_password(password):
-                return True
-    except Exception as e:
-        print(f"Cloud Login Error: {e}")
+    # Local database mode (no cloud / users.json)
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        return sqlite_store.get_store().get_password_hash(username) == hash_password(password)
 
-    # 2. Local Fallback
-    users = load_users()
-    if username in users:
-        if users[username] == hash_password(password):
-            return True
-    return False
+    # Cloud first, users.json as fallback
+    cloud_hash, local_hash = user_directory.lookup(username)
+    hashed = hash_password(password)
+    return hashed == cloud_hash or hashed == local_hash
 
 def register_user(username, password):
-    # Check Cloud Dupes
-    try:
-        from gsheet_handler import gsheet_logger
-        cloud_users = gsheet_logger.fetch_all_users("Stock_Bot_Log")
-        if username in cloud_users:
-             return False, "帳號已存在的 (Cloud)"
-    except:
-        pass
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        if not sqlite_store.get_store().add_user(username, hash_password(password)):
+            return False, "帳號已存在的 (Local)"
+        return True, "註冊成功，請登入"
 
-    # Check Local Dupes
-    users = load_users()
-    if username in users:
+    # Check Cloud / Local Dupes
+    cloud_hash, local_hash = user_directory.lookup(username)
+    if cloud_hash is not None:
+        return False, "帳號已存在的 (Cloud)"
+    if local_hash is not None:
         return False, "帳號已存在的 (Local)"
     
     hashed = hash_password(password)
     
     # Save Local (Backup)
+    users = user_directory.local_users()
     users[username] = hashed
     save_users(users)
     
     # Save Cloud (Primary)
+    cloud_ok = False
     try:
-        gsheet_logger.register_user_db("Stock_Bot_Log", username, hashed)
+        from gsheet_handler import gsheet_logger
+        cloud_ok = gsheet_logger.register_user_db("Stock_Bot_Log", username, hashed)
         # Also log event (Old method, can keep or remove, keeping for history)
         # gsheet_logger.log_user("Stock_Bot_Log", username) 
     except Exception as e:
         print(f"Cloud Register Error: {e}")
+    user_directory.add(username, hashed, cloud=cloud_ok)
         
     return True, "註冊成功，請登入"
 
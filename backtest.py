@@ -1,16 +1,21 @@
 import pandas as pd
 import numpy as np
-from strategy import calculate_indicators, get_signal
+from strategy import calculate_indicators, get_signal, get_signals
 
 class BacktestEngine:
     def __init__(self, initial_capital=1000000.0):
         self.initial_capital = initial_capital
     
-    def run_backtest(self, df, strategy_type="MA_Cross"):
+    def run_backtest(self, df, strategy_type="MA_Cross", vectorized=False, params=None):
         """
         df: Raw DataFrame (OHLCV).
         strategy_type: Name of strategy to test.
+        vectorized: Use the array engine (same results, much faster on long histories).
+        params: Strategy thresholds overriding strategy.DEFAULT_PARAMS.
         """
+        if vectorized:
+            return self.run_backtest_vectorized(df, strategy_type, params)
+            
         # 1. Calc Indicators
         df = calculate_indicators(df.copy())
         
@@ -38,7 +43,7 @@ class BacktestEngine:
             close_price = curr_row['Close']
             
             # --- Get Signal ---
-            signal = get_signal(curr_row, prev_row, strategy_type)
+            signal = get_signal(curr_row, prev_row, strategy_type, params)
             
             # --- Execution ---
             # Simplified Execution: Buy Max / Sell All
@@ -107,6 +112,91 @@ class BacktestEngine:
         
         return equity_df, trade_df
 
+    def run_backtest_vectorized(self, df, strategy_type="MA_Cross", params=None):
+        """
+        Array version of run_backtest() with identical equity_df / trade_df.
+        Signals come from get_signals() for the whole series; the position can
+        only change on signal bars, so only those are walked (same fill and fee
+        arithmetic as the loop), and the equity curve is built with array ops.
+        """
+        df = calculate_indicators(df.copy())
+        df = df.sort_index()
+        
+        start_idx = 30
+        if len(df) < start_idx:
+            return pd.Series(), pd.DataFrame()
+            
+        signals = get_signals(df, strategy_type, params)
+        return self.run_signals(df.index[start_idx:], df['Close'].to_numpy(dtype=float)[start_idx:], signals[start_idx:])
+    
+    def run_signals(self, dates, close, signals):
+        """
+        Simulates a precomputed signal array (1 / -1 / 0 per bar) on `close`.
+        Returns (equity_df, trade_df) in the same format as run_backtest().
+        """
+        cash = self.initial_capital
+        inventory = 0
+        
+        fill_idx = []    # bar positions where the position changed
+        fill_cash = []   # cash after each fill
+        fill_inv = []    # shares held after each fill
+        trade_log = []
+        
+        for i in np.flatnonzero(signals):
+            close_price = close[i]
+            action = None
+            fee = 0
+            tax = 0
+            
+            if signals[i] == 1 and inventory == 0:
+                max_mv = cash * 0.99
+                if close_price > 0:
+                    shares = int(max_mv // close_price // 1000) * 1000
+                    if shares > 0:
+                        cost = shares * close_price
+                        fee = max(int(cost * 0.001425), 20)
+                        total_cost = cost + fee
+                        if cash >= total_cost:
+                            cash -= total_cost
+                            inventory += shares
+                            action = "BUY"
+                            qty_traded = shares
+                            
+            elif signals[i] == -1 and inventory > 0:
+                revenue = inventory * close_price
+                fee = max(int(revenue * 0.001425), 20)
+                tax = int(revenue * 0.003)
+                cash += revenue - fee - tax
+                action = "SELL"
+                qty_traded = inventory
+                inventory = 0
+                
+            if action:
+                fill_idx.append(i)
+                fill_cash.append(cash)
+                fill_inv.append(inventory)
+                trade_log.append({
+                    "Date": dates[i],
+                    "Action": action,
+                    "Price": close_price,
+                    "Qty": qty_traded,
+                    "Fee": fee,
+                    "Tax": tax,
+                    "Cash": cash,
+                    "Equity": cash + inventory * close_price
+                })
+        
+        # Cash / shares are step functions that change only at fills
+        seg = np.searchsorted(np.array(fill_idx, dtype=int), np.arange(len(dates)), side='right') - 1
+        cash_path = np.append(np.array(fill_cash, dtype=float), self.initial_capital)[seg]
+        inv_path = np.append(np.array(fill_inv, dtype=np.int64), 0)[seg]
+        equity = cash_path + inv_path * close
+        
+        equity_df = pd.DataFrame({"Equity": equity}, index=pd.DatetimeIndex(dates, freq=None, name="Date"))
+        trade_df = pd.DataFrame(trade_log)
+        
+        return equity_df, trade_df
+
     def calculate_kpis(self, equity_df, trade_df):
         if equity_df.empty:
             return {
@@ -0,0 +1,271 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import datetime
+import numpy as np
+import pandas as pd
+from trading_calendar import is_data_settled
+
+# Columnar on-disk cache of OHLCV bars, one file per (ticker, interval).
+# get_stock_data() reads from here and only asks yfinance for the bars
+# after the last stored timestamp (plus one settled bar of overlap). yfinance
+# prices are adjusted back in time after a dividend or split: when the
+# overlap no longer matches the stored bar the whole history is downloaded again.
+
+STORE_DIR = os.environ.get("BAR_STORE_DIR", os.path.join("data_cache", "bars"))
+
+# yfinance refuses intraday requests further back than these limits
+INTRADAY_MAX_DAYS = {
+    "1m": 7,
+    "2m": 60, "5m": 60, "15m": 60, "30m": 60, "90m": 60,
+    "60m": 730, "1h": 730,
+}
+
+try:
+    import pyarrow  # noqa: F401 (needed by DataFrame.to_parquet)
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+
+def period_to_offset(period):
+    """
+    Converts a yfinance period string ("5d", "6mo", "2y", "ytd", "max")
+    into a pandas offset. Returns None for "max".
+    """
+    if period in (None, "max"):
+        return None
+    if period == "ytd":
+        today = datetime.date.today()
+        return pd.Timedelta(days=today.timetuple().tm_yday)
+    m = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if not m:
+        raise ValueError(f"Unknown period: {period}")
+    n, unit = int(m.group(1)), m.group(2)
+    if unit == "d": return pd.Timedelta(days=n)
+    if unit == "wk": return pd.Timedelta(weeks=n)
+    if unit == "mo": return pd.DateOffset(months=n)
+    return pd.DateOffset(years=n)
+
+
+def period_days(period):
+    """Approximate length of a period in days (for coverage comparisons)."""
+    off = period_to_offset(period)
+    if off is None:
+        return float("inf")
+    base = pd.Timestamp("2000-01-01")
+    return ((base + off) - base).days
+
+
+def clamp_period(period, interval):
+    """Limits an intraday period to what yfinance can serve for that interval."""
+    max_days = INTRADAY_MAX_DAYS.get(interval)
+    if max_days is not None and period_days(period) > max_days:
+        return f"{max_days}d"
+    return period
+
+
+def slice_period(df, period):
+    """
+    Returns the tail of df covering `period`.
+    Day periods ("1d", "5d") count trading sessions like yfinance does,
+    longer periods are measured back from now.
+    """
+    if df.empty or period in (None, "max"):
+        return df
+    m = re.fullmatch(r"(\d+)d", period)
+    if m:
+        dates = pd.Index(df.index.date)
+        keep = dates.unique()[-int(m.group(1)):]
+        return df[dates.isin(keep)]
+    now = pd.Timestamp.now(tz=df.index.tz)
+    return df[df.index >= now - period_to_offset(period)]
+
+
+class BarStore:
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    # --- Paths & Locks ---
+    def _key(self, ticker, interval):
+        return re.sub(r"[^A-Za-z0-9._-]", "_", f"{ticker}_{interval}")
+
+    def _data_path(self, ticker, interval):
+        ext = "parquet" if HAS_PARQUET else "pkl"
+        return os.path.join(self.store_dir, f"{self._key(ticker, interval)}.{ext}")
+
+    def _meta_path(self, ticker, interval):
+        return os.path.join(self.store_dir, f"{self._key(ticker, interval)}.meta.json")
+
+    def _lock(self, ticker, interval):
+        key = self._key(ticker, interval)
+        with self._locks_guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    # --- Raw IO ---
+    def load(self, ticker, interval):
+        path = self._data_path(ticker, interval)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        try:
+            if HAS_PARQUET:
+                return pd.read_parquet(path)
+            return pd.read_pickle(path)
+        except Exception as e:
+            print(f"Bar Store Read Error {ticker} {interval}: {e}")
+            return pd.DataFrame()
+
+    def load_meta(self, ticker, interval):
+        path = self._meta_path(ticker, interval)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def save(self, ticker, interval, df, meta):
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self._data_path(ticker, interval)
+        # Write then rename so readers never see a half-written file; unique
+        # temp names since several processes may save the same ticker
+        fd, tmp = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            if HAS_PARQUET:
+                df.to_parquet(tmp)
+            else:
+                df.to_pickle(tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        fd, tmp = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, self._meta_path(ticker, interval))
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    # --- Incremental Sync ---
+    def _plan(self, ticker, interval, period, now):
+        """
+        What sync() has to download: (stored, covered, request), request being
+        None (up to date), {"period": ...} (full) or {"start": ...} (incremental).
+        """
+        stored = self.load(ticker, interval)
+        meta = self.load_meta(ticker, interval)
+
+        covered = meta.get("period")
+        need_full = stored.empty or covered is None or period_days(period) > period_days(covered)
+
+        # Intraday history too old to be continued from the last bar
+        max_days = INTRADAY_MAX_DAYS.get(interval)
+        if not need_full and max_days is not None:
+            if (now - stored.index[-1]).days >= max_days:
+                need_full = True
+
+        # Nothing can have changed since the last fetch (market closed and settled)
+        fetched_at = meta.get("fetched_at")
+        if not need_full and fetched_at and is_data_settled(datetime.datetime.fromisoformat(fetched_at)):
+            return stored, covered, None
+
+        if need_full:
+            covered = period if covered is None else max(covered, period, key=period_days)
+            return stored, covered, {"period": clamp_period(period, interval)}
+        # Re-fetch from the day of the bar before the last one: the last bar may
+        # still be forming, the one before it is the settled overlap to compare
+        start = stored.index[max(0, len(stored) - 2)]
+        return stored, covered, {"start": start.tz_convert("Asia/Taipei").date()}
+
+    @staticmethod
+    def _history_changed(stored, fresh):
+        """True if re-fetched bars disagree with settled stored ones (prices adjusted since)."""
+        overlap = stored.index[:-1].intersection(fresh.index)
+        cols = [c for c in ("Open", "High", "Low", "Close") if c in stored.columns and c in fresh.columns]
+        if overlap.empty or not cols:
+            return False
+        return not np.allclose(stored.loc[overlap, cols].to_numpy(dtype=float),
+                               fresh.loc[overlap, cols].to_numpy(dtype=float), rtol=1e-6, equal_nan=True)
+
+    def _merge(self, ticker, interval, period, stored, covered, fresh, now):
+        merged = stored
+        if not fresh.empty:
+            merged = pd.concat([stored, fresh]) if not stored.empty else fresh
+            merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+        if not merged.empty:
+            try:
+                self.save(ticker, interval, merged, {"period": covered, "fetched_at": now.isoformat()})
+            except Exception as e:
+                print(f"Bar Store Write Error {ticker} {interval}: {e}")
+
+        return slice_period(merged, period).copy()
+
+    def sync(self, ticker, interval, period, fetch):
+        """
+        Brings the stored bars for (ticker, interval) up to date and returns
+        the slice covering `period`.
+        fetch(period=..., start=...) downloads bars from yfinance; it is called
+        with `period` for a full download and with `start` for an incremental one.
+        """
+        with self._lock(ticker, interval):
+            now = pd.Timestamp.now(tz="Asia/Taipei")
+            stored, covered, request = self._plan(ticker, interval, period, now)
+            if request is None:
+                return slice_period(stored, period).copy()
+            fresh = fetch(**request)
+            if "start" in request and self._history_changed(stored, fresh):
+                stored, fresh = pd.DataFrame(), fetch(period=clamp_period(covered, interval))
+            return self._merge(ticker, interval, period, stored, covered, fresh, now)
+
+    def sync_many(self, tickers, interval, period, fetch_many):
+        """
+        sync() for many tickers with at most two downloads: one for every ticker
+        needing a full download and one, from the earliest start, for every
+        incremental one. fetch_many(tickers, period=..., start=...) returns
+        {ticker: DataFrame}. Returns {ticker: bars covering `period`}.
+        """
+        now = pd.Timestamp.now(tz="Asia/Taipei")
+        plans = {}
+        for t in tickers:
+            with self._lock(t, interval):
+                plans[t] = self._plan(t, interval, period, now)
+
+        full = [t for t, (_, _, req) in plans.items() if req and "period" in req]
+        incremental = [t for t, (_, _, req) in plans.items() if req and "start" in req]
+        fresh = {}
+        if full:
+            fresh.update(fetch_many(full, period=clamp_period(period, interval)))
+        if incremental:
+            # Extra overlap bars for the others are dropped as duplicates
+            fresh.update(fetch_many(incremental, start=min(plans[t][2]["start"] for t in incremental)))
+            # Adjusted since the last sync: download their whole history again
+            adjusted = [t for t in incremental if self._history_changed(plans[t][0], fresh.get(t, pd.DataFrame()))]
+            if adjusted:
+                covered = max((plans[t][1] for t in adjusted), key=period_days)
+                fresh.update(fetch_many(adjusted, period=clamp_period(covered, interval)))
+                for t in adjusted:
+                    plans[t] = (pd.DataFrame(), covered, plans[t][2])
+
+        out = {}
+        for t, (stored, covered, request) in plans.items():
+            if request is None:
+                out[t] = slice_period(stored, period).copy()
+                continue
+            with self._lock(t, interval):
+                out[t] = self._merge(t, interval, period, stored, covered, fresh.get(t, pd.DataFrame()), now)
+        return out
+
+# Global Instance
+bar_store = BarStore()
@@ -0,0 +1,174 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# Batch AI prediction scan (XGBoost + LSTM + Prophet per ticker) spread over
+# worker processes. Each worker gets a fixed share of the cores: its BLAS,
+# OpenMP (XGBoost) and TensorFlow thread pools are capped at
+# threads_per_worker, so N workers never run N x cores threads.
+# Results stream back as each ticker finishes (completion order, not input
+# order); the models themselves come from the on-disk model registry, which
+# all workers share. Inputs common to every ticker (^VIX) are fetched once
+# here and handed to the workers.
+#
+# Usage: python batch_predict.py 2330.TW 2317.TW [--years 2] [--days 5] [--workers 4]
+#
+# The heavy libraries (numpy, tensorflow, prophet...) are only imported
+# inside the workers, after _init_worker has set the thread limits.
+
+PREDICT_WORKERS = int(os.environ.get("PREDICT_WORKERS", "0")) # 0 = one per core
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "TF_NUM_INTRAOP_THREADS")
+
+
+def plan_workers(n_tickers, workers=PREDICT_WORKERS, cpus=None):
+    """(worker processes, threads per worker) for a scan of n_tickers."""
+    cpus = cpus or os.cpu_count() or 1
+    workers = min(workers or cpus, cpus, n_tickers)
+    return max(1, workers), max(1, cpus // max(1, workers))
+
+
+def _init_worker(threads):
+    """Process pool initializer: caps every library thread pool at `threads`."""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    try:
+        # BLAS pools already loaded (numpy imported before the env was set)
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except Exception as e:
+        print(f"Predict Worker Thread Limit Error: {e}")
+    import xgboost as xgb
+    xgb.set_config(nthread=threads)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def fetch_vix(lookback_years=2):
+    """^VIX bars for the whole batch (an empty frame if unavailable)."""
+    import pandas as pd
+    try:
+        from utils import get_stock_data
+        return get_stock_data("^VIX", period=f"{lookback_years}y")
+    except Exception as e:
+        print(f"VIX Fetch Error: {e}")
+        return pd.DataFrame()
+
+
+def predict_ticker(ticker, lookback_years=2, forecast_days=5, vix=None):
+    """
+    Full AI prediction for one ticker (runs in a worker process).
+    vix: fetch_vix() result shared by the batch (fetched per ticker if None).
+    Returns a picklable dict: T+1..T+forecast_days prices of each model, their
+    errors and backtests, the Prophet model as JSON, and the registry status
+    of each model. {"ticker", "error"} if the ticker could not be analyzed.
+    """
+    t0 = time.perf_counter()
+    try:
+        import pandas as pd
+        from prophet.serialize import model_to_json
+        from prediction_engine import prepare_data, cached_xgboost_multi, cached_lstm, cached_prophet, XGB_FEATURES
+
+        # 1. Data Prep
+        feature_df = prepare_data(ticker, period=f"{lookback_years}y", vix=vix)
+        if not isinstance(feature_df, pd.DataFrame) or feature_df.empty:
+            return {"ticker": ticker, "error": "no data", "seconds": time.perf_counter() - t0}
+
+        # 2. XGBoost (one model for all horizons)
+        model_x, results_x, scores_x, f_imp_x, status_x = cached_xgboost_multi(
+            ticker, feature_df, forecast_days=forecast_days, features=XGB_FEATURES)
+        next_preds = model_x.predict(feature_df.iloc[-1:][XGB_FEATURES])[0]
+        xgb_predictions = [{"Day": f"T+{d}", "Price": float(next_preds[d - 1]),
+                            "Conf": max(0, 100 * (1 - scores_x[d]['mape'])), "MAE": scores_x[d]['mae']}
+                           for d in range(1, forecast_days + 1)]
+
+        # 3. LSTM
+        _, results_l, mae_l, _, mape_l, future_prices_l, history_l, status_l = cached_lstm(
+            ticker, feature_df, forecast_days=forecast_days, seq_length=60, epochs=10)
+
+        # 4. Prophet
+        prophet_forecast, future_prices_p, model_p, mae_p, status_p = cached_prophet(
+            ticker, feature_df, forecast_days=forecast_days)
+
+        return {
+            "ticker": ticker,
+            "last_close": float(feature_df['Close'].iloc[-1]),
+            "last_date": feature_df.index[-1],
+            "history": feature_df['Close'].iloc[-90:],
+            "xgb_predictions": xgb_predictions,
+            "f_imp": f_imp_x,
+            "mape_x": scores_x[forecast_days]['mape'],
+            "backtest_xgb": results_x[1],
+            "future_prices_l": [float(p) for p in future_prices_l],
+            "mae_l": mae_l,
+            "mape_l": mape_l,
+            "loss_history": history_l.history['loss'] if history_l else [],
+            "backtest_lstm": results_l,
+            "future_prices_p": [float(p) for p in future_prices_p],
+            "mae_p": mae_p,
+            "prophet_forecast": prophet_forecast,
+            "prophet_model_json": model_to_json(model_p),
+            "registry": {"xgboost_multi": status_x, "lstm": status_l, "prophet": status_p},
+            "seconds": time.perf_counter() - t0,
+        }
+    except Exception as e:
+        return {"ticker": ticker, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - t0}
+
+
+def run_batch(tickers, lookback_years=2, forecast_days=5, workers=PREDICT_WORKERS, threads_per_worker=None):
+    """
+    Yields predict_ticker() results as each ticker finishes.
+    One worker (a single ticker, or a single core) runs in this process;
+    otherwise a spawned process pool of plan_workers() size is used.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return
+    n_workers, threads = plan_workers(len(tickers), workers)
+    threads = threads_per_worker or threads
+    vix = fetch_vix(lookback_years)
+    if n_workers == 1:
+        for ticker in tickers:
+            yield predict_ticker(ticker, lookback_years, forecast_days, vix)
+        return
+
+    # spawn: forking a process that already runs threads (Streamlit, TensorFlow) is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                               initializer=_init_worker, initargs=(threads,))
+    try:
+        futures = {pool.submit(predict_ticker, t, lookback_years, forecast_days, vix): t for t in tickers}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory): its ticker and the unfinished ones fail
+                yield {"ticker": futures[future], "error": f"worker crashed: {e}", "seconds": 0.0}
+    finally:
+        # Also reached when the consumer stops early (e.g. a Streamlit rerun): drop queued tickers
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tickers", nargs="+")
+    parser.add_argument("--years", type=int, default=2, help="training data (years)")
+    parser.add_argument("--days", type=int, default=5, help="forecast days")
+    parser.add_argument("--workers", type=int, default=PREDICT_WORKERS, help="worker processes (0 = one per core)")
+    args = parser.parse_args()
+
+    started = time.time()
+    for res in run_batch(args.tickers, args.years, args.days, args.workers):
+        if "error" in res:
+            print(f"{res['ticker']}: ERROR {res['error']}")
+            continue
+        t1 = (res["xgb_predictions"][0]["Price"] + res["future_prices_l"][0] + res["future_prices_p"][0]) / 3
+        print(f"{res['ticker']}: close {res['last_close']:.2f} -> T+1 {t1:.2f} "
+              f"({(t1 / res['last_close'] - 1) * 100:+.2f}%) in {res['seconds']:.1f}s {res['registry']}")
+    print(f"Done in {time.time() - started:.1f}s")
@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Add parent dir to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from strategy import calculate_indicators, calculate_kd
+
+def make_minute_frame(years, seed=0):
+    """Synthetic 1-minute OHLCV bars: ~245 sessions/year x 270 bars/session."""
+    n = int(years * 245 * 270)
+    rng = np.random.default_rng(seed)
+    close = 500 + np.cumsum(rng.normal(0, 0.5, n))
+    spread = rng.uniform(0.1, 1.0, n)
+    idx = pd.date_range("2020-01-01 09:00", periods=n, freq="min", tz="Asia/Taipei")
+    return pd.DataFrame({
+        'Open': close + rng.normal(0, 0.2, n),
+        'High': close + spread,
+        'Low': close - spread,
+        'Close': close,
+        'Volume': rng.integers(1, 500, n)
+    }, index=idx)
+
+def kd_loop(df):
+    """The original per-row K/D loop from strategy.calculate_indicators."""
+    k_list = []
+    d_list = []
+    k = 50
+    d = 50
+    for rsv in df['RSV']:
+        if pd.isna(rsv):
+            k_list.append(50)
+            d_list.append(50)
+        else:
+            k = (2/3) * k + (1/3) * rsv
+            d = (2/3) * d + (1/3) * k
+            k_list.append(k)
+            d_list.append(d)
+    return np.array(k_list, dtype=float), np.array(d_list, dtype=float)
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+if __name__ == "__main__":
+    print("--- KD Benchmark: vectorized calculate_indicators vs per-row loop ---")
+    for years in (1, 3, 5):
+        df = make_minute_frame(years)
+        t_full, ind = timed(lambda: calculate_indicators(df.copy()))
+        t_loop, (k_ref, d_ref) = timed(lambda: kd_loop(ind), repeat=1)
+
+        # Time only the KD part of the new implementation
+        rsv = ind['RSV'].to_numpy(dtype=float)
+        t_vec, _ = timed(lambda: calculate_kd(rsv))
+
+        err = max(np.abs(ind['K'].to_numpy() - k_ref).max(), np.abs(ind['D'].to_numpy() - d_ref).max())
+        print(f"{years}y 1m ({len(df):,} rows): KD loop {t_loop*1000:8.1f} ms | KD vectorized {t_vec*1000:6.1f} ms "
+              f"| speedup {t_loop/t_vec:5.1f}x | all indicators {t_full*1000:7.1f} ms | max diff {err:.1e}")
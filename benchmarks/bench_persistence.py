@@ -0,0 +1,124 @@
+import sys
+import os
+import json
+import time
+import datetime
+import tempfile
+import argparse
+
+# Add parent dir to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Persistence / trade-log benchmark against the offline Sheets backend.
+# Usage: python benchmarks/bench_persistence.py [--latency 0.1] [--error-rate 0.05]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--latency", type=float, default=0.1, help="seconds per fake API call")
+parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API calls failing with 429")
+parser.add_argument("--trades", type=int, default=200)
+parser.add_argument("--persists", type=int, default=50)
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(prefix="bench_persist_")
+os.environ["GSHEET_BACKEND"] = "fake"
+os.environ["FAKE_GSHEET_DB"] = os.path.join(workdir, "sheets.db")
+os.environ["FAKE_GSHEET_LATENCY"] = str(args.latency)
+os.environ["FAKE_GSHEET_ERROR_RATE"] = str(args.error_rate)
+os.environ["TRADE_LOG_SPOOL"] = os.path.join(workdir, "spool.jsonl")
+os.chdir(workdir) # user_<name>.json files land here
+
+from broker import PaperBroker
+from data_manager import save_data
+from gsheet_handler import gsheet_logger, format_trade_row, TRADE_HEADERS
+from trade_log_queue import trade_log_queue
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# --- The code paths before the write-behind log / journal (for comparison) ---
+def old_log_trade(client, trade_data):
+    """One synchronous log per order: open + header read + append_row."""
+    ws = client.open("Stock_Bot_Log").sheet1
+    if not ws.get_all_values():
+        ws.append_row(TRADE_HEADERS)
+    ws.append_row(format_trade_row(trade_data))
+
+def old_save_data(client, broker, watchlists, trade_log, bot_config, username):
+    """Full state every time: the whole JSON file + find / update_cell upsert of the whole state."""
+    data = {"balance": broker.balance, "inventory": broker.inventory,
+            "transaction_history": broker.transaction_history,
+            "watchlists": watchlists, "trade_log": trade_log, "bot_config": bot_config}
+    with open(f"user_{username}.json", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    sh = client.open("Stock_Bot_Log")
+    try:
+        ws = sh.worksheet("UserData")
+    except Exception:
+        ws = sh.add_worksheet(title="UserData", rows=100, cols=5)
+        ws.append_row(["Username", "UpdatedAt", "DataJSON"])
+    json_str = json.dumps(data, ensure_ascii=False)
+    now = str(datetime.datetime.now())
+    cell = ws.find(username, in_column=1)
+    if cell:
+        ws.update_cell(cell.row, 2, now)
+        ws.update_cell(cell.row, 3, json_str)
+    else:
+        ws.append_row([username, now, json_str])
+
+if __name__ == "__main__":
+    print(f"--- Persistence Benchmark (fake Sheets: {args.latency*1000:.0f} ms/call, error rate {args.error_rate:.0%}) ---")
+    gsheet_logger.connect()
+    client = gsheet_logger.client
+
+    # 1. Orders through PaperBroker (trade log is write-behind)
+    broker = PaperBroker(initial_balance=1e12)
+    lat = []
+    calls0 = client.calls
+    t0 = time.perf_counter()
+    for i in range(args.trades):
+        t = time.perf_counter()
+        if i % 2 == 0:
+            broker.buy("2330.TW", 1000.0, 1000)
+        else:
+            broker.sell("2330.TW", 1001.0, 1000)
+        lat.append(time.perf_counter() - t)
+    t_orders = time.perf_counter() - t0
+    while trade_log_queue.pending_count():
+        trade_log_queue.flush(timeout=30)
+    t_drained = time.perf_counter() - t0
+    logged = len(gsheet_logger._worksheet("Stock_Bot_Log").get_all_values()) - 1
+    print(f"Orders: {args.trades / t_orders:10.0f} trades/s | order latency p50 {percentile(lat, 50)*1000:.2f} ms "
+          f"p99 {percentile(lat, 99)*1000:.2f} ms")
+    print(f"Sheet log: {logged}/{args.trades} rows in {t_drained:.2f}s ({logged / t_drained:.0f} rows/s) "
+          f"| API calls {client.calls - calls0}")
+
+    # 2. Old synchronous path for comparison (one uncached log per order, see old_log_trade)
+    n_sync = min(args.trades, 20)
+    calls0 = client.calls
+    t0 = time.perf_counter()
+    for i in range(n_sync):
+        old_log_trade(client, {"symbol": "2330.TW", "action": "現股買進", "price": 1000, "qty": 1000})
+    t_sync = time.perf_counter() - t0
+    print(f"Old synchronous log: {n_sync / t_sync:8.1f} trades/s | {(client.calls - calls0) / n_sync:.1f} API calls/trade")
+
+    # 3. A persist after each fill: old full-state save vs save_data (local journal/snapshot + cloud journal)
+    history = len(broker.transaction_history)
+    for label, persist, username in (
+            ("Old full-state save", lambda b: old_save_data(client, b, {"自選股1": ["2330.TW"]}, [], {"targets": ["2330.TW"]}, "bench_old"), "bench_old"),
+            ("save_data", lambda b: save_data(b, {"自選股1": ["2330.TW"]}, [], {"targets": ["2330.TW"]}, username="bench"), "bench")):
+        # Same starting history for both runs
+        b = PaperBroker(initial_balance=1e12)
+        b.restore_state(broker.balance, dict(broker.inventory), list(broker.transaction_history[:history]))
+        calls0 = client.calls
+        t_persist = 0.0
+        for i in range(args.persists):
+            b.buy("2330.TW", 1000.0, 1000) if i % 2 == 0 else b.sell("2330.TW", 1001.0, 1000)
+            t0 = time.perf_counter()
+            persist(b)
+            t_persist += time.perf_counter() - t0
+        local_bytes = sum(os.path.getsize(p) for p in (f"user_{username}.json", f"user_{username}.journal.jsonl") if os.path.exists(p))
+        print(f"{label}: {args.persists / t_persist:8.1f} persists/s | {(client.calls - calls0) / args.persists:.2f} API calls/persist "
+              f"| {len(b.transaction_history)} history rows | local files {local_bytes / 1024:.0f} KiB")
+    while trade_log_queue.pending_count():
+        trade_log_queue.flush(timeout=30)
@@ -0,0 +1,190 @@
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from strategy import get_signal
+from streaming_indicators import indicator_streams
+from instrumentation import span, timed
+from market_hub import market_hub
+
+# One bot scan over a user's targets, shared by the Streamlit page and the
+# headless runner (bot_runner.py): signals from the streaming indicators,
+# stop-loss / take-profit first, then the strategy signal.
+# Bars for all targets come from the shared market hub (one batched download
+# per refresh for all bots) and the signals are computed concurrently; only
+# the order phase touches the broker, serially.
+
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "8"))
+
+DEFAULT_BOT_CONFIG = {"targets": [], "cap_limit_per_stock": 1000000, "strategies": {}, "sl_pct": 10.0, "tp_pct": 20.0, "buy_qty": {}}
+
+
+def merge_bot_config(loaded_conf):
+    """Saved bot_config completed with the defaults."""
+    if not loaded_conf:
+        return dict(DEFAULT_BOT_CONFIG, strategies={}, buy_qty={})
+    for k, v in DEFAULT_BOT_CONFIG.items():
+        if k not in loaded_conf:
+            loaded_conf[k] = v.copy() if isinstance(v, dict) else v
+    return loaded_conf
+
+
+class BarTracker:
+    """
+    Last evaluated bar per (symbol, interval). A target is evaluated again
+    only when its newest bar changed (new timestamp or a revised forming bar),
+    its settings changed (strategy, parameters, SL/TP, cap, buy quantity) or
+    the account changed (its position, the cash balance); otherwise the cycle
+    skips both the indicator update and the signal.
+    """
+    def __init__(self):
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def bar_key(self, symbol, df, bot_config, broker=None):
+        if df.empty:
+            return None
+        settings = {
+            "strategy": bot_config.get('strategies', {}).get(symbol, "MA_Cross"),
+            "params": sorted((bot_config.get('strategy_params', {}).get(symbol) or {}).items()),
+            "buy_qty": bot_config.get('buy_qty', {}).get(symbol),
+            **{k: bot_config.get(k) for k in ('sl_pct', 'tp_pct', 'cap_limit_per_stock')},
+        }
+        account = (broker.inventory.get(symbol), broker.balance) if broker is not None else None
+        return (df.index[-1], float(df['Close'].iloc[-1]), repr(sorted(settings.items())), repr(account))
+
+    def is_new(self, symbol, interval, key):
+        with self._lock:
+            if key is not None and self._seen.get((symbol, interval)) == key:
+                self.skipped += 1
+                return False
+            return True
+
+    def mark(self, symbol, interval, key):
+        with self._lock:
+            self._seen[(symbol, interval)] = key
+
+
+def compute_signal(symbol, df_bot, bot_config, streams=indicator_streams):
+    """
+    Signal phase for one target (no broker access, safe to run in parallel).
+    Returns (signal, close price), or None when there are not enough bars.
+    """
+    strat = bot_config.get('strategies', {}).get(symbol, "MA_Cross")
+    strat_params = bot_config.get('strategy_params', {}).get(symbol)
+    # Incremental indicators: only bars new since the last scan are processed
+    with span("bot.indicators"):
+        last_rows = streams.sync(symbol, "1d", df_bot)
+    if not last_rows:
+        return None
+    curr_row, prev_row = last_rows
+    with span("bot.signal"):
+        sig = get_signal(curr_row, prev_row, strat, strat_params)
+    return sig, float(curr_row['Close'])
+
+
+def apply_signal(broker, symbol, sig, current_price, bot_config):
+    """
+    Order phase for one target: stop-loss / take-profit first, then the
+    strategy signal. Places at most one order; returns its message or None.
+    """
+    cap_limit = bot_config.get('cap_limit_per_stock', 1000000)
+    sl_pct = bot_config.get('sl_pct', 10.0) / 100.0
+    tp_pct = bot_config.get('tp_pct', 20.0) / 100.0
+    strat = bot_config.get('strategies', {}).get(symbol, "MA_Cross")
+
+    inv = broker.inventory.get(symbol, {'qty': 0, 'cost': 0})
+    curr_qty = inv['qty']
+    avg_cost = inv['cost']
+
+    # SL/TP Check
+    if curr_qty != 0:
+        if curr_qty > 0: pnl_pct = (current_price - avg_cost) / avg_cost
+        else: pnl_pct = (avg_cost - current_price) / avg_cost
+
+        if pnl_pct < -sl_pct or pnl_pct > tp_pct:
+            s, m = broker.sell(symbol, current_price, abs(curr_qty), action="現股賣出") if curr_qty > 0 else broker.buy(symbol, current_price, abs(curr_qty), action="融券回補")
+            if s:
+                if pnl_pct < -sl_pct:
+                    return f"🛡️ 觸發停損 ({pnl_pct*100:.1f}%)! 強制平倉 {symbol}: {m}"
+                return f"💰 觸發停利 ({pnl_pct*100:.1f}%)! 強制平倉 {symbol}: {m}"
+
+    # Strategy Signal Check
+    if sig == 1: # Buy
+        custom_qty = bot_config.get('buy_qty', {}).get(symbol, 1000)
+        exposure = curr_qty * current_price
+        if (cap_limit - exposure) > current_price * custom_qty:
+            s, m = broker.buy(symbol, current_price, custom_qty, action="現股買進")
+            if s: return f"🤖 Bot買進 {symbol} ({strat}): {m}"
+    elif sig == -1: # Sell
+        if curr_qty > 0:
+            s, m = broker.sell(symbol, current_price, curr_qty, action="現股賣出")
+            if s: return f"🤖 Bot賣出 {symbol} ({strat}): {m}"
+    return None
+
+
+@timed("bot.cycle")
+def run_bot_cycle(broker, bot_config, trade_log, streams=indicator_streams, fetch_many=market_hub.get_frames,
+                  progress=None, max_workers=BOT_WORKERS, tracker=None):
+    """
+    Scans every target once:
+    1. bars for all targets from the shared market hub (batched download),
+    2. indicators and signals in a thread pool,
+    3. orders applied to the broker one by one, in target order.
+    Executed trades are appended to `trade_log`.
+    progress: optional callback(symbol) called before each target's orders.
+    tracker: optional BarTracker; targets whose last bar was already evaluated are skipped.
+    Returns the list of trade messages.
+    """
+    targets = list(dict.fromkeys(bot_config.get('targets', [])))
+    if not targets:
+        return []
+    try:
+        with span("bot.fetch"):
+            frames = fetch_many(targets, period="6mo")
+    except Exception as e:
+        print(f"Bot Fetch Error: {e}")
+        return []
+
+    keys = {}
+    if tracker is not None:
+        for symbol in targets:
+            keys[symbol] = tracker.bar_key(symbol, frames.get(symbol, pd.DataFrame()), bot_config, broker)
+        targets = [s for s in targets if tracker.is_new(s, "1d", keys[s])]
+        if not targets:
+            return [] # No new bars since the last cycle
+
+    def _signal(symbol):
+        try:
+            return compute_signal(symbol, frames.get(symbol, pd.DataFrame()), bot_config, streams)
+        except Exception as e:
+            print(f"Bot Error {symbol}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets)))) as pool:
+        signals = list(pool.map(_signal, targets)) # Results in target order
+
+    msgs = []
+    for symbol, result in zip(targets, signals):
+        if progress:
+            progress(symbol)
+        if result is None:
+            continue
+        try:
+            with span("bot.order"):
+                msg = apply_signal(broker, symbol, *result, bot_config)
+        except Exception as e:
+            print(f"Bot Error {symbol}: {e}")
+            continue
+        if msg:
+            trade_log.append(f"[{datetime.datetime.now()}] {msg}")
+            msgs.append(msg)
+
+    if tracker is not None:
+        # Keyed on the account after this cycle's orders: the next fill / deposit re-evaluates
+        for symbol in targets:
+            if keys[symbol] is not None:
+                tracker.mark(symbol, "1d", tracker.bar_key(symbol, frames[symbol], bot_config, broker))
+    return msgs
@@ -0,0 +1,121 @@
+import json
+import os
+import time
+import uuid
+from urllib.parse import quote, unquote
+
+# Command channel from the Streamlit sessions to the headless bot runner.
+# While a runner is live it is the only writer of the users' saved state:
+# a session does not save, it drops a command here (one JSON file per
+# command, per user directory) and waits for the runner's reply.
+#   {"op": "trade", "side": "buy" | "sell", "symbol", "price", "qty", "action"}
+#   {"op": "edit", "entry": data_manager.pending_edits(...)}
+# Replies are {"ok": bool, "msg": str}.
+# The runner claims a command (.cmd.json -> .run.json) before applying it,
+# so a session that stops waiting can still cancel it if it was not claimed.
+# Trades older than TRADE_TTL are rejected, never filled at a stale price.
+
+INBOX_DIR = os.environ.get("BOT_INBOX_DIR", os.path.join("data_cache", "bot_inbox"))
+REPLY_TIMEOUT = float(os.environ.get("BOT_INBOX_TIMEOUT", "10"))
+STALE_REPLY = 600 # Seconds before an uncollected reply (session gone) is deleted
+TRADE_TTL = float(os.environ.get("BOT_INBOX_TRADE_TTL", str(REPLY_TIMEOUT)))
+
+
+class BotInbox:
+    def __init__(self, inbox_dir=INBOX_DIR):
+        self.inbox_dir = inbox_dir
+
+    def _user_dir(self, username):
+        return os.path.join(self.inbox_dir, quote(username, safe=""))
+
+    def _write(self, path, obj):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    # --- Session side ---
+    def submit(self, username, command):
+        """Queues a command for the runner; returns its id."""
+        d = self._user_dir(username)
+        os.makedirs(d, exist_ok=True)
+        # Time-ordered ids: the runner applies a user's commands in submission order
+        cmd_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        self._write(os.path.join(d, f"{cmd_id}.cmd.json"), dict(command, submitted_at=time.time()))
+        return cmd_id
+
+    def cancel(self, username, cmd_id):
+        """Withdraws a command; False if the runner already claimed it (its reply will come)."""
+        try:
+            os.remove(os.path.join(self._user_dir(username), f"{cmd_id}.cmd.json"))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def wait(self, username, cmd_id, timeout=REPLY_TIMEOUT, poll=0.2):
+        """The runner's reply to a command, or None if none came within `timeout`."""
+        path = os.path.join(self._user_dir(username), f"{cmd_id}.res.json")
+        deadline = time.time() + timeout
+        while True:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    reply = json.load(f)
+                os.remove(path)
+                return reply
+            except FileNotFoundError:
+                pass
+            if time.time() >= deadline:
+                return None
+            time.sleep(poll)
+
+    # --- Runner side ---
+    def pending_users(self):
+        if not os.path.isdir(self.inbox_dir):
+            return []
+        return sorted(unquote(name) for name in os.listdir(self.inbox_dir)
+                      if any(f.endswith(".cmd.json") for f in os.listdir(os.path.join(self.inbox_dir, name))))
+
+    def take(self, username, now=None):
+        """
+        Claims the user's waiting commands: [(cmd_id, command)], oldest first.
+        Expired trades are answered with a rejection instead.
+        """
+        d = self._user_dir(username)
+        if not os.path.isdir(d):
+            return []
+        now = time.time() if now is None else now
+        for name in os.listdir(d):
+            path = os.path.join(d, name)
+            if name.endswith((".res.json", ".run.json")) and now - os.path.getmtime(path) > STALE_REPLY:
+                os.remove(path)
+        out = []
+        for name in sorted(f for f in os.listdir(d) if f.endswith(".cmd.json")):
+            cmd_id = name[:-len(".cmd.json")]
+            run_path = os.path.join(d, f"{cmd_id}.run.json")
+            try:
+                os.rename(os.path.join(d, name), run_path)
+            except FileNotFoundError:
+                continue # Cancelled meanwhile
+            try:
+                with open(run_path, "r", encoding="utf-8") as f:
+                    command = json.load(f)
+            except Exception as e:
+                print(f"Bot Inbox Read Error {name}: {e}")
+                self.reply(username, cmd_id, {"ok": False, "msg": "unreadable command"})
+                continue
+            if command.get("op") == "trade" and now - command.get("submitted_at", 0) > TRADE_TTL:
+                self.reply(username, cmd_id, {"ok": False, "msg": "expired"})
+                continue
+            out.append((cmd_id, command))
+        return out
+
+    def reply(self, username, cmd_id, result):
+        """Publishes the result and removes the command."""
+        d = self._user_dir(username)
+        self._write(os.path.join(d, f"{cmd_id}.res.json"), result)
+        try:
+            os.remove(os.path.join(d, f"{cmd_id}.run.json"))
+        except FileNotFoundError:
+            pass
+
+# Global Instance
+bot_inbox = BotInbox()
@@ -0,0 +1,276 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import time
+import sqlite_store
+import trading_calendar as tcal
+from broker import PaperBroker
+from bot_engine import run_bot_cycle, merge_bot_config, BarTracker
+from data_manager import load_data, save_data, state_version, apply_edits, active_bot_users, set_bot_active
+from bot_inbox import bot_inbox
+from instrumentation import metrics, span
+from streaming_indicators import indicator_streams
+from market_hub import market_hub
+
+# Headless bot runner: a long-lived process that scans the targets of every
+# user whose bot is switched on (bot_config['active']) once per interval,
+# independently of any open browser tab. The Streamlit page only edits the
+# config and shows the results; the runner's heartbeat file tells it that
+# the bots are being run here.
+#
+# While it is live the runner is the only writer of its users' saved state:
+# the sessions send manual trades and config edits through bot_inbox, and
+# the runner applies them between scans. Each user's state stays in memory
+# between cycles and is reloaded only when its state_version() changed.
+#
+# Usage: python bot_runner.py [--users alice,bob] [--interval 60] [--once] [--all-hours]
+
+STATUS_PATH = os.environ.get("BOT_RUNNER_STATUS", os.path.join("data_cache", "bot_runner_status.json"))
+BOT_INTERVAL = float(os.environ.get("BOT_RUNNER_INTERVAL", "60"))
+# Stage timings of this process (the Streamlit app writes instrumentation.METRICS_PATH)
+RUNNER_METRICS_PATH = os.environ.get("BOT_RUNNER_METRICS", os.path.join("data_cache", "metrics_bot_runner.txt"))
+INBOX_POLL = 1.0 # Seconds between inbox checks while waiting for the next scan
+
+
+def write_status(status, path=STATUS_PATH):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_status(path=STATUS_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def runner_status(path=STATUS_PATH, now=None):
+    """Status of a live runner (heartbeat within 3 intervals), else None."""
+    status = read_status(path)
+    if not status or status.get("state") == "stopped":
+        return None
+    now = time.time() if now is None else now
+    if now - status.get("heartbeat", 0) > 3 * status.get("interval", BOT_INTERVAL):
+        return None
+    return status
+
+
+def known_users():
+    """Every user with saved state (SQLite users, or local snapshots + cloud users)."""
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        return sorted(sqlite_store.get_store().all_users())
+    users = {os.path.basename(p)[len("user_"):-len(".json")] for p in glob.glob("user_*.json")}
+    try:
+        from gsheet_handler import gsheet_logger
+        users.update(gsheet_logger.fetch_all_users("Stock_Bot_Log"))
+    except Exception as e:
+        print(f"Bot Runner User List Error: {e}")
+    return sorted(users)
+
+
+class BotRunner:
+    def __init__(self, users=None, interval=BOT_INTERVAL, market_hours_only=True,
+                 status_path=STATUS_PATH, hub=market_hub, streams=indicator_streams, inbox=bot_inbox):
+        self.users = users
+        self.interval = interval
+        self.market_hours_only = market_hours_only
+        self.status_path = status_path
+        self.hub = hub
+        self.streams = streams
+        self.inbox = inbox
+        self.cycles = 0
+        self.loads = 0
+        self._user_status = {}
+        self._trackers = {}  # username -> BarTracker (skips targets without a new bar)
+        self._states = {}    # username -> cached state (see _state)
+
+    def _state(self, username):
+        """The user's state, reloaded only if it changed on disk since the last load / save."""
+        version = state_version(username)
+        st = self._states.get(username)
+        if st is not None and version is not None and st["version"] == version:
+            return st
+        data = load_data(username)
+        self.loads += 1
+        if not data:
+            self._states.pop(username, None)
+            return None
+        broker = PaperBroker(initial_balance=10000000)
+        broker.restore_state(data.get("balance", 10000000), data.get("inventory", {}), data.get("transaction_history", []))
+        st = {
+            "broker": broker,
+            "watchlists": data.get("watchlists", {}),
+            "trade_log": data.get("trade_log", []),
+            "bot_config": merge_bot_config(data.get("bot_config", {})),
+            "version": version,
+        }
+        self._states[username] = st
+        return st
+
+    def _save(self, username, st):
+        with span("persist"):
+            save_data(st["broker"], st["watchlists"], st["trade_log"], st["bot_config"], username=username)
+        st["version"] = state_version(username)
+
+    def run_user(self, username):
+        """
+        One cycle for one user: scans the targets and saves if anything was
+        executed. Returns the trade messages, or None if the user's bot is off.
+        """
+        st = self._state(username)
+        if st is None:
+            return None
+        bot_config = st["bot_config"]
+        if not bot_config.get("active"):
+            self.hub.unsubscribe(username)
+            self._states.pop(username, None)
+            self._trackers.pop(username, None)
+            return None
+        self.hub.subscribe(username, bot_config.get("targets", []), period="6mo")
+
+        tracker = self._trackers.setdefault(username, BarTracker())
+        msgs = run_bot_cycle(st["broker"], bot_config, st["trade_log"], self.streams, self.hub.get_frames, tracker=tracker)
+        if msgs:
+            self._save(username, st)
+        return msgs
+
+    def handle_commands(self):
+        """Applies the manual trades / config edits the sessions queued in the inbox."""
+        for username in self.inbox.pending_users():
+            commands = self.inbox.take(username)
+            if not commands:
+                continue
+            try:
+                st = self._state(username)
+                if st is None:
+                    for cmd_id, _ in commands:
+                        self.inbox.reply(username, cmd_id, {"ok": False, "msg": "no saved state"})
+                    continue
+                results = [(cmd_id, self._apply_command(st, cmd)) for cmd_id, cmd in commands]
+                self._save(username, st)
+                if not st["bot_config"].get("active"):
+                    self.hub.unsubscribe(username)
+            except Exception as e:
+                print(f"Bot Runner Command Error {username}: {e}")
+                results = [(cmd_id, {"ok": False, "msg": str(e)}) for cmd_id, _ in commands]
+            for cmd_id, result in results:
+                self.inbox.reply(username, cmd_id, result)
+
+    def _apply_command(self, st, cmd):
+        op = cmd.get("op")
+        if op == "trade":
+            order = st["broker"].buy if cmd.get("side") == "buy" else st["broker"].sell
+            args = (cmd["symbol"], float(cmd["price"]), int(cmd["qty"]))
+            ok, msg = order(*args, cmd["action"]) if cmd.get("action") else order(*args)
+            return {"ok": bool(ok), "msg": msg}
+        if op == "edit":
+            data = {k: st[k] for k in ("watchlists", "trade_log", "bot_config")}
+            apply_edits(data, cmd.get("entry", {}))
+            return {"ok": True, "msg": "updated"}
+        return {"ok": False, "msg": f"unknown command {op}"}
+
+    def _active_users(self):
+        if self.users:
+            return self.users
+        users = active_bot_users()
+        if users is None:
+            # First start: build the index from every saved user once
+            users = []
+            for username in known_users():
+                active = bool(merge_bot_config((load_data(username) or {}).get("bot_config", {})).get("active"))
+                set_bot_active(username, active)
+                if active:
+                    users.append(username)
+        return users
+
+    def run_once(self):
+        """Runs every active user once and writes the heartbeat."""
+        self.handle_commands()
+        users = self._active_users()
+        for username in list(self._user_status):
+            if username not in users:
+                self._user_status.pop(username)
+        for username in users:
+            try:
+                msgs = self.run_user(username)
+            except Exception as e:
+                print(f"Bot Runner Error {username}: {e}")
+                continue
+            if msgs is None:
+                self._user_status.pop(username, None)
+                continue
+            prev = self._user_status.get(username, {})
+            self._user_status[username] = {
+                "last_cycle": str(datetime.datetime.now()),
+                "fills": prev.get("fills", 0) + len(msgs),
+                "last_msgs": msgs or prev.get("last_msgs", []),
+            }
+        self.cycles += 1
+        self.heartbeat()
+        metrics.export(RUNNER_METRICS_PATH)
+
+    def heartbeat(self, state="running"):
+        try:
+            write_status({
+                "pid": os.getpid(),
+                "state": state,
+                "heartbeat": time.time(),
+                "interval": self.interval,
+                "cycles": self.cycles,
+                "users": self._user_status,
+                "subscribers": self.hub.subscriber_counts(),
+            }, self.status_path)
+        except Exception as e:
+            print(f"Bot Runner Status Error: {e}")
+
+    def _sleep(self, seconds):
+        """Sleeps while answering the inbox (manual trades wait on the reply)."""
+        deadline = time.time() + seconds
+        while True:
+            try:
+                self.handle_commands()
+            except Exception as e:
+                print(f"Bot Runner Inbox Error: {e}")
+            left = deadline - time.time()
+            if left <= 0:
+                return
+            time.sleep(min(INBOX_POLL, left))
+
+    def run_forever(self):
+        print(f"Bot runner started (interval {self.interval:.0f}s)")
+        while True:
+            if self.market_hours_only and not tcal.is_market_active():
+                self.heartbeat("idle")
+                # Wake up for the open, but keep the heartbeat fresh
+                wait = (tcal.next_session_open() - tcal.now_taipei()).total_seconds()
+                self._sleep(max(1.0, min(self.interval, wait)))
+                continue
+            started = time.time()
+            self.run_once()
+            # Fixed cadence: a slow cycle shortens the next wait instead of drifting
+            self._sleep(max(0.0, self.interval - (time.time() - started)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", default=os.environ.get("BOT_USERS", ""), help="comma separated (default: all users)")
+    parser.add_argument("--interval", type=float, default=BOT_INTERVAL, help="seconds between scans")
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    parser.add_argument("--all-hours", action="store_true", help="also scan outside market hours")
+    args = parser.parse_args()
+
+    runner = BotRunner(users=[u for u in args.users.split(",") if u] or None,
+                       interval=args.interval, market_hours_only=not args.all_hours)
+    try:
+        if args.once:
+            runner.run_once()
+        else:
+            runner.run_forever()
+    except KeyboardInterrupt:
+        runner.heartbeat("stopped")
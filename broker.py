@@ -1,5 +1,5 @@
 import datetime
-from gsheet_handler import gsheet_logger
+from trade_log_queue import trade_log_queue
 
 class PaperBroker:
     def __init__(self, initial_balance=1000000.0):
@@ -226,6 +226,10 @@ class PaperBroker:
             
         return False, "未知交易類型"
 
+    def held_symbols(self):
+        """Sorted tuple of symbols with a non-zero position (for batched price lookups)"""
+        return tuple(sorted(s for s, v in self.inventory.items() if v['qty'] != 0))
+
     def get_account_summary(self, current_prices=None):
         if current_prices is None: current_prices = {}
         
@@ -298,7 +302,8 @@ class PaperBroker:
                 "balance": self.balance,
                 "msg": f"PnL: {record['P&L']}"
             }
-            gsheet_logger.log_trade("Stock_Bot_Log", log_data)
+            # Write-behind: sent in batches by a background thread
+            trade_log_queue.enqueue(log_data)
         except Exception as e:
             print(f"Cloud Log Error: {e}")
             pass
@@ -1,11 +1,235 @@
+import atexit
+import copy
+import datetime
 import json
 import os
+import threading
+import time
+import uuid
+from urllib.parse import quote, unquote
+import sqlite_store
+from instrumentation import span
+
+# User state is stored as a snapshot (user_<name>.json) plus an append-only
+# journal (user_<name>.journal.jsonl). Each save_data() appends one entry
+# holding only what changed since the previous save: new transactions and
+# log lines, changed balance / positions, and key-level diffs of the
+# watchlists and bot config. Every JOURNAL_COMPACT_EVERY entries the state
+# is compacted into a fresh snapshot and the journal is truncated.
+# The cloud copy follows the same scheme (rows of the user's journal worksheet
+# + UserData snapshot); a cloud snapshot deletes the journal rows it folds in.
+# With STORAGE_BACKEND=sqlite the same diffs are applied as row updates to the
+# local SQLite database instead (see sqlite_store.py).
+
+JOURNAL_COMPACT_EVERY = 200
+
+# Minimum seconds between two saves of the same user by PersistCoordinator
+# (0 = save whenever something is dirty, i.e. at most once per Streamlit rerun)
+PERSIST_MIN_INTERVAL = float(os.environ.get("PERSIST_MIN_INTERVAL", "0"))
+
+# Users whose bot is switched on, one marker file each (bot_runner only visits these)
+BOT_INDEX_DIR = os.environ.get("BOT_INDEX_DIR", os.path.join("data_cache", "bot_active"))
+
+# Keyed sections diffed key by key
+_KEYED = ("inventory", "watchlists", "bot_config")
+# Sections a session edits while the bot runner owns the account (see pending_edits)
+_EDITABLE = ("watchlists", "bot_config")
+
+_journals = {}  # username -> last persisted view (see _view)
+_journal_locks = {}
+_journals_guard = threading.Lock()
+
+
+def _snapshot_path(username):
+    return f"user_{username}.json"
+
+def _journal_path(username):
+    return f"user_{username}.journal.jsonl"
+
+def _user_lock(username):
+    with _journals_guard:
+        if username not in _journal_locks:
+            _journal_locks[username] = threading.Lock()
+        return _journal_locks[username]
+
+
+def _view(data, seq, since_snapshot, cloud_jid=None, cloud_since=0):
+    """
+    What was last persisted: lengths of the append-only lists, copies of the rest.
+    cloud_jid: id of the cloud snapshot the cloud journal continues (None = cloud
+    copy out of date, the next save uploads a snapshot).
+    """
+    return {
+        "seq": seq,
+        "since_snapshot": since_snapshot,
+        "cloud_jid": cloud_jid,
+        "cloud_since": cloud_since,
+        "balance": data["balance"],
+        "tx_len": len(data["transaction_history"]),
+        "log_len": len(data["trade_log"]),
+        **{k: copy.deepcopy(data[k]) for k in _KEYED},
+    }
+
+
+def _diff(view, data):
+    """
+    Journal entry turning the persisted view into `data`.
+    Returns {} when nothing changed and None when a snapshot is needed
+    (the append-only lists were shortened or rewritten).
+    """
+    if len(data["transaction_history"]) < view["tx_len"] or len(data["trade_log"]) < view["log_len"]:
+        return None
+
+    entry = {}
+    if data["balance"] != view["balance"]:
+        entry["balance"] = data["balance"]
+    if len(data["transaction_history"]) > view["tx_len"]:
+        entry["tx"] = data["transaction_history"][view["tx_len"]:]
+    if len(data["trade_log"]) > view["log_len"]:
+        entry["log"] = data["trade_log"][view["log_len"]:]
+
+    _diff_keyed(entry, view, data, _KEYED)
+    return entry
+
+
+def _diff_keyed(entry, view, data, sections):
+    for section in sections:
+        old, new = view[section], data[section]
+        changed = {k: v for k, v in new.items() if k not in old or old[k] != v}
+        removed = [k for k in old if k not in new]
+        if changed:
+            entry[section] = changed
+        if removed:
+            entry.setdefault("removed", {})[section] = removed
+
+
+def _apply(data, entry):
+    """Replays one journal entry onto a state dict (in place)."""
+    if "balance" in entry:
+        data["balance"] = entry["balance"]
+    data["transaction_history"].extend(entry.get("tx", []))
+    data["trade_log"].extend(entry.get("log", []))
+    for section in _KEYED:
+        data[section].update(entry.get(section, {}))
+        for k in entry.get("removed", {}).get(section, []):
+            data[section].pop(k, None)
+
+
+def pending_edits(watchlists, trade_log, bot_config, username="default"):
+    """
+    Watchlist / bot config changes and new log lines since the state was
+    last loaded or saved in this process, as an entry for apply_edits().
+    Returns None when nothing was loaded or saved yet.
+    """
+    with _user_lock(username):
+        view = _journals.get(username)
+        if view is None:
+            return None
+        entry = {}
+        if len(trade_log) > view["log_len"]:
+            entry["log"] = trade_log[view["log_len"]:]
+        _diff_keyed(entry, view, {"watchlists": watchlists, "bot_config": bot_config}, _EDITABLE)
+        return entry
+
+
+def apply_edits(data, entry):
+    """
+    Applies a pending_edits() entry onto a state dict (in place). Only the
+    key-level config edits and log lines are taken, so they merge onto a
+    newer state without touching its balance, positions or transactions.
+    """
+    data["trade_log"].extend(entry.get("log", []))
+    for section in _EDITABLE:
+        data[section].update(entry.get(section, {}))
+        for k in entry.get("removed", {}).get(section, []):
+            data[section].pop(k, None)
+
+
+def state_version(username="default"):
+    """Cheap token that changes whenever the user's saved state changes (None: nothing saved)."""
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        return sqlite_store.get_store().state_version(username)
+    stats = []
+    for path in (_snapshot_path(username), _journal_path(username)):
+        try:
+            s = os.stat(path)
+            stats.append((s.st_mtime_ns, s.st_size))
+        except FileNotFoundError:
+            stats.append(None)
+    return tuple(stats) if stats[0] else None
+
+
+def set_bot_active(username, active):
+    """Adds / removes the user's marker in the active bot index."""
+    path = os.path.join(BOT_INDEX_DIR, quote(username, safe=""))
+    try:
+        if active:
+            os.makedirs(BOT_INDEX_DIR, exist_ok=True)
+            open(path, "w").close()
+        elif os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        print(f"Bot Index Write Error {username}: {e}")
+
+
+def active_bot_users():
+    """Users whose bot is switched on, or None if the index was never built."""
+    if not os.path.isdir(BOT_INDEX_DIR):
+        return None
+    return sorted(unquote(name) for name in os.listdir(BOT_INDEX_DIR))
+
+
+def _sync_bot_index(view, username, bot_config):
+    if view is None or bool(view["bot_config"].get("active")) != bool(bot_config.get("active")):
+        set_bot_active(username, bool(bot_config.get("active")))
+
+
+def _normalize(data):
+    for k, default in (("balance", 0), ("inventory", {}), ("transaction_history", []),
+                       ("watchlists", {}), ("trade_log", []), ("bot_config", {})):
+        data.setdefault(k, copy.deepcopy(default))
+    return data
+
+
+def _write_snapshot(username, data, seq):
+    """Compaction: full state (tagged with the journal position) + empty journal."""
+    filename = _snapshot_path(username)
+    with open(filename + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(dict(data, journal_seq=seq), f, ensure_ascii=False, indent=4)
+    os.replace(filename + ".tmp", filename)
+    # Entries up to `seq` are in the snapshot; load skips them even if truncation fails
+    open(_journal_path(username), "w", encoding="utf-8").close()
+
+
+def _append_journal(username, entry):
+    with open(_journal_path(username), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _read_journal(username, after_seq):
+    path = _journal_path(username)
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break # Torn last line from a crash mid-write
+            if entry.get("seq", 0) > after_seq:
+                entries.append(entry)
+    return entries
+
 
 def save_data(broker, watchlists, trade_log, bot_config, username="default"):
     """
-    Saves user data to JSON file.
+    Saves user data: appends the changes since the last save to the journal
+    (local file and cloud), compacting into a snapshot periodically.
     """
-    filename = f"user_{username}.json"
     data = {
         "balance": broker.balance,
         "inventory": broker.inventory,
@@ -14,49 +238,192 @@ def save_data(broker, watchlists, trade_log, bot_config, username="default"):
         "trade_log": trade_log,
         "bot_config": bot_config
     }
-    
-    
-    # Local Backup (Always good to have)
-    try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"Error saving local data: {e}")
 
-    # Cloud Persistence
-    try:
-        from gsheet_handler import gsheet_logger
-        gsheet_logger.save_user_data("Stock_Bot_Log", username, data)
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        return _save_sqlite(username, data)
+
+    with _user_lock(username):
+        view = _journals.get(username)
+        entry = _diff(view, data) if view else None
+        if entry == {}:
+            return view["cloud_jid"] is not None # Nothing changed
+
+        seq = (view["seq"] if view else 0) + 1
+        since = view["since_snapshot"] + 1 if view else 0
+        compact = entry is None or since >= JOURNAL_COMPACT_EVERY
+
+        # Local (Always good to have)
+        since_snapshot = 0 if compact else since
+        try:
+            if compact:
+                _write_snapshot(username, data, seq)
+            else:
+                _append_journal(username, dict(entry, seq=seq, time=str(datetime.datetime.now())))
+        except Exception as e:
+            print(f"Error saving local data: {e}")
+            since_snapshot = JOURNAL_COMPACT_EVERY # Local copy unreliable: next save writes a snapshot
+
+        # Cloud Persistence
+        cloud_jid = None
+        cloud_since = view["cloud_since"] + 1 if view else 0
+        try:
+            from gsheet_handler import gsheet_logger
+            if entry is None or view["cloud_jid"] is None or cloud_since >= JOURNAL_COMPACT_EVERY:
+                # Snapshot (also resyncs the cloud after a failed journal write).
+                # A new id keeps journal rows of older snapshots (other sessions) out of the replay.
+                jid = uuid.uuid4().hex[:12]
+                if gsheet_logger.save_user_data("Stock_Bot_Log", username, dict(data, journal_seq=seq, journal_id=jid)):
+                    cloud_jid = jid
+                    cloud_since = 0
+                    # Every journal row is in the snapshot now (rows left by a failed clear are skipped by jid)
+                    gsheet_logger.clear_user_journal("Stock_Bot_Log", username)
+            elif gsheet_logger.append_user_journal("Stock_Bot_Log", username, [dict(entry, seq=seq, jid=view["cloud_jid"])]):
+                cloud_jid = view["cloud_jid"]
+        except Exception as e:
+            print(f"Error saving cloud data: {e}")
+
+        _journals[username] = _view(data, seq, since_snapshot, cloud_jid, cloud_since)
+        _sync_bot_index(view, username, bot_config)
+        return cloud_jid is not None
+
+
+def _save_sqlite(username, data):
+    with _user_lock(username):
+        view = _journals.get(username)
+        entry = _diff(view, data) if view else None
+        if entry == {}:
+            return True
+        try:
+            store = sqlite_store.get_store()
+            if entry is None:
+                store.write_state(username, data)
+            else:
+                store.apply_entry(username, entry)
+        except Exception as e:
+            print(f"Error saving SQLite data: {e}")
+            _journals.pop(username, None) # Next save rewrites the full state
+            return False
+        _journals[username] = _view(data, 0, 0)
+        _sync_bot_index(view, username, data["bot_config"])
         return True
-    except Exception as e:
-        print(f"Error saving cloud data: {e}")
-        return False
+
 
 def load_data(username="default"):
     """
-    Loads user data from JSON file.
+    Loads user data (snapshot + journal replay).
     Returns: dict or None
     """
+    if sqlite_store.STORAGE_BACKEND == "sqlite":
+        try:
+            data = sqlite_store.get_store().load_state(username)
+        except Exception as e:
+            print(f"Error loading SQLite data: {e}")
+            return None
+        if data is not None:
+            with _user_lock(username):
+                _journals[username] = _view(data, 0, 0)
+        return data
+
     # 1. Try Cloud
     try:
         from gsheet_handler import gsheet_logger
         cloud_data = gsheet_logger.fetch_user_data("Stock_Bot_Log", username)
         if cloud_data:
+            data = _normalize(cloud_data)
+            seq = data.pop("journal_seq", 0)
+            jid = data.pop("journal_id", None)
+            entries = gsheet_logger.fetch_user_journal("Stock_Bot_Log", username, after_seq=seq)
+            if entries is None:
+                raise RuntimeError("journal unavailable") # Snapshot alone would be stale
+            replayed = 0
+            for entry in entries:
+                if jid is None or entry.get("jid") != jid:
+                    continue
+                _apply(data, entry)
+                seq = entry["seq"]
+                replayed += 1
             print(f"Loaded data from Cloud for {username}")
-            return cloud_data
+            with _user_lock(username):
+                # Local files may be from another lineage: next save writes a fresh snapshot
+                _journals[username] = _view(data, seq, JOURNAL_COMPACT_EVERY, jid, replayed)
+            return data
     except Exception as e:
         print(f"Cloud load error: {e}")
 
     # 2. Local Fallback
-    filename = f"user_{username}.json"
+    filename = _snapshot_path(username)
     if not os.path.exists(filename):
         return None
-        
+
     try:
         with open(filename, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            print(f"Loaded data from Local for {username}")
-            return data
+            data = _normalize(json.load(f))
+        seq = data.pop("journal_seq", 0)
+        entries = _read_journal(username, seq)
+        for entry in entries:
+            _apply(data, entry)
+            seq = entry["seq"]
+        print(f"Loaded data from Local for {username}")
+        with _user_lock(username):
+            # Cloud copy state unknown: next save resyncs it with a snapshot
+            _journals[username] = _view(data, seq, len(entries))
+        return data
     except Exception as e:
         print(f"Error loading local data: {e}")
         return None
+
+
+class PersistCoordinator:
+    """
+    Coalesces save requests. mark_dirty() only records what has to be saved;
+    flush() runs save_data() once for everything marked since the last save,
+    at most every `min_interval` seconds per user unless forced.
+    `save` has save_data()'s signature (the app routes it to the bot runner
+    while one owns the account).
+    """
+    def __init__(self, min_interval=PERSIST_MIN_INTERVAL, save=None):
+        self.min_interval = min_interval
+        self.save = save or save_data
+        self.saves = 0
+        self._dirty = {}      # username -> (broker, watchlists, trade_log, bot_config)
+        self._last_save = {}  # username -> time.time() of the last save
+        self._lock = threading.Lock()
+
+    def mark_dirty(self, broker, watchlists, trade_log, bot_config, username="default"):
+        # The objects are live session state: the flush saves whatever they hold by then
+        with self._lock:
+            self._dirty[username] = (broker, watchlists, trade_log, bot_config)
+
+    def is_dirty(self, username="default"):
+        with self._lock:
+            return username in self._dirty
+
+    def flush(self, username="default", force=False):
+        """Saves the user's pending state if due (or forced). Returns True if a save ran."""
+        with self._lock:
+            if username not in self._dirty:
+                return False
+            if not force and time.time() - self._last_save.get(username, 0) < self.min_interval:
+                return False
+            state = self._dirty.pop(username)
+            self._last_save[username] = time.time()
+        with span("persist"):
+            self.save(*state, username=username)
+        self.saves += 1
+        return True
+
+    def discard(self, username="default"):
+        """Drops the user's unsaved state (it is about to be reloaded)."""
+        with self._lock:
+            self._dirty.pop(username, None)
+
+    def flush_all(self):
+        """Forced flush of every user (logout / shutdown)."""
+        with self._lock:
+            users = list(self._dirty)
+        for username in users:
+            self.flush(username, force=True)
+
+# Global Instance
+persist_coordinator = PersistCoordinator()
+atexit.register(persist_coordinator.flush_all)
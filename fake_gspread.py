@@ -0,0 +1,264 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import gspread
+from gspread.utils import numericise_all
+
+# Offline stand-in for the part of the gspread API that GSheetHandler uses
+# (open / sheet1 / worksheet / add_worksheet and the worksheet read/write calls).
+# Sheets live in a SQLite file, so persistence and trade logging can be run,
+# measured and load-tested without Google credentials.
+# Every API call can be slowed down (`latency`) or fail with a 429 quota
+# error (`error_rate`) to mimic the real service.
+#
+# Enable with GSHEET_BACKEND=fake (see GSheetHandler.connect); tune with
+# FAKE_GSHEET_DB, FAKE_GSHEET_LATENCY (seconds) and FAKE_GSHEET_ERROR_RATE (0-1).
+
+DB_PATH = os.environ.get("FAKE_GSHEET_DB", os.path.join("data_cache", "fake_gsheet.db"))
+
+
+class _QuotaResponse:
+    """Minimal requests.Response look-alike for gspread.exceptions.APIError."""
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": "Quota exceeded for quota metric 'Write requests' (fake backend)",
+                          "status": "RESOURCE_EXHAUSTED"}}
+
+
+class _Cell:
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+def _a1_to_rowcol(label):
+    m = re.fullmatch(r"([A-Z]+)(\d+)", label)
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + (ord(ch) - 64)
+    return int(m.group(2)), col
+
+
+def _display(value):
+    # Sheets returns formatted strings on reads
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+class FakeClient:
+    def __init__(self, db_path=DB_PATH, latency=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        if db_path != ":memory:" and os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS worksheets (
+                spreadsheet TEXT, title TEXT, idx INTEGER,
+                PRIMARY KEY (spreadsheet, title));
+            CREATE TABLE IF NOT EXISTS rows (
+                spreadsheet TEXT, title TEXT, row_no INTEGER, data TEXT,
+                PRIMARY KEY (spreadsheet, title, row_no));
+        """)
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls):
+        return cls(db_path=DB_PATH,
+                   latency=float(os.environ.get("FAKE_GSHEET_LATENCY", "0")),
+                   error_rate=float(os.environ.get("FAKE_GSHEET_ERROR_RATE", "0")))
+
+    def _api_call(self):
+        """Accounts for one API round trip: latency and random quota errors."""
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise gspread.exceptions.APIError(_QuotaResponse())
+
+    def open(self, title):
+        self._api_call()
+        with self._lock:
+            exists = self._db.execute("SELECT 1 FROM worksheets WHERE spreadsheet=?", (title,)).fetchone()
+            if not exists:
+                # Real spreadsheets are created in the Drive UI; here they appear on first use
+                self._db.execute("INSERT INTO worksheets VALUES (?, 'Sheet1', 0)", (title,))
+                self._db.commit()
+        return FakeSpreadsheet(self, title)
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+
+    @property
+    def sheet1(self):
+        self.client._api_call()
+        with self.client._lock:
+            row = self.client._db.execute(
+                "SELECT title FROM worksheets WHERE spreadsheet=? ORDER BY idx LIMIT 1", (self.title,)).fetchone()
+        return FakeWorksheet(self.client, self.title, row[0])
+
+    def worksheet(self, title):
+        self.client._api_call()
+        with self.client._lock:
+            row = self.client._db.execute(
+                "SELECT 1 FROM worksheets WHERE spreadsheet=? AND title=?", (self.title, title)).fetchone()
+        if not row:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return FakeWorksheet(self.client, self.title, title)
+
+    def add_worksheet(self, title, rows=100, cols=26):
+        self.client._api_call()
+        with self.client._lock:
+            db = self.client._db
+            idx = db.execute("SELECT COALESCE(MAX(idx), -1) + 1 FROM worksheets WHERE spreadsheet=?",
+                             (self.title,)).fetchone()[0]
+            db.execute("INSERT INTO worksheets VALUES (?, ?, ?)", (self.title, title, idx))
+            db.commit()
+        return FakeWorksheet(self.client, self.title, title)
+
+
+class FakeWorksheet:
+    def __init__(self, client, spreadsheet, title):
+        self.client = client
+        self.spreadsheet = spreadsheet
+        self.title = title
+
+    # --- Storage helpers (no API cost) ---
+    def _rows(self):
+        cur = self.client._db.execute(
+            "SELECT row_no, data FROM rows WHERE spreadsheet=? AND title=? ORDER BY row_no",
+            (self.spreadsheet, self.title))
+        out = []
+        for row_no, data in cur:
+            while len(out) < row_no - 1:
+                out.append([])
+            out.append(json.loads(data))
+        return out
+
+    def _get_row(self, row_no):
+        r = self.client._db.execute(
+            "SELECT data FROM rows WHERE spreadsheet=? AND title=? AND row_no=?",
+            (self.spreadsheet, self.title, row_no)).fetchone()
+        return json.loads(r[0]) if r else []
+
+    def _put_row(self, row_no, values):
+        self.client._db.execute("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?)",
+                                (self.spreadsheet, self.title, row_no, json.dumps(values, ensure_ascii=False)))
+
+    def _last_row(self):
+        return self.client._db.execute(
+            "SELECT COALESCE(MAX(row_no), 0) FROM rows WHERE spreadsheet=? AND title=?",
+            (self.spreadsheet, self.title)).fetchone()[0]
+
+    # --- Reads ---
+    def get_all_values(self):
+        self.client._api_call()
+        with self.client._lock:
+            return [[_display(v) for v in r] for r in self._rows()]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        headers = values[0]
+        return [dict(zip(headers, numericise_all(r + [""] * (len(headers) - len(r)))))
+                for r in values[1:]]
+
+    def row_values(self, row):
+        self.client._api_call()
+        with self.client._lock:
+            values = [_display(v) for v in self._get_row(row)]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def col_values(self, col):
+        self.client._api_call()
+        with self.client._lock:
+            values = [_display(r[col - 1]) if len(r) >= col else "" for r in self._rows()]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def cell(self, row, col):
+        self.client._api_call()
+        with self.client._lock:
+            r = self._get_row(row)
+        return _Cell(row, col, _display(r[col - 1]) if len(r) >= col else None)
+
+    def find(self, query, in_column=None):
+        self.client._api_call()
+        with self.client._lock:
+            for i, r in enumerate(self._rows()):
+                for j, v in enumerate(r):
+                    if (in_column is None or j + 1 == in_column) and _display(v) == query:
+                        return _Cell(i + 1, j + 1, _display(v))
+        return None
+
+    # --- Writes ---
+    def append_rows(self, values, **kwargs):
+        self.client._api_call()
+        with self.client._lock:
+            start = self._last_row() + 1
+            for i, r in enumerate(values):
+                self._put_row(start + i, list(r))
+            self.client._db.commit()
+        end = start + len(values) - 1
+        return {"updates": {"updatedRange": f"{self.title}!A{start}:Z{end}", "updatedRows": len(values)}}
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def update_cell(self, row, col, value):
+        self.client._api_call()
+        with self.client._lock:
+            r = self._get_row(row)
+            r += [""] * (col - len(r))
+            r[col - 1] = value
+            self._put_row(row, r)
+            self.client._db.commit()
+
+    def update(self, values, range_name=None, **kwargs):
+        self.client._api_call()
+        start = range_name.split(":")[0] if range_name else "A1"
+        row0, col0 = _a1_to_rowcol(start)
+        with self.client._lock:
+            for i, new in enumerate(values):
+                r = self._get_row(row0 + i)
+                r += [""] * (col0 - 1 + len(new) - len(r))
+                r[col0 - 1:col0 - 1 + len(new)] = list(new)
+                self._put_row(row0 + i, r)
+            self.client._db.commit()
+        return {"updatedRange": f"{self.title}!{range_name}"}
+
+    def clear(self):
+        self.client._api_call()
+        with self.client._lock:
+            self.client._db.execute("DELETE FROM rows WHERE spreadsheet=? AND title=?", (self.spreadsheet, self.title))
+            self.client._db.commit()
+
+    def resize(self, rows=None, cols=None):
+        # Only shrinking the row count matters here (rows past it are deleted)
+        self.client._api_call()
+        if rows is None:
+            return
+        with self.client._lock:
+            self.client._db.execute("DELETE FROM rows WHERE spreadsheet=? AND title=? AND row_no>?",
+                                    (self.spreadsheet, self.title, rows))
+            self.client._db.commit()
@@ -2,6 +2,8 @@ import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import datetime
 import os
+import re
+import threading
 import streamlit as st
 
 # Scope for GSheets/Drive
@@ -12,15 +14,58 @@ SCOPE = [
 
 KEY_FILE = 'google_key.json'
 
+# "google" (live Sheets API) or "fake" (local SQLite stand-in, see fake_gspread.py)
+BACKEND = os.environ.get("GSHEET_BACKEND", "google")
+
+JOURNAL_HEADERS = ["Username", "Seq", "Time", "EntryJSON"]
+TRADE_HEADERS = ["Date", "Symbol", "Action", "Price", "Qty", "Amount", "Fee", "Tax", "Balance", "Msg"]
+
+def format_trade_row(trade_data):
+    """Converts a trade dict (date, symbol, action, price, qty, ...) into a log sheet row."""
+    return [
+        str(datetime.datetime.now()),
+        trade_data.get('symbol', ''),
+        trade_data.get('action', ''),
+        trade_data.get('price', 0),
+        trade_data.get('qty', 0),
+        trade_data.get('amount', 0),
+        trade_data.get('fee', 0),
+        trade_data.get('tax', 0),
+        trade_data.get('balance', 0),
+        trade_data.get('msg', '')
+    ]
+
+def _appended_row(resp):
+    """Row number written by append_row(), from its 'updates.updatedRange' (e.g. 'UserData!A7:C7')."""
+    try:
+        rng = resp["updates"]["updatedRange"].split("!")[-1]
+        return int(re.match(r"[A-Z]+(\d+)", rng).group(1))
+    except Exception:
+        return None
+
 class GSheetHandler:
-    def __init__(self, key_file=KEY_FILE):
+    def __init__(self, key_file=KEY_FILE, backend=None):
         self.client = None
         self.key_file = key_file
+        self.backend = backend or BACKEND
         self.connected = False
+        self.no_credentials = False # connect() found no credentials at all (not a transient failure)
+        # Handle cache: opening a spreadsheet / worksheet costs an API call each time
+        self._spreadsheets = {}       # sheet_name -> Spreadsheet
+        self._worksheets = {}         # (sheet_name, title) -> Worksheet (title None = first sheet)
+        self._headers_known = set()   # (sheet_name, title) whose header row is known to exist
+        self._user_rows = {}          # sheet_name -> {username: row number in UserData}
+        self._cache_lock = threading.Lock()
         
     def connect(self):
         """Authenticates with Google Sheets API"""
         try:
+            if self.backend == "fake":
+                from fake_gspread import FakeClient
+                self.client = FakeClient.from_env()
+                self.connected = True
+                return True
+
             # Check Streamlit Secrets first (safe check)
             try:
                 if "gcp_service_account" in st.secrets:
@@ -40,47 +85,144 @@ class GSheetHandler:
                 return True
             else:
                 print("No credentials found (google_key.json or st.secrets)")
+                self.no_credentials = True
                 return False
 
         except Exception as e:
             print(f"GSheet Auth Error: {e}")
             return False
 
+    def is_configured(self):
+        """False when there is no Sheets backend to write to (no credentials anywhere)."""
+        if self.client is not None or self.backend == "fake":
+            return True
+        if self.no_credentials:
+            return False
+        try:
+            if "gcp_service_account" in st.secrets:
+                return True
+        except Exception:
+            pass # Local run without secrets.toml
+        return os.path.exists(self.key_file)
+
+    # --- Handle Cache ---
+    def _spreadsheet(self, sheet_name):
+        with self._cache_lock:
+            sh = self._spreadsheets.get(sheet_name)
+        if sh is None:
+            sh = self.client.open(sheet_name)
+            with self._cache_lock:
+                self._spreadsheets[sheet_name] = sh
+        return sh
+
+    def _worksheet(self, sheet_name, title=None, create=False, headers=None):
+        """
+        Cached worksheet handle; title None means the first sheet.
+        A missing worksheet is created (with `headers` as its first row) if
+        create=True, otherwise None is returned.
+        """
+        key = (sheet_name, title)
+        with self._cache_lock:
+            ws = self._worksheets.get(key)
+        if ws is not None:
+            return ws
+
+        sh = self._spreadsheet(sheet_name)
+        if title is None:
+            ws = sh.sheet1
+        else:
+            try:
+                ws = sh.worksheet(title)
+            except gspread.exceptions.WorksheetNotFound:
+                if not create:
+                    return None
+                ws = sh.add_worksheet(title=title, rows=100, cols=5)
+                if headers:
+                    ws.append_row(headers)
+                    with self._cache_lock:
+                        self._headers_known.add(key)
+
+        with self._cache_lock:
+            self._worksheets[key] = ws
+        return ws
+
+    def _has_headers(self, sheet_name, title, ws):
+        """True if the worksheet has a header row (checked with one row read, then remembered)."""
+        key = (sheet_name, title)
+        with self._cache_lock:
+            if key in self._headers_known:
+                return True
+        if ws.row_values(1):
+            self._mark_headers(sheet_name, title)
+            return True
+        return False
+
+    def _mark_headers(self, sheet_name, title):
+        with self._cache_lock:
+            self._headers_known.add((sheet_name, title))
+
+    def _invalidate(self, sheet_name):
+        """Drops cached handles after an API error (sheet deleted/renamed, expired session...)."""
+        with self._cache_lock:
+            self._spreadsheets.pop(sheet_name, None)
+            for key in [k for k in self._worksheets if k[0] == sheet_name]:
+                del self._worksheets[key]
+            self._headers_known = {k for k in self._headers_known if k[0] != sheet_name}
+            self._user_rows.pop(sheet_name, None)
+
+    def _user_row(self, sheet_name, ws, username):
+        """
+        Row of `username` in UserData from the in-memory index (None if absent).
+        The index is read with one column fetch and re-read on a miss, so rows
+        appended by other sessions are picked up. Rows are never deleted, so
+        known row numbers stay valid.
+        """
+        with self._cache_lock:
+            index = self._user_rows.get(sheet_name)
+        if index is not None and username in index:
+            return index[username]
+
+        names = ws.col_values(1)
+        index = {name: i + 1 for i, name in enumerate(names) if i > 0 and name}
+        with self._cache_lock:
+            self._user_rows[sheet_name] = index
+        return index.get(username)
+
+    def _remember_user_row(self, sheet_name, username, row):
+        with self._cache_lock:
+            if sheet_name in self._user_rows:
+                self._user_rows[sheet_name][username] = row
+
     def log_trade(self, sheet_name, trade_data):
         """
         Logs a trade dictionary to the first worksheet.
         trace_data: dict with keys like date, symbol, action, price, qty, etc.
         """
+        return self.log_trades(sheet_name, [format_trade_row(trade_data)])
+
+    def log_trades(self, sheet_name, rows):
+        """
+        Appends pre-formatted trade rows (see format_trade_row) in one request.
+        Used by the write-behind trade_log_queue.
+        """
         if not self.client:
             if not self.connect(): return False
             
         try:
-            sh = self.client.open(sheet_name)
-            ws = sh.sheet1 # Use first sheet
+            ws = self._worksheet(sheet_name) # Use first sheet
             
             # Ensure Headers if empty
-            if not ws.get_all_values():
-                headers = ["Date", "Symbol", "Action", "Price", "Qty", "Amount", "Fee", "Tax", "Balance", "Msg"]
-                ws.append_row(headers)
+            add_headers = not self._has_headers(sheet_name, None, ws)
+            if add_headers:
+                rows = [TRADE_HEADERS] + list(rows)
                 
-            # Prepare row
-            row = [
-                str(datetime.datetime.now()),
-                trade_data.get('symbol', ''),
-                trade_data.get('action', ''),
-                trade_data.get('price', 0),
-                trade_data.get('qty', 0),
-                trade_data.get('amount', 0),
-                trade_data.get('fee', 0),
-                trade_data.get('tax', 0),
-                trade_data.get('balance', 0),
-                trade_data.get('msg', '')
-            ]
-            
-            ws.append_row(row)
+            ws.append_rows(rows)
+            if add_headers:
+                self._mark_headers(sheet_name, None)
             return True
         except Exception as e:
             print(f"GSheet Log Error: {e}")
+            self._invalidate(sheet_name)
             return False
 
 
@@ -92,22 +234,20 @@ class GSheetHandler:
             if not self.connect(): return False
             
         try:
-            sh = self.client.open(sheet_name)
-            
-            # Try to get or create "Users" worksheet
-            try:
-                ws = sh.worksheet("Users")
-            except:
-                ws = sh.add_worksheet(title="Users", rows=100, cols=5)
+            # Get or create "Users" worksheet
+            headers = ["Register Time", "Username", "Status"]
+            ws = self._worksheet(sheet_name, "Users", create=True, headers=headers)
                 
             # Ensure Headers
-            if not ws.get_all_values():
-                ws.append_row(["Register Time", "Username", "Status"])
+            if not self._has_headers(sheet_name, "Users", ws):
+                ws.append_row(headers)
+                self._mark_headers(sheet_name, "Users")
                 
             ws.append_row([str(datetime.datetime.now()), username, "Active"])
             return True
         except Exception as e:
             print(f"GSheet User Log Error: {e}")
+            self._invalidate(sheet_name)
             return False
 
     # --- Cloud DB Methods ---
@@ -117,10 +257,8 @@ class GSheetHandler:
             if not self.connect(): return {}
             
         try:
-            sh = self.client.open(sheet_name)
-            try:
-                ws = sh.worksheet("Users")
-            except:
+            ws = self._worksheet(sheet_name, "Users")
+            if ws is None:
                 return {} # No users sheet yet
                 
             records = ws.get_all_records() # Expects headers: Register Time, Username, PasswordHash...
@@ -137,6 +275,7 @@ class GSheetHandler:
             return user_db
         except Exception as e:
             print(f"Fetch Users Error: {e}")
+            self._invalidate(sheet_name)
             return {}
 
     def register_user_db(self, sheet_name, username, password_hash):
@@ -144,28 +283,27 @@ class GSheetHandler:
             if not self.connect(): return False
             
         try:
-            sh = self.client.open(sheet_name)
-            try:
-                ws = sh.worksheet("Users")
-            except:
-                ws = sh.add_worksheet(title="Users", rows=100, cols=5)
-                
-            # Check Headers
-            headers = ws.row_values(1)
             required = ["Register Time", "Username", "PasswordHash", "Status"]
-            if not headers or headers[:2] != ["Register Time", "Username"]: 
-                # Init headers
-                ws.clear()
-                ws.append_row(required)
-            elif "PasswordHash" not in headers:
-                # Upgrade headers - primitive
-                # For now assuming we control it.
-                pass
+            ws = self._worksheet(sheet_name, "Users", create=True, headers=required)
+                
+            # Check Headers (once per session)
+            if (sheet_name, "Users") not in self._headers_known:
+                headers = ws.row_values(1)
+                if not headers or headers[:2] != ["Register Time", "Username"]: 
+                    # Init headers
+                    ws.clear()
+                    ws.append_row(required)
+                elif "PasswordHash" not in headers:
+                    # Upgrade headers - primitive
+                    # For now assuming we control it.
+                    pass
+                self._mark_headers(sheet_name, "Users")
 
             ws.append_row([str(datetime.datetime.now()), username, password_hash, "Active"])
             return True
         except Exception as e:
             print(f"Register DB Error: {e}")
+            self._invalidate(sheet_name)
             return False
 
     def save_user_data(self, sheet_name, username, data_dict):
@@ -177,29 +315,27 @@ class GSheetHandler:
             if not self.connect(): return False
             
         try:
-            sh = self.client.open(sheet_name)
-            try:
-                ws = sh.worksheet("UserData")
-            except:
-                ws = sh.add_worksheet(title="UserData", rows=100, cols=5)
-                ws.append_row(["Username", "UpdatedAt", "DataJSON"])
+            ws = self._worksheet(sheet_name, "UserData", create=True, headers=["Username", "UpdatedAt", "DataJSON"])
             
             json_str = json.dumps(data_dict, ensure_ascii=False)
             now = str(datetime.datetime.now())
             
             # Upsert Logic
-            # 1. Find row
-            cell = ws.find(username, in_column=1)
-            if cell:
-                # Update
-                ws.update_cell(cell.row, 2, now)
-                ws.update_cell(cell.row, 3, json_str)
+            # 1. Find row (in-memory index)
+            row = self._user_row(sheet_name, ws, username)
+            if row:
+                # Update timestamp + JSON in one request
+                ws.update(range_name=f"B{row}:C{row}", values=[[now, json_str]])
             else:
                 # Insert
-                ws.append_row([username, now, json_str])
+                resp = ws.append_row([username, now, json_str])
+                new_row = _appended_row(resp)
+                if new_row:
+                    self._remember_user_row(sheet_name, username, new_row)
             return True
         except Exception as e:
             print(f"Save UserData Error: {e}")
+            self._invalidate(sheet_name)
             return False
 
     def fetch_user_data(self, sheet_name, username):
@@ -208,20 +344,86 @@ class GSheetHandler:
             if not self.connect(): return None
             
         try:
-            sh = self.client.open(sheet_name)
-            try:
-                ws = sh.worksheet("UserData")
-            except:
+            ws = self._worksheet(sheet_name, "UserData")
+            if ws is None:
                 return None
             
-            cell = ws.find(username, in_column=1)
-            if cell:
-                json_str = ws.cell(cell.row, 3).value
+            row = self._user_row(sheet_name, ws, username)
+            if row:
+                json_str = ws.cell(row, 3).value
                 return json.loads(json_str)
             return None
         except Exception as e:
             print(f"Fetch UserData Error: {e}")
+            self._invalidate(sheet_name)
+            return None
+
+    def _journal_title(self, username):
+        # One journal worksheet per user: loads read only that user's rows
+        return re.sub(r"[\[\]*?/\\:']", "_", f"Journal_{username}")[:100]
+
+    def append_user_journal(self, sheet_name, username, entries):
+        """
+        Appends journal entries (dicts with a 'seq') to the user's journal worksheet.
+        One append_rows request, sized by the change instead of the whole state.
+        """
+        import json
+        if not self.client:
+            if not self.connect(): return False
+            
+        try:
+            ws = self._worksheet(sheet_name, self._journal_title(username), create=True, headers=JOURNAL_HEADERS)
+            now = str(datetime.datetime.now())
+            ws.append_rows([[username, e["seq"], now, json.dumps(e, ensure_ascii=False)] for e in entries])
+            return True
+        except Exception as e:
+            print(f"Append User Journal Error: {e}")
+            self._invalidate(sheet_name)
+            return False
+
+    def fetch_user_journal(self, sheet_name, username, after_seq=0):
+        """
+        Journal entries of a user with seq > after_seq, in order (None on error).
+        The worksheet only holds the entries since the last compaction
+        (clear_user_journal).
+        """
+        import json
+        if not self.client:
+            if not self.connect(): return None
+            
+        try:
+            ws = self._worksheet(sheet_name, self._journal_title(username))
+            if ws is None:
+                return []
+            
+            entries = []
+            for row in ws.get_all_values()[1:]:
+                if len(row) >= 4 and row[0] == username and int(row[1]) > after_seq:
+                    entries.append(json.loads(row[3]))
+            entries.sort(key=lambda e: e["seq"])
+            return entries
+        except Exception as e:
+            print(f"Fetch User Journal Error: {e}")
+            self._invalidate(sheet_name)
             return None
 
+    def clear_user_journal(self, sheet_name, username):
+        """
+        Deletes the user's journal rows (keeps the header). Called after a
+        snapshot was saved: every existing row is folded into it.
+        """
+        if not self.client:
+            if not self.connect(): return False
+            
+        try:
+            ws = self._worksheet(sheet_name, self._journal_title(username))
+            if ws is not None:
+                ws.resize(rows=1)
+            return True
+        except Exception as e:
+            print(f"Clear User Journal Error: {e}")
+            self._invalidate(sheet_name)
+            return False
+
 # Global Instance
 gsheet_logger = GSheetHandler()
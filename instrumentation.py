@@ -0,0 +1,128 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Lightweight stage timing for the bot loop, persistence and page renders.
+# span("bot.fetch") measures a block; the last WINDOW samples of each stage
+# are kept for percentiles, and exceptions are counted per stage (with the
+# last message) before being re-raised. export() writes the summary as a
+# Prometheus-style text file; the ?diag=1 page shows the same numbers.
+
+METRICS_PATH = os.environ.get("METRICS_PATH", os.path.join("data_cache", "metrics.txt"))
+WINDOW = 1000 # Samples kept per stage
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class Metrics:
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._stages = {}  # stage -> {"samples": deque, "count", "total", "errors", "last_error"}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def _stage(self, stage):
+        # Called with self._lock held
+        if stage not in self._stages:
+            self._stages[stage] = {"samples": deque(maxlen=self.window), "count": 0, "total": 0.0,
+                                   "errors": 0, "last_error": ""}
+        return self._stages[stage]
+
+    def record(self, stage, seconds, error=None):
+        with self._lock:
+            s = self._stage(stage)
+            s["samples"].append(seconds)
+            s["count"] += 1
+            s["total"] += seconds
+            if error is not None:
+                s["errors"] += 1
+                s["last_error"] = f"{type(error).__name__}: {error}"
+
+    @contextmanager
+    def span(self, stage):
+        """Times the block as `stage`; an exception is counted and re-raised."""
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Streamlit's rerun/stop exceptions are not errors (not Exception subclasses)
+            self.record(stage, time.perf_counter() - t0, error)
+
+    def timed(self, stage):
+        """Decorator form of span()."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def summary(self):
+        """{stage: {count, errors, last_error, mean, p50, p90, p99, max}} (seconds, over the window)."""
+        out = {}
+        with self._lock:
+            for stage, s in sorted(self._stages.items()):
+                values = sorted(s["samples"])
+                out[stage] = {
+                    "count": s["count"],
+                    "errors": s["errors"],
+                    "last_error": s["last_error"],
+                    "mean": s["total"] / s["count"] if s["count"] else 0.0,
+                    **{f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES},
+                    "max": values[-1] if values else 0.0,
+                }
+        return out
+
+    def to_text(self):
+        lines = ["# TYPE tw_stage_seconds summary"]
+        summary = self.summary()
+        for stage, s in summary.items():
+            for q in QUANTILES:
+                lines.append(f'tw_stage_seconds{{stage="{stage}",quantile="{q}"}} {s[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'tw_stage_seconds_sum{{stage="{stage}"}} {s["mean"] * s["count"]:.6f}')
+            lines.append(f'tw_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+        lines.append("# TYPE tw_stage_errors_total counter")
+        for stage, s in summary.items():
+            lines.append(f'tw_stage_errors_total{{stage="{stage}"}} {s["errors"]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=METRICS_PATH, min_interval=0.0):
+        """Writes the metrics text file (skipped if the last export is younger than min_interval)."""
+        now = time.time()
+        if now - self._last_export < min_interval:
+            return False
+        self._last_export = now
+        try:
+            d = os.path.dirname(path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.to_text())
+            os.replace(path + ".tmp", path)
+            return True
+        except Exception as e:
+            print(f"Metrics Export Error: {e}")
+            return False
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+# Global Instance
+metrics = Metrics()
+span = metrics.span
+timed = metrics.timed
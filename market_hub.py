@@ -0,0 +1,93 @@
+import threading
+import pandas as pd
+from trading_calendar import cache_epoch
+from utils import get_stock_data_batch
+
+# Process-wide market data fan-out for the bots.
+# Every bot (page session or runner user) subscribes to its targets; the hub
+# keeps one frame per (ticker, interval, period) and refreshes all stale
+# subscribed tickers together in one batched download, once per cache epoch
+# (every minute while the market is active, once after the close).
+# All bots share the same bar data: each caller gets a shallow copy, and
+# with pandas Copy-on-Write (always on from pandas 3, pinned in
+# requirements.txt) a consumer that modifies its frame, even in place,
+# only writes to its own copy, so the shared frames never change.
+
+HUB_TTL = 60 # Seconds between refreshes while the market is active
+
+
+class MarketHub:
+    def __init__(self, fetch_many=get_stock_data_batch, ttl=HUB_TTL):
+        self.fetch_many = fetch_many
+        self.ttl = ttl
+        self.fetches = 0        # Batched downloads made (for diagnostics)
+        self._frames = {}       # (ticker, interval, period) -> (epoch, DataFrame)
+        self._subs = {}         # owner -> {(ticker, interval, period)}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+
+    # --- Subscriptions ---
+    def subscribe(self, owner, tickers, period="6mo", interval="1d"):
+        """Sets the owner's subscriptions for (interval, period) to `tickers`."""
+        with self._lock:
+            keys = {k for k in self._subs.get(owner, set()) if k[1:] != (interval, period)}
+            keys.update((t, interval, period) for t in tickers)
+            if keys:
+                self._subs[owner] = keys
+            else:
+                self._subs.pop(owner, None)
+
+    def unsubscribe(self, owner):
+        with self._lock:
+            self._subs.pop(owner, None)
+
+    def subscriber_counts(self, interval="1d"):
+        """{ticker: number of owners subscribed} for one interval."""
+        counts = {}
+        with self._lock:
+            for keys in self._subs.values():
+                for ticker in {k[0] for k in keys if k[1] == interval}:
+                    counts[ticker] = counts.get(ticker, 0) + 1
+        return counts
+
+    # --- Frames ---
+    def _stale(self, keys, epoch):
+        # Called with self._lock held
+        return [k for k in keys if k not in self._frames or self._frames[k][0] != epoch]
+
+    def get_frames(self, tickers, period="6mo", interval="1d"):
+        """
+        {ticker: bars} for `tickers`; the data is shared with every other caller.
+        A refresh also brings along every other stale subscribed ticker of
+        the same (interval, period), so concurrent bots share one download.
+        """
+        epoch = cache_epoch(self.ttl)
+        wanted = [(t, interval, period) for t in dict.fromkeys(tickers)]
+        with self._lock:
+            missing = self._stale(wanted, epoch)
+        if missing:
+            # One refresh at a time: bots arriving meanwhile find their tickers fresh
+            with self._fetch_lock:
+                with self._lock:
+                    subscribed = {k for keys in self._subs.values() for k in keys if k[1:] == (interval, period)}
+                    stale = self._stale(wanted + sorted(subscribed - set(wanted)), epoch)
+                if stale:
+                    frames = self.fetch_many([k[0] for k in stale], period=period, interval=interval)
+                    self.fetches += 1
+                    with self._lock:
+                        for k in stale:
+                            # No data: cached as empty until the next epoch
+                            self._frames[k] = (epoch, frames.get(k[0], pd.DataFrame()))
+                        self._evict(epoch)
+        with self._lock:
+            return {k[0]: self._frames[k][1].copy(deep=False)
+                    for k in wanted if k in self._frames and not self._frames[k][1].empty}
+
+    def _evict(self, epoch):
+        # Called with self._lock held: drop outdated frames nobody subscribes to
+        subscribed = {k for keys in self._subs.values() for k in keys}
+        for k in [k for k, (e, _) in self._frames.items() if e != epoch and k not in subscribed]:
+            del self._frames[k]
+
+# Global Instance
+market_hub = MarketHub()
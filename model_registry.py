@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import trading_calendar as tcal
+
+# On-disk cache of fitted forecast models (prediction_engine).
+# An entry is keyed by (ticker, model type, feature set, hyperparameters) and
+# keeps the raw OHLCV bars it was trained on. Only those are compared: the
+# derived features (rolling / EWM indicators) of every row change whenever
+# the lookback window slides by a day. get_or_train() then:
+#   - hit:         same last bar, shared bars unchanged -> the stored model and outputs
+#   - incremental: shared bars unchanged plus a few new ones -> update_fn
+#                  (extra boosting rounds / fine-tuning)
+#   - miss:        anything else (e.g. revised / adjusted history) -> full train_fn
+# After MAX_INCREMENTAL_BARS bars of incremental updates the next update is a
+# full retrain, so updated models never drift far from a fresh fit.
+# Nothing is stored while the data is not settled (a forming intraday bar).
+
+MODEL_DIR = os.environ.get("MODEL_REGISTRY_DIR", os.path.join("data_cache", "models"))
+MAX_INCREMENTAL_BARS = int(os.environ.get("MODEL_MAX_INCREMENTAL_BARS", "5"))
+RAW_COLUMNS = ("Open", "High", "Low", "Close", "Volume")
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR, max_incremental=MAX_INCREMENTAL_BARS, settled=None):
+        self.model_dir = model_dir
+        self.max_incremental = max_incremental
+        # settled() -> True when freshly fetched bars are final (market closed)
+        self.settled = settled or (lambda: tcal.is_data_settled(tcal.now_taipei()))
+        self.stats = {"hit": 0, "incremental": 0, "miss": 0}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    # --- Paths & Locks ---
+    def _path(self, ticker, model_type, features, params):
+        spec = json.dumps([list(features), params or {}], sort_keys=True, default=str)
+        digest = hashlib.sha1(spec.encode()).hexdigest()[:12]
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", f"{ticker}_{model_type}_{digest}")
+        return os.path.join(self.model_dir, f"{name}.pkl")
+
+    def _lock(self, path):
+        with self._locks_guard:
+            if path not in self._locks:
+                self._locks[path] = threading.Lock()
+            return self._locks[path]
+
+    # --- Raw IO ---
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"Model Registry Read Error {path}: {e}")
+            return None
+
+    def _save(self, path, entry):
+        try:
+            os.makedirs(self.model_dir, exist_ok=True)
+            # Unique temp file: other processes may be writing the same entry
+            fd, tmp = tempfile.mkstemp(dir=self.model_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(entry, f)
+                os.replace(tmp, path)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except Exception as e:
+            print(f"Model Registry Write Error {path}: {e}")
+
+    @staticmethod
+    def _raw_bars(df):
+        cols = [c for c in RAW_COLUMNS if c in df.columns]
+        return df[cols or list(df.columns)].copy()
+
+    @staticmethod
+    def _same_history(stored, bars):
+        """True if `bars` up to the stored last bar are exactly the stored bars (window may have slid)."""
+        if stored is None or stored.index[-1] not in bars.index or not stored.columns.equals(bars.columns):
+            return False
+        new = bars.loc[:stored.index[-1]]
+        old = stored.loc[new.index[0]:]
+        return new.index.equals(old.index) and new.equals(old)
+
+    # --- Lookup ---
+    def get_or_train(self, ticker, model_type, df, train_fn, update_fn=None, features=(), params=None):
+        """
+        Returns (state, status), status being "hit", "incremental" or "miss".
+        train_fn(df) -> state
+        update_fn(state, df, new_bars) -> state (optional)
+        `state` is a picklable dict with the fitted model and its outputs.
+        """
+        path = self._path(ticker, model_type, features, params)
+        last_ts = df.index[-1]
+        bars = self._raw_bars(df)
+        with self._lock(path):
+            entry = self._load(path)
+            status = "miss"
+            same = entry is not None and self._same_history(entry.get("bars"), bars)
+            if same and entry["last_ts"] == last_ts:
+                status = "hit"
+            elif same and update_fn is not None:
+                new_bars = int((df.index > entry["last_ts"]).sum())
+                if entry["bars_since_full"] + new_bars <= self.max_incremental:
+                    try:
+                        state = update_fn(entry["state"], df, new_bars)
+                        entry = dict(entry, state=state, last_ts=last_ts, bars=bars,
+                                     bars_since_full=entry["bars_since_full"] + new_bars)
+                        status = "incremental"
+                    except Exception as e:
+                        print(f"Model Update Error {ticker} {model_type}: {e}")
+
+            if status == "miss":
+                entry = {"state": train_fn(df), "last_ts": last_ts, "bars": bars, "bars_since_full": 0}
+            if status != "hit" and self.settled():
+                self._save(path, entry)
+            self.stats[status] += 1
+            return entry["state"], status
+
+# Global Instance
+model_registry = ModelRegistry()
@@ -0,0 +1,158 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from backtest import BacktestEngine
+from strategy import calculate_indicators, get_signals, strategy_params
+
+# Strategy optimizer: evaluates every (ticker x strategy x params) combination
+# with the vectorized backtest and ranks them.
+# Work is spread over a process pool; each ticker's OHLCV arrays are placed in
+# one shared memory block that the workers map instead of receiving a pickled copy.
+
+STRATEGIES = ["MA_Cross", "RSI_Strategy", "MACD_Strategy", "KD_Strategy", "Bollinger_Strategy"]
+
+# Values tried per threshold (see strategy.DEFAULT_PARAMS for the defaults)
+PARAM_GRID = {
+    "RSI_Strategy": {"oversold": [20, 25, 30, 35], "overbought": [65, 70, 75, 80]},
+    "KD_Strategy": {"oversold": [10, 20, 30], "overbought": [70, 80, 90]},
+    "Bollinger_Strategy": {"num_std": [1.5, 2, 2.5]},
+}
+
+OHLCV_COLS = ['Open', 'High', 'Low', 'Close', 'Volume']
+START_IDX = 30 # Same warm-up as BacktestEngine
+INITIAL_CAPITAL = 1000000
+
+
+def expand_grid(strategy_name, grid=None):
+    """All parameter dicts to try for a strategy ([{}] when it has no thresholds)."""
+    space = (grid if grid is not None else PARAM_GRID).get(strategy_name, {})
+    if not space:
+        return [{}]
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+# --- Shared OHLCV blocks ---
+def share_frame(df):
+    """
+    Copies df's index and OHLCV columns into a new shared memory block.
+    Returns (shm, spec); spec is the small picklable description workers attach with.
+    """
+    n = len(df)
+    shm = shared_memory.SharedMemory(create=True, size=max(n * 8 * (1 + len(OHLCV_COLS)), 1))
+    index = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+    values = np.ndarray((n, len(OHLCV_COLS)), dtype=np.float64, buffer=shm.buf, offset=n * 8)
+    index[:] = df.index.asi8 # Integers in the index's own unit (us by default in pandas 3)
+    values[:] = df[OHLCV_COLS].to_numpy(dtype=np.float64)
+    spec = {"name": shm.name, "rows": n, "unit": df.index.unit, "tz": str(df.index.tz) if df.index.tz else None}
+    return shm, spec
+
+
+def _frame_from_spec(spec, shm):
+    """DataFrame whose OHLCV columns are views on the shared block."""
+    n = spec["rows"]
+    index = np.ndarray((n,), dtype=np.int64, buffer=shm.buf)
+    values = np.ndarray((n, len(OHLCV_COLS)), dtype=np.float64, buffer=shm.buf, offset=n * 8)
+    idx = pd.DatetimeIndex(index.view(f"datetime64[{spec['unit']}]"))
+    if spec["tz"]:
+        idx = idx.tz_localize("UTC").tz_convert(spec["tz"])
+    return pd.DataFrame(values, index=idx, columns=OHLCV_COLS, copy=False)
+
+
+# --- Evaluation ---
+def _evaluate(ticker, df, strategy_name, param_sets):
+    """Backtests one strategy over all its parameter sets on one ticker."""
+    engine = BacktestEngine(INITIAL_CAPITAL)
+    ind = calculate_indicators(df.sort_index())
+    dates = ind.index[START_IDX:]
+    close = ind['Close'].to_numpy(dtype=float)[START_IDX:]
+
+    rows = []
+    for params in param_sets:
+        signals = get_signals(ind, strategy_name, params)[START_IDX:]
+        eq, tr = engine.run_signals(dates, close, signals)
+        kpis = engine.calculate_kpis(eq, tr)
+        rows.append({"Ticker": ticker, "Strategy": strategy_name,
+                     "Params": strategy_params(strategy_name, params), **kpis})
+    return rows
+
+
+def _evaluate_shared(ticker, spec, strategy_name, param_sets):
+    """Worker entry point: maps the ticker's shared block and evaluates."""
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    try:
+        df = _frame_from_spec(spec, shm)
+        rows = _evaluate(ticker, df, strategy_name, param_sets)
+        del df # Release the views before closing the mapping
+        return rows
+    finally:
+        shm.close()
+
+
+def rank_results(rows):
+    """Sorts results by ticker, then Total Return (best first) and numbers the ranks per ticker."""
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table
+    table = table.sort_values(["Ticker", "Total Return"], ascending=[True, False], kind="stable").reset_index(drop=True)
+    table.insert(0, "Rank", table.groupby("Ticker").cumcount() + 1)
+    return table
+
+
+def best_by_ticker(table):
+    """{ticker: (strategy, params)} for the rank-1 row of each ticker."""
+    if table.empty:
+        return {}
+    best = table[table["Rank"] == 1]
+    return {r.Ticker: (r.Strategy, r.Params) for r in best.itertuples()}
+
+
+def optimize(data, strategies=None, grid=None, max_workers=None, progress=None):
+    """
+    data: {ticker: OHLCV DataFrame}.
+    strategies: strategy names to try (default: all).
+    grid: per-strategy threshold values (default: PARAM_GRID).
+    max_workers: pool size (default: CPU count); 1 runs in-process.
+    progress: callback(done, total) called as each (ticker, strategy) finishes.
+    Returns the ranked result table (see rank_results()).
+    """
+    strategies = strategies or STRATEGIES
+    data = {t: df for t, df in data.items() if df is not None and len(df) >= START_IDX}
+    tasks = [(t, s, expand_grid(s, grid)) for t in data for s in strategies]
+    total = len(tasks)
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, total)
+
+    results = [None] * total # Per task, in task order so ties rank deterministically
+    done = 0
+    if max_workers > 1 and total > 1:
+        blocks = {}
+        try:
+            for t, df in data.items():
+                blocks[t] = share_frame(df)
+            # Spawn: forking a process that runs server threads is unsafe (and unavailable on Windows)
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+                futures = {pool.submit(_evaluate_shared, t, blocks[t][1], s, ps): i for i, (t, s, ps) in enumerate(tasks)}
+                for fut in as_completed(futures):
+                    results[futures[fut]] = fut.result()
+                    done += 1
+                    if progress: progress(done, total)
+            return rank_results([r for rows in results for r in rows])
+        except Exception as e:
+            print(f"Optimizer Pool Error: {e} (falling back to serial)")
+            done = 0
+        finally:
+            for shm, _ in blocks.values():
+                shm.close()
+                shm.unlink()
+
+    for i, (t, s, ps) in enumerate(tasks):
+        results[i] = _evaluate(t, data[t], s, ps)
+        done += 1
+        if progress: progress(done, total)
+    return rank_results([r for rows in results for r in rows])
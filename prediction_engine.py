@@ -43,10 +43,11 @@ def calculate_bollinger(df, period=20, std_dev=2):
     lower = ma - (std * std_dev)
     return upper, lower
 
-def prepare_data(ticker, period="2y"):
+def prepare_data(ticker, period="2y", vix=None):
     """
     Fetches data and generates technical features.
     Target: Next Day's Close Price.
+    vix: ^VIX bars (e.g. fetched once for a whole batch); fetched here if None.
     """
     df = get_stock_data(ticker, period=period)
     if df.empty: return pd.DataFrame(), pd.DataFrame()
@@ -73,7 +74,8 @@ def prepare_data(ticker, period="2y"):
     
     # --- ADD VIX DATA ---
     try:
-        vix = get_stock_data("^VIX", period=period) 
+        if vix is None:
+            vix = get_stock_data("^VIX", period=period)
         if not vix.empty:
             vix = vix[['Close']].rename(columns={'Close': 'VIX'})
             df = df.join(vix, how='left')
@@ -164,10 +166,92 @@ def train_xgboost(df, horizon=1, features=['Close', 'MA5', 'MA20', 'RSI', 'MACD'
     f_importance = dict(zip(features, final_model.feature_importances_))
     
     return final_model, results, mae, rmse, mape, f_importance
+
+
+XGB_FEATURES = ['Close', 'MA5', 'MA20', 'RSI', 'MACD', 'MACD_Hist', 'K', 'D', 'UpperB', 'LowerB', 'PctChange', 'VolChange', 'VIX']
+
+def _stack_horizons(X, horizons):
+    """Rows of X repeated once per horizon, with the horizon as an extra feature."""
+    return pd.concat([X.assign(Horizon=h) for h in horizons])
+
+class HorizonModel:
+    """
+    One XGBoost model for every horizon (Horizon is an input feature).
+    predict(X) returns one column per horizon, like a multi-output model.
+    """
+    def __init__(self, model, horizons):
+        self.model = model
+        self.horizons = list(horizons)
+
+    def predict(self, X):
+        preds = self.model.predict(_stack_horizons(X, self.horizons))
+        return preds.reshape(len(self.horizons), len(X)).T
+
+def train_xgboost_multi(df, forecast_days=5, features=XGB_FEATURES, refit=True):
+    """
+    Trains horizons 1..forecast_days in one model: the training rows of every
+    horizon are stacked with a Horizon feature (2 fits per ticker instead of
+    2 per horizon). Each horizon keeps train_xgboost()'s rows and 80/20 split.
+    refit=False keeps the evaluation model as the final model (1 fit).
+    Returns: HorizonModel, {h: results_df}, {h: {"mae", "rmse", "mape"}}, f_importance
+    """
+    horizons = list(range(1, forecast_days + 1))
+    train_parts, full_parts, tests = [], [], {}
+    for h in horizons:
+        # Same rows as train_xgboost(df, horizon=h)
+        data = df[features].assign(Horizon=h, Target=df['Close'].shift(-h)).dropna(subset=['Target'])
+        if data.empty:
+            return None, {}, {}, {}
+        split = int(len(data) * 0.8)
+        train_parts.append(data.iloc[:split])
+        full_parts.append(data)
+        tests[h] = data.iloc[split:]
+
+    cols = features + ['Horizon']
+    train = pd.concat(train_parts)
+    model = xgb.XGBRegressor(
+        objective='reg:squarederror',
+        n_estimators=100,
+        learning_rate=0.1,
+        max_depth=5,
+        random_state=42
+    )
+    model.fit(train[cols], train['Target'])
+
+    # Evaluate each horizon on its own test rows
+    results, scores = {}, {}
+    for h, test in tests.items():
+        y_test = test['Target']
+        preds = model.predict(test[cols])
+        mae = mean_absolute_error(y_test, preds)
+        rmse = np.sqrt(mean_squared_error(y_test, preds))
+        diff = np.abs((y_test - preds) / y_test)
+        diff.replace([np.inf, -np.inf], np.nan, inplace=True)
+        scores[h] = {"mae": mae, "rmse": rmse, "mape": diff.mean()}
+        results[h] = pd.DataFrame({"Actual": y_test, "Predicted": preds}, index=y_test.index)
+
+    # Re-train on the FULL dataset for future prediction (stale model otherwise)
+    final_model = model
+    if refit:
+        full = pd.concat(full_parts)
+        final_model = xgb.XGBRegressor(
+            objective='reg:squarederror',
+            n_estimators=100,
+            learning_rate=0.1,
+            max_depth=5,
+            random_state=42
+        )
+        final_model.fit(full[cols], full['Target'])
+
+    # Feature Importance (shared by all horizons; the Horizon feature itself is left out)
+    f_importance = dict(zip(features, final_model.feature_importances_[:len(features)]))
+    return HorizonModel(final_model, horizons), results, scores, f_importance
+
+
 # ==========================================
 # 3. LSTM Model (Deep Learning)
 # ==========================================
-from tensorflow.keras.models import Sequential
+from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 from tensorflow.keras.callbacks import EarlyStopping
 
@@ -192,6 +276,47 @@ def train_lstm_model(ticker_data_json, seq_length=60, epochs=20):
     """
     pass 
 
+def lstm_forecast(model, scaler, scaled_data, forecast_days, seq_length, target_idx):
+    """Recursive T+1..T+forecast_days prices from the last `seq_length` scaled rows."""
+    n_features = scaled_data.shape[1]
+    future_prices = []
+    
+    # Start with the last known sequence
+    current_seq = scaled_data[-seq_length:].copy() # shape (60, features)
+    
+    for _ in range(forecast_days):
+        # Predict Next Step using current sequence
+        # Reshape to (1, 60, features)
+        input_seq = current_seq.reshape(1, seq_length, n_features)
+        pred_scaled = model.predict(input_seq)[0][0] # Scalar
+        
+        # Inverse to get real price for this step
+        dummy_f = np.zeros((1, n_features))
+        dummy_f[:, target_idx] = pred_scaled
+        pred_price = scaler.inverse_transform(dummy_f)[0, target_idx]
+        future_prices.append(pred_price)
+        
+        # Update Sequence for Next Step
+        # Shift everything left, append new prediction?
+        # PROBLEM: We only predicted "Close" price, but we need ALL features (MA, RSI, etc) for the next step.
+        # Strategy:
+        # 1. "Naive" strategy: Assume other features stay constant? (Bad)
+        # 2. "Feature Estimation": Re-calculate indicators based on new Close? (Complex)
+        # 3. "Self-Correction": Just assume other features drift or use last known?
+        
+        # Better approach for simplified recursion:
+        # Create a dummy row for the new step. 
+        # Update 'Close' with predicted close.
+        # For other columns, copy the last value (Naive persistence).
+        # This is not perfect but valid for short horizon (5 days).
+        
+        new_row = current_seq[-1].copy() # Copy last row of features
+        new_row[target_idx] = pred_scaled # Update Close
+        
+        # Append new row, remove first row
+        current_seq = np.vstack([current_seq[1:], new_row])
+    return future_prices
+
 def train_lstm(df, forecast_days=1, seq_length=60, epochs=10, features=['Close', 'MA5', 'MA20', 'RSI', 'PctChange', 'VolChange', 'VIX']):
     
     # 1. Scale Data
@@ -271,42 +396,7 @@ def train_lstm(df, forecast_days=1, seq_length=60, epochs=10, features=['Close',
     }, index=df.index[seq_length:])
 
     # RECURSIVE FUTURE PREDICTION
-    future_prices = []
-    
-    # Start with the last known sequence
-    current_seq = scaled_data[-seq_length:].copy() # shape (60, features)
-    
-    for _ in range(forecast_days):
-        # Predict Next Step using current sequence
-        # Reshape to (1, 60, features)
-        input_seq = current_seq.reshape(1, seq_length, len(features))
-        pred_scaled = model.predict(input_seq)[0][0] # Scalar
-        
-        # Inverse to get real price for this step
-        dummy_f = np.zeros((1, len(features)))
-        dummy_f[:, target_idx] = pred_scaled
-        pred_price = scaler.inverse_transform(dummy_f)[0, target_idx]
-        future_prices.append(pred_price)
-        
-        # Update Sequence for Next Step
-        # Shift everything left, append new prediction?
-        # PROBLEM: We only predicted "Close" price, but we need ALL features (MA, RSI, etc) for the next step.
-        # Strategy:
-        # 1. "Naive" strategy: Assume other features stay constant? (Bad)
-        # 2. "Feature Estimation": Re-calculate indicators based on new Close? (Complex)
-        # 3. "Self-Correction": Just assume other features drift or use last known?
-        
-        # Better approach for simplified recursion:
-        # Create a dummy row for the new step. 
-        # Update 'Close' with predicted close.
-        # For other columns, copy the last value (Naive persistence).
-        # This is not perfect but valid for short horizon (5 days).
-        
-        new_row = current_seq[-1].copy() # Copy last row of features
-        new_row[target_idx] = pred_scaled # Update Close
-        
-        # Append new row, remove first row
-        current_seq = np.vstack([current_seq[1:], new_row])
+    future_prices = lstm_forecast(model, scaler, scaled_data, forecast_days, seq_length, target_idx)
     
     return model, results, mae, rmse, mape, future_prices, history
 
@@ -320,7 +410,7 @@ import logging
 logging.getLogger('prophet').setLevel(logging.ERROR)
 logging.getLogger('cmdstanpy').setLevel(logging.ERROR)
 
-def train_prophet(df, forecast_days=5):
+def train_prophet(df, forecast_days=5, init=None):
     """
     Trains FB Prophet Model.
     Returns: 
@@ -328,6 +418,7 @@ def train_prophet(df, forecast_days=5):
         future_only (list of T+1...T+N prices)
         model (object, for components plot)
         mae (float)
+    init: initial parameters (warm start from a previous fit, see prophet_warm_start)
     """
     # 1. Prep Data (Prophet strict format: ds, y)
     prophet_df = df.reset_index()[['Date', 'Close']].copy()
@@ -346,7 +437,10 @@ def train_prophet(df, forecast_days=5):
     use_yearly = len(prophet_df) > 365
     
     m = Prophet(daily_seasonality=False, weekly_seasonality=True, yearly_seasonality=use_yearly)
-    m.fit(prophet_df)
+    if init:
+        m.fit(prophet_df, init=init)
+    else:
+        m.fit(prophet_df)
     
     # 3. Predict Future
     # Prophet logic: make_future_dataframe includes history + future
@@ -370,3 +464,140 @@ def train_prophet(df, forecast_days=5):
     mae = mean_absolute_error(y_true, y_pred)
     
     return forecast, future_prices, m, mae
+
+# ==========================================
+# 5. Cached Training (Model Registry)
+# ==========================================
+# Same outputs as the train_* functions, served from model_registry: stored
+# models are reused while no new bar arrived, and a few new bars are folded
+# in with extra boosting rounds / a short fine-tune / a warm-started fit.
+import os
+import tempfile
+from types import SimpleNamespace
+from prophet.serialize import model_to_json, model_from_json
+from model_registry import model_registry
+
+LSTM_FEATURES = ['Close', 'MA5', 'MA20', 'RSI', 'PctChange', 'VolChange', 'VIX']
+XGB_UPDATE_ROUNDS = 10    # Boosting rounds added per incremental update
+XGB_UPDATE_WINDOW = 60    # Most recent training rows (per horizon) they are fitted on
+LSTM_FINE_TUNE_EPOCHS = 3
+
+def update_xgboost_multi(model, df, features=XGB_FEATURES, rounds=XGB_UPDATE_ROUNDS, window=XGB_UPDATE_WINDOW):
+    """Continues boosting a HorizonModel on the most recent rows (incl. targets revealed by new bars)."""
+    parts = []
+    for h in model.horizons:
+        data = df[features].assign(Horizon=h, Target=df['Close'].shift(-h)).dropna(subset=['Target'])
+        parts.append(data.iloc[-window:])
+    recent = pd.concat(parts)
+    cols = features + ['Horizon']
+    updated = xgb.XGBRegressor(
+        objective='reg:squarederror',
+        n_estimators=rounds,
+        learning_rate=0.1,
+        max_depth=5,
+        random_state=42
+    )
+    updated.fit(recent[cols], recent['Target'], xgb_model=model.model.get_booster())
+    return HorizonModel(updated, model.horizons)
+
+def cached_xgboost_multi(ticker, df, forecast_days=5, features=XGB_FEATURES, registry=model_registry):
+    """
+    train_xgboost_multi() through the model registry.
+    Returns (model, results, scores, f_importance, status). After an
+    incremental update the test metrics are those of the last full fit.
+    """
+    def train(df):
+        model, results, scores, f_importance = train_xgboost_multi(df, forecast_days, features)
+        return {"model": model, "results": results, "scores": scores, "f_importance": f_importance}
+
+    def update(state, df, new_bars):
+        if state["model"] is None:
+            raise ValueError("no model to update")
+        return dict(state, model=update_xgboost_multi(state["model"], df, features))
+
+    state, status = registry.get_or_train(ticker, "xgboost_multi", df, train, update, features,
+                                          {"forecast_days": forecast_days})
+    return state["model"], state["results"], state["scores"], state["f_importance"], status
+
+def _keras_dumps(model):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "model.keras")
+        model.save(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+def _keras_loads(blob):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "model.keras")
+        with open(path, "wb") as f:
+            f.write(blob)
+        return load_model(path)
+
+def cached_lstm(ticker, df, forecast_days=1, seq_length=60, epochs=10, features=LSTM_FEATURES, registry=model_registry):
+    """
+    train_lstm() through the model registry.
+    Returns train_lstm()'s tuple plus the registry status. New bars are
+    learned with a short fine-tune on their sequences; the training metrics
+    stay those of the last full fit.
+    """
+    target_idx = features.index('Close')
+
+    def train(df):
+        model, results, mae, rmse, mape, future_prices, history = train_lstm(df, forecast_days, seq_length, epochs, features)
+        return {
+            "model": _keras_dumps(model) if model is not None else None,
+            # Same fit as inside train_lstm (deterministic on the same data)
+            "scaler": MinMaxScaler(feature_range=(0, 1)).fit(df[features]),
+            "results": results, "mae": mae, "rmse": rmse, "mape": mape,
+            "future_prices": future_prices,
+            "loss": history.history['loss'] if history else [],
+        }
+
+    def update(state, df, new_bars):
+        if state["model"] is None:
+            raise ValueError("no model to update")
+        model = _keras_loads(state["model"])
+        scaled_data = state["scaler"].transform(df[features])
+        # Sequences ending in the new bars
+        X = np.array([scaled_data[i - seq_length:i] for i in range(len(scaled_data) - new_bars, len(scaled_data))])
+        y = scaled_data[len(scaled_data) - new_bars:, target_idx]
+        history = model.fit(X, y, epochs=LSTM_FINE_TUNE_EPOCHS, batch_size=32, verbose=0)
+        return dict(state,
+                    model=_keras_dumps(model),
+                    future_prices=lstm_forecast(model, state["scaler"], scaled_data, forecast_days, seq_length, target_idx),
+                    loss=state["loss"] + history.history['loss'])
+
+    state, status = registry.get_or_train(ticker, "lstm", df, train, update, features,
+                                          {"forecast_days": forecast_days, "seq_length": seq_length, "epochs": epochs})
+    model = _keras_loads(state["model"]) if state["model"] is not None else None
+    history = SimpleNamespace(history={"loss": state["loss"]}) if state["loss"] else None
+    return model, state["results"], state["mae"], state["rmse"], state["mape"], state["future_prices"], history, status
+
+def prophet_warm_start(m):
+    """Fitted parameters of a Prophet model, usable as `init` for the next fit."""
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = m.params[pname][0][0]
+    for pname in ['delta', 'beta']:
+        res[pname] = m.params[pname][0]
+    return res
+
+def cached_prophet(ticker, df, forecast_days=5, registry=model_registry):
+    """
+    train_prophet() through the model registry.
+    Returns train_prophet()'s tuple plus the registry status. New bars refit
+    the model warm-started from the stored parameters.
+    """
+    def pack(result):
+        forecast, future_prices, m, mae = result
+        return {"model": model_to_json(m), "forecast": forecast, "future_prices": future_prices, "mae": mae}
+
+    def train(df):
+        return pack(train_prophet(df, forecast_days))
+
+    def update(state, df, new_bars):
+        return pack(train_prophet(df, forecast_days, init=prophet_warm_start(model_from_json(state["model"]))))
+
+    state, status = registry.get_or_train(ticker, "prophet", df, train, update, ["Close"],
+                                          {"forecast_days": forecast_days})
+    return state["forecast"], state["future_prices"], model_from_json(state["model"]), state["mae"], status
@@ -0,0 +1,115 @@
+import datetime
+import threading
+import time
+from trading_calendar import cache_ttl
+
+TAIPEI = datetime.timezone(datetime.timedelta(hours=8))
+
+
+class QuoteEngine:
+    """
+    Answers realtime quotes from one intraday (1m) series per ticker plus a
+    previous-close table that is rebuilt once per trading day.
+    Quotes are served from memory for `quote_ttl` seconds while the market is
+    active and until the next session opens otherwise.
+    """
+    def __init__(self, quote_ttl=30):
+        self.quote_ttl = quote_ttl
+        self._prev_close = {} # ticker -> (today_date, prev_close)
+        self._quotes = {}     # ticker -> (expires_at, quote dict)
+        self._lock = threading.Lock()
+
+    def get_quote(self, ticker):
+        """
+        Returns a dict with: 'price', 'change', 'pct', 'time', 'prev_close'
+        """
+        with self._lock:
+            cached = self._quotes.get(ticker)
+        if cached and time.time() < cached[0]:
+            return cached[1]
+
+        from utils import get_stock_data
+        try:
+            today = datetime.datetime.now(TAIPEI).date()
+            df_m = get_stock_data(ticker, period="5d", interval="1m")
+            prev_close = self._previous_close(ticker, today, df_m)
+
+            curr_price = 0.0
+            time_str = "N/A"
+            if not df_m.empty:
+                curr_price = float(df_m['Close'].iloc[-1])
+                time_str = df_m.index[-1].strftime("%Y-%m-%d %H:%M")
+            else:
+                # No intraday feed (e.g. index without 1m bars): use daily history
+                df_d = get_stock_data(ticker, period="5d", interval="1d")
+                if not df_d.empty:
+                    curr_price = float(df_d['Close'].iloc[-1])
+                    time_str = df_d.index[-1].strftime("%Y-%m-%d (已收盤)")
+
+            if prev_close > 0:
+                chg = curr_price - prev_close
+                pct = (chg / prev_close) * 100
+            else:
+                chg = 0; pct = 0
+
+            quote = {
+                "price": curr_price,
+                "change": chg,
+                "pct": pct,
+                "time": time_str,
+                "prev_close": prev_close
+            }
+        except Exception as e:
+            print(f"Quote Error: {e}")
+            return {"price": 0, "change": 0, "pct": 0, "time": "Error", "prev_close": 0}
+
+        if curr_price > 0:
+            with self._lock:
+                self._quotes[ticker] = (time.time() + cache_ttl(self.quote_ttl), quote)
+        return quote
+
+    def _previous_close(self, ticker, today, df_m):
+        """
+        Previous session close, looked up once per day per ticker.
+        Daily bars are preferred; the intraday series covers days yfinance
+        has not published a daily bar for yet.
+        """
+        with self._lock:
+            entry = self._prev_close.get(ticker)
+        if entry and entry[0] == today:
+            return entry[1]
+
+        from utils import get_stock_data
+        df_d = get_stock_data(ticker, period="1mo", interval="1d")
+
+        d_date, d_price = _last_close_before(df_d, today)
+        m_date, m_price = _last_close_before(df_m, today)
+
+        prev_close = 0.0
+        if d_date and m_date:
+            prev_close = m_price if m_date > d_date else d_price
+        elif d_date:
+            prev_close = d_price
+        elif m_date:
+            prev_close = m_price
+        elif not df_d.empty:
+            # No past data? Fallback to Open
+            prev_close = float(df_d['Open'].iloc[0])
+
+        if prev_close > 0:
+            with self._lock:
+                self._prev_close[ticker] = (today, prev_close)
+        return prev_close
+
+
+def _last_close_before(df, scan_date):
+    """(date, close) of the last bar dated before scan_date, or (None, None)."""
+    if df.empty:
+        return None, None
+    df_past = df[df.index.date < scan_date]
+    if df_past.empty:
+        return None, None
+    return df_past.index[-1].date(), float(df_past['Close'].iloc[-1])
+
+# Global Instance
+quote_engine = QuoteEngine()
@@ -0,0 +1,53 @@
+import pandas as pd
+
+# Coarser chart intervals and the base feed they are built from
+RESAMPLE_RULES = {
+    "5m": ("1m", "5min"),
+    "15m": ("1m", "15min"),
+    "30m": ("1m", "30min"),
+    "60m": ("1m", "60min"),
+    "1h": ("1m", "60min"),
+    "1wk": ("1d", "W-MON"),
+    "1mo": ("1d", "MS"),
+}
+
+OHLCV_AGG = {
+    'Open': 'first',
+    'High': 'max',
+    'Low': 'min',
+    'Close': 'last',
+    'Volume': 'sum',
+}
+
+
+def base_interval(interval):
+    """Interval of the feed that `interval` is resampled from (itself if none)."""
+    return RESAMPLE_RULES.get(interval, (interval, None))[0]
+
+
+def resample_ohlcv(df, interval):
+    """
+    Aggregates OHLCV bars into `interval` bars.
+    Bars are labelled by their start (weeks start Monday, months on the 1st),
+    intraday bins align to the hour so 60m bars start at 09:00.
+    Empty bins (lunch, nights, holidays) are dropped.
+    """
+    if interval not in RESAMPLE_RULES or df.empty:
+        return df
+    rule = RESAMPLE_RULES[interval][1]
+
+    agg = {c: OHLCV_AGG.get(c, 'last') for c in df.columns}
+    out = df.resample(rule, closed='left', label='left').agg(agg)
+    return out.dropna(subset=['Open'])
+
+
+def splice_bars(older, recent):
+    """
+    Native bars of `older` for the sessions before the first session of
+    `recent`, followed by `recent` (e.g. native 60m history + 60m bars
+    resampled from the 1m feed, which only reaches back 7 days).
+    """
+    if older.empty or recent.empty:
+        return recent if older.empty else older
+    first_day = recent.index[0].normalize()
+    return pd.concat([older[older.index.normalize() < first_day], recent])
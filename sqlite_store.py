@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import datetime
+
+# SQLite storage for users and per-user account state (local alternative to
+# the JSON files + Google Sheets path). Enable with STORAGE_BACKEND=sqlite.
+# WAL mode lets several Streamlit processes read while one writes; every
+# load/save touches only the rows of one user through indexed lookups.
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+DB_PATH = os.environ.get("SQLITE_DB_PATH", "tw_stock.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY,
+    balance REAL NOT NULL,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS positions (
+    username TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (username, symbol)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    time TEXT, action TEXT, stock TEXT,
+    price REAL, qty INTEGER, fee REAL, tax REAL, pnl REAL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (username, id);
+CREATE TABLE IF NOT EXISTS trade_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    line TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trade_log_user ON trade_log (username, id);
+CREATE TABLE IF NOT EXISTS watchlists (
+    username TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    symbols TEXT NOT NULL,
+    PRIMARY KEY (username, name)
+);
+CREATE TABLE IF NOT EXISTS bot_config (
+    username TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (username, key)
+);
+"""
+
+# transaction_history record keys <-> transactions columns
+TX_COLUMNS = [("Time", "time"), ("Action", "action"), ("Stock", "stock"), ("Price", "price"),
+              ("Qty", "qty"), ("Fee", "fee"), ("Tax", "tax"), ("P&L", "pnl")]
+
+
+def _num(v):
+    # numpy scalars -> python numbers for sqlite3
+    return v.item() if hasattr(v, "item") else v
+
+
+class SQLiteStore:
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    # --- Connections ---
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not shareable by default)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            d = os.path.dirname(self.db_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Durable across app crashes; WAL keeps it consistent
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    class _Tx:
+        def __init__(self, conn):
+            self.conn = conn
+        def __enter__(self):
+            # IMMEDIATE: take the write lock up front so concurrent writers queue instead of deadlocking
+            self.conn.execute("BEGIN IMMEDIATE")
+            return self.conn
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+            return False
+
+    def _write(self):
+        return SQLiteStore._Tx(self._conn())
+
+    # --- Users ---
+    def get_password_hash(self, username):
+        row = self._conn().execute("SELECT password_hash FROM users WHERE username=?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, password_hash):
+        """Returns False if the username is taken."""
+        try:
+            with self._write() as conn:
+                conn.execute("INSERT INTO users VALUES (?, ?, ?)", (username, password_hash, str(datetime.datetime.now())))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def all_users(self):
+        return dict(self._conn().execute("SELECT username, password_hash FROM users"))
+
+    # --- Account State ---
+    def load_state(self, username):
+        """User state in the save_data() dict layout, or None for an unknown user."""
+        conn = self._conn()
+        acc = conn.execute("SELECT balance FROM accounts WHERE username=?", (username,)).fetchone()
+        if not acc:
+            return None
+        keys = [k for k, _ in TX_COLUMNS]
+        cols = ", ".join(c for _, c in TX_COLUMNS)
+        return {
+            "balance": acc[0],
+            "inventory": {s: {"qty": q, "cost": c} for s, q, c in
+                          conn.execute("SELECT symbol, qty, cost FROM positions WHERE username=?", (username,))},
+            "transaction_history": [dict(zip(keys, r)) for r in
+                                    conn.execute(f"SELECT {cols} FROM transactions WHERE username=? ORDER BY id", (username,))],
+            "watchlists": {n: json.loads(s) for n, s in
+                           conn.execute("SELECT name, symbols FROM watchlists WHERE username=? ORDER BY position", (username,))},
+            "trade_log": [r[0] for r in conn.execute("SELECT line FROM trade_log WHERE username=? ORDER BY id", (username,))],
+            "bot_config": {k: json.loads(v) for k, v in
+                           conn.execute("SELECT key, value FROM bot_config WHERE username=?", (username,))},
+        }
+
+    def state_version(self, username):
+        """Changes with every write of the user's state (None for an unknown user)."""
+        row = self._conn().execute("SELECT updated_at FROM accounts WHERE username=?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def write_state(self, username, data):
+        """Replaces the whole state of a user (first save / after a history rewrite)."""
+        with self._write() as conn:
+            for table in ("positions", "transactions", "trade_log", "watchlists", "bot_config"):
+                conn.execute(f"DELETE FROM {table} WHERE username=?", (username,))
+            conn.execute("INSERT OR REPLACE INTO accounts VALUES (?, ?, ?)",
+                         (username, _num(data["balance"]), str(datetime.datetime.now())))
+            self._insert_changes(conn, username, {
+                "tx": data["transaction_history"],
+                "log": data["trade_log"],
+                "inventory": data["inventory"],
+                "watchlists": data["watchlists"],
+                "bot_config": data["bot_config"],
+            })
+
+    def apply_entry(self, username, entry):
+        """Applies a data_manager journal entry (only the changed rows) in one transaction."""
+        with self._write() as conn:
+            conn.execute("UPDATE accounts SET updated_at=? WHERE username=?", (str(datetime.datetime.now()), username))
+            if "balance" in entry:
+                conn.execute("UPDATE accounts SET balance=? WHERE username=?", (_num(entry["balance"]), username))
+            removed = entry.get("removed", {})
+            for sym in removed.get("inventory", []):
+                conn.execute("DELETE FROM positions WHERE username=? AND symbol=?", (username, sym))
+            for name in removed.get("watchlists", []):
+                conn.execute("DELETE FROM watchlists WHERE username=? AND name=?", (username, name))
+            for key in removed.get("bot_config", []):
+                conn.execute("DELETE FROM bot_config WHERE username=? AND key=?", (username, key))
+            self._insert_changes(conn, username, entry)
+
+    def _insert_changes(self, conn, username, entry):
+        if entry.get("tx"):
+            conn.executemany(
+                f"INSERT INTO transactions (username, {', '.join(c for _, c in TX_COLUMNS)}) VALUES (?{', ?' * len(TX_COLUMNS)})",
+                [(username, *(_num(r.get(k)) for k, _ in TX_COLUMNS)) for r in entry["tx"]])
+        if entry.get("log"):
+            conn.executemany("INSERT INTO trade_log (username, line) VALUES (?, ?)",
+                             [(username, str(line)) for line in entry["log"]])
+        if entry.get("inventory"):
+            conn.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?)",
+                             [(username, s, _num(v["qty"]), _num(v["cost"])) for s, v in entry["inventory"].items()])
+        if entry.get("watchlists"):
+            # Keep existing lists in place, append new ones at the end
+            next_pos = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM watchlists WHERE username=?",
+                                    (username,)).fetchone()[0]
+            for name, symbols in entry["watchlists"].items():
+                updated = conn.execute("UPDATE watchlists SET symbols=? WHERE username=? AND name=?",
+                                       (json.dumps(symbols, ensure_ascii=False), username, name)).rowcount
+                if not updated:
+                    conn.execute("INSERT INTO watchlists VALUES (?, ?, ?, ?)",
+                                 (username, name, next_pos, json.dumps(symbols, ensure_ascii=False)))
+                    next_pos += 1
+        if entry.get("bot_config"):
+            conn.executemany("INSERT OR REPLACE INTO bot_config VALUES (?, ?, ?)",
+                             [(username, k, json.dumps(v, ensure_ascii=False, default=_num)) for k, v in entry["bot_config"].items()])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Process-wide SQLiteStore (created on first use)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteStore()
+        return _store
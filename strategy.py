@@ -1,6 +1,38 @@
 import pandas as pd
 import numpy as np
 
+# Tunable thresholds per strategy (overridable per call; the optimizer searches around these).
+# MA_Cross and MACD_Strategy have none: their windows are fixed in calculate_indicators().
+DEFAULT_PARAMS = {
+    "RSI_Strategy": {"oversold": 30, "overbought": 70},
+    "KD_Strategy": {"oversold": 20, "overbought": 80},
+    "Bollinger_Strategy": {"num_std": 2},
+}
+
+def strategy_params(strategy_name, params=None):
+    """DEFAULT_PARAMS for the strategy, updated with `params`."""
+    merged = dict(DEFAULT_PARAMS.get(strategy_name, {}))
+    merged.update(params or {})
+    return merged
+
+def calculate_kd(rsv, seed=50.0):
+    """
+    K/D smoothing of an RSV array: K = 2/3 K + 1/3 RSV, D = 2/3 D + 1/3 K,
+    seeded at 50. NaN RSV rows report 50 and leave the state untouched.
+    Runs the recursion through pandas' compiled EWM over the valid rows
+    (same values as a Python loop, up to float rounding).
+    Returns: (k_array, d_array)
+    """
+    valid = ~np.isnan(rsv)
+    k = np.full(len(rsv), seed)
+    d = np.full(len(rsv), seed)
+    if valid.any():
+        k_valid = pd.Series(np.concatenate(([seed], rsv[valid]))).ewm(alpha=1/3, adjust=False).mean().to_numpy()[1:]
+        d_valid = pd.Series(np.concatenate(([seed], k_valid))).ewm(alpha=1/3, adjust=False).mean().to_numpy()[1:]
+        k[valid] = k_valid
+        d[valid] = d_valid
+    return k, d
+
 def calculate_indicators(df):
     """
     Calculates all technical indicators needed for strategies.
@@ -35,33 +67,17 @@ def calculate_indicators(df):
     high_max = df['High'].rolling(window=9).max()
     df['RSV'] = (df['Close'] - low_min) / (high_max - low_min) * 100
     
-    # Calculate K and D recursively (Loop for accuracy)
-    k_list = []
-    d_list = []
-    k = 50
-    d = 50
-    
-    # To improve speed, if df is large, this loop is slow.
-    # But for 1y daily data (~250 rows), it's negligible.
-    for rsv in df['RSV']:
-        if pd.isna(rsv):
-            k_list.append(50)
-            d_list.append(50)
-        else:
-            k = (2/3) * k + (1/3) * rsv
-            d = (2/3) * d + (1/3) * k
-            k_list.append(k)
-            d_list.append(d)
-            
-    df['K'] = k_list
-    df['D'] = d_list
+    # Calculate K and D recursively (vectorized, same values as the original loop)
+    df['K'], df['D'] = calculate_kd(df['RSV'].to_numpy(dtype=float))
 
     return df
 
-def get_signal(row, prev_row, strategy_name):
+def get_signal(row, prev_row, strategy_name, params=None):
     """
     Returns generic signal: 1 (Buy), -1 (Sell), 0 (Hold).
+    params: thresholds overriding DEFAULT_PARAMS (e.g. {"oversold": 25}).
     """
+    p = strategy_params(strategy_name, params)
     signal = 0
     
     if strategy_name == "MA_Cross":
@@ -71,9 +87,9 @@ def get_signal(row, prev_row, strategy_name):
             signal = -1
             
     elif strategy_name == "RSI_Strategy":
-        if prev_row['RSI'] < 30 and row['RSI'] >= 30:
+        if prev_row['RSI'] < p['oversold'] and row['RSI'] >= p['oversold']:
             signal = 1
-        elif prev_row['RSI'] > 70 and row['RSI'] <= 70:
+        elif prev_row['RSI'] > p['overbought'] and row['RSI'] <= p['overbought']:
             signal = -1
             
     elif strategy_name == "MACD_Strategy":
@@ -83,19 +99,59 @@ def get_signal(row, prev_row, strategy_name):
             signal = -1
             
     elif strategy_name == "Bollinger_Strategy":
-        if row['Close'] <= row['BB_Low']:
+        if row['Close'] <= row['BB_Mid'] - row['BB_Std'] * p['num_std']:
             signal = 1
-        elif row['Close'] >= row['BB_Up']:
+        elif row['Close'] >= row['BB_Mid'] + row['BB_Std'] * p['num_std']:
             signal = -1
             
     elif strategy_name == "KD_Strategy":
-        if prev_row['K'] < 20 and prev_row['K'] < prev_row['D'] and row['K'] > row['D']:
+        if prev_row['K'] < p['oversold'] and prev_row['K'] < prev_row['D'] and row['K'] > row['D']:
             signal = 1
-        elif prev_row['K'] > 80 and prev_row['K'] > prev_row['D'] and row['K'] < row['D']:
+        elif prev_row['K'] > p['overbought'] and prev_row['K'] > prev_row['D'] and row['K'] < row['D']:
             signal = -1
             
     return signal
 
+def get_signals(df, strategy_name, params=None):
+    """
+    Vectorized get_signal() over a whole indicator frame.
+    Element i equals get_signal(df.iloc[i], df.iloc[i-1], strategy_name, params); element 0 is 0.
+    """
+    p = strategy_params(strategy_name, params)
+    def cur(col):
+        return df[col].to_numpy(dtype=float)
+    def prev(col):
+        return np.concatenate(([np.nan], cur(col)[:-1]))
+    
+    buy = np.zeros(len(df), dtype=bool)
+    sell = np.zeros(len(df), dtype=bool)
+    
+    if strategy_name == "MA_Cross":
+        buy = (prev('MA5') < prev('MA20')) & (cur('MA5') > cur('MA20'))
+        sell = (prev('MA5') > prev('MA20')) & (cur('MA5') < cur('MA20'))
+        
+    elif strategy_name == "RSI_Strategy":
+        buy = (prev('RSI') < p['oversold']) & (cur('RSI') >= p['oversold'])
+        sell = (prev('RSI') > p['overbought']) & (cur('RSI') <= p['overbought'])
+        
+    elif strategy_name == "MACD_Strategy":
+        buy = (prev('DIF') < prev('DEM')) & (cur('DIF') > cur('DEM'))
+        sell = (prev('DIF') > prev('DEM')) & (cur('DIF') < cur('DEM'))
+        
+    elif strategy_name == "Bollinger_Strategy":
+        buy = cur('Close') <= cur('BB_Mid') - cur('BB_Std') * p['num_std']
+        sell = cur('Close') >= cur('BB_Mid') + cur('BB_Std') * p['num_std']
+        
+    elif strategy_name == "KD_Strategy":
+        buy = (prev('K') < p['oversold']) & (prev('K') < prev('D')) & (cur('K') > cur('D'))
+        sell = (prev('K') > p['overbought']) & (prev('K') > prev('D')) & (cur('K') < cur('D'))
+        
+    # Buy wins when both fire, like the if/elif in get_signal()
+    signals = np.where(buy, 1, np.where(sell, -1, 0))
+    if len(signals):
+        signals[0] = 0
+    return signals
+
 def get_strategy_status(df, strategy_name):
     """
     Returns a string describing strategy status.
@@ -0,0 +1,207 @@
+import math
+import threading
+from collections import deque
+
+# Incremental version of strategy.calculate_indicators().
+# A StreamingIndicators object keeps the rolling state (window sums, EMA values,
+# rolling min/max, K/D) for one (ticker, interval) and advances it one bar at a
+# time, so the bot only pays for the bars that are new since its last scan.
+
+
+class _State:
+    def __init__(self):
+        self.n = 0
+        self.prev_close = None
+        # MA5 / MA20 / Bollinger
+        self.win5 = deque(maxlen=5)
+        self.win20 = deque(maxlen=20)
+        self.sum5 = 0.0
+        self.sum20 = 0.0
+        # RSI (14)
+        self.gains = deque(maxlen=14)
+        self.losses = deque(maxlen=14)
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        # MACD (12, 26, 9)
+        self.ema12 = None
+        self.ema26 = None
+        self.dem = None
+        # KD (9, 3, 3): monotonic deques of (bar_no, value)
+        self.lows = deque()
+        self.highs = deque()
+        self.k = 50.0
+        self.d = 50.0
+
+    def copy(self):
+        new = _State.__new__(_State)
+        new.__dict__ = {k: (v.copy() if isinstance(v, deque) else v) for k, v in self.__dict__.items()}
+        return new
+
+
+def _push_window(win, total, value):
+    """Appends to a fixed-size window and returns the updated running sum."""
+    if len(win) == win.maxlen:
+        total -= win[0]
+    win.append(value)
+    return total + value
+
+
+def _ratio(num, den):
+    """num / den with pandas semantics (x/0 -> +-inf, 0/0 -> NaN)."""
+    if den == 0:
+        if num == 0 or math.isnan(num):
+            return math.nan
+        return math.copysign(math.inf, num)
+    return num / den
+
+
+class StreamingIndicators:
+    """
+    Streaming MA5/MA20/RSI/MACD/Bollinger/KD for one (ticker, interval).
+    update() costs O(1) in the length of the history (bounded by the 20-bar
+    window) and yields the same values as calculate_indicators() on the same
+    bars. Re-sending the last bar (a forming candle) replaces it.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_ts = None
+        self.rows = deque(maxlen=2) # last two indicator rows
+        self._state = _State()
+        self._prev = None           # (state, rows) before the last bar
+
+    def update(self, ts, bar):
+        """
+        Feeds one bar (dict-like with Open/High/Low/Close/Volume).
+        Returns the indicator row for it, or None if the bar is older than the last one.
+        """
+        if self.last_ts is not None:
+            if ts < self.last_ts:
+                return None
+            if ts == self.last_ts:
+                # Revision of the forming bar: roll back and re-apply
+                self._state, self.rows = self._prev
+        self._prev = (self._state.copy(), self.rows.copy())
+
+        row = self._advance(bar)
+        self.rows.append(row)
+        self.last_ts = ts
+        return row
+
+    def _advance(self, bar):
+        s = self._state
+        close = float(bar['Close'])
+        high = float(bar['High'])
+        low = float(bar['Low'])
+        s.n += 1
+        row = {k: bar[k] for k in ('Open', 'High', 'Low', 'Close', 'Volume') if k in bar}
+
+        # MA
+        s.sum5 = _push_window(s.win5, s.sum5, close)
+        s.sum20 = _push_window(s.win20, s.sum20, close)
+        row['MA5'] = s.sum5 / 5 if s.n >= 5 else math.nan
+        row['MA20'] = s.sum20 / 20 if s.n >= 20 else math.nan
+
+        # RSI (first bar has no delta and counts as 0 gain / 0 loss, like the batch version)
+        delta = 0.0 if s.prev_close is None else close - s.prev_close
+        s.gain_sum = _push_window(s.gains, s.gain_sum, delta if delta > 0 else 0.0)
+        s.loss_sum = _push_window(s.losses, s.loss_sum, -delta if delta < 0 else 0.0)
+        if s.n >= 14:
+            rs = _ratio(s.gain_sum / 14, s.loss_sum / 14)
+            row['RSI'] = 100 - (100 / (1 + rs))
+        else:
+            row['RSI'] = math.nan
+        s.prev_close = close
+
+        # MACD
+        a12, a26, a9 = 2 / 13, 2 / 27, 2 / 10
+        s.ema12 = close if s.ema12 is None else (1 - a12) * s.ema12 + a12 * close
+        s.ema26 = close if s.ema26 is None else (1 - a26) * s.ema26 + a26 * close
+        dif = s.ema12 - s.ema26
+        s.dem = dif if s.dem is None else (1 - a9) * s.dem + a9 * dif
+        row['DIF'] = dif
+        row['DEM'] = s.dem
+        row['MACD_Bar'] = dif - s.dem
+
+        # Bollinger Bands (20, 2)
+        if s.n >= 20:
+            mid = s.sum20 / 20
+            std = math.sqrt(sum((x - mid) ** 2 for x in s.win20) / 19)
+            row['BB_Mid'] = mid
+            row['BB_Std'] = std
+            row['BB_Up'] = mid + std * 2
+            row['BB_Low'] = mid - std * 2
+        else:
+            row['BB_Mid'] = row['BB_Std'] = row['BB_Up'] = row['BB_Low'] = math.nan
+
+        # KD: rolling 9-bar low/high via monotonic deques
+        while s.lows and s.lows[-1][1] >= low:
+            s.lows.pop()
+        s.lows.append((s.n, low))
+        while s.highs and s.highs[-1][1] <= high:
+            s.highs.pop()
+        s.highs.append((s.n, high))
+        while s.lows[0][0] <= s.n - 9:
+            s.lows.popleft()
+        while s.highs[0][0] <= s.n - 9:
+            s.highs.popleft()
+
+        if s.n >= 9:
+            low_min = s.lows[0][1]
+            high_max = s.highs[0][1]
+            rsv = _ratio(close - low_min, high_max - low_min) * 100
+        else:
+            rsv = math.nan
+        row['RSV'] = rsv
+        if math.isnan(rsv):
+            row['K'] = 50.0
+            row['D'] = 50.0
+        else:
+            s.k = (2/3) * s.k + (1/3) * rsv
+            s.d = (2/3) * s.d + (1/3) * s.k
+            row['K'] = s.k
+            row['D'] = s.d
+        return row
+
+    def last_rows(self):
+        """(curr_row, prev_row) for get_signal(), or None with fewer than two bars."""
+        if len(self.rows) < 2:
+            return None
+        return self.rows[-1], self.rows[-2]
+
+
+class IndicatorStreams:
+    """Process-wide registry of StreamingIndicators keyed by (ticker, interval)."""
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def get(self, ticker, interval):
+        key = (ticker, interval)
+        with self._lock:
+            if key not in self._streams:
+                self._streams[key] = (StreamingIndicators(), threading.Lock())
+            return self._streams[key]
+
+    def sync(self, ticker, interval, df):
+        """
+        Feeds the bars of df that the stream has not seen (plus the last seen
+        bar, which may have been revised) and returns (curr_row, prev_row).
+        A new stream, or one that fell behind the start of df, replays df once.
+        """
+        if df.empty:
+            return None
+        stream, lock = self.get(ticker, interval)
+        with lock:
+            if stream.last_ts is None or df.index[0] > stream.last_ts:
+                stream.reset()
+                new_bars = df
+            else:
+                new_bars = df[df.index >= stream.last_ts]
+            for ts, bar in zip(new_bars.index, new_bars.to_dict('records')):
+                stream.update(ts, bar)
+            return stream.last_rows()
+
+# Global Instance
+indicator_streams = IndicatorStreams()
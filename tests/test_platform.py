@@ -6,10 +6,44 @@ import numpy as np
 # Add parent dir to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Broker trades go to the global trade_log_queue: keep them out of the real
+# spool (data_cache/) and away from the real sheet
+import tempfile
+os.environ["TRADE_LOG_SPOOL"] = os.path.join(tempfile.mkdtemp(), "trade_log_spool.jsonl")
+from trade_log_queue import trade_log_queue
+
+class NullSheet:
+    def log_trades(self, sheet_name, rows):
+        return True
+
+trade_log_queue.handler = NullSheet()
+
 from broker import PaperBroker
-from data_manager import save_data, load_data
+from data_manager import save_data, load_data, pending_edits, active_bot_users
+import data_manager
+import sqlite_store
+import auth
+from gsheet_handler import gsheet_logger
 from strategy import calculate_indicators, get_signal
+from streaming_indicators import StreamingIndicators, IndicatorStreams
+from bot_engine import merge_bot_config
+from bot_runner import BotRunner, runner_status
+from bot_inbox import BotInbox
+from market_hub import MarketHub
+from instrumentation import Metrics
+from model_registry import ModelRegistry
+from batch_predict import plan_workers
 import datetime
+import json
+import time
+from bar_store import BarStore
+from resampler import resample_ohlcv, splice_bars
+import trading_calendar as tcal
+from backtest import BacktestEngine
+from optimizer import optimize, best_by_ticker, share_frame, _frame_from_spec
+from trade_log_queue import TradeLogQueue
+from gsheet_handler import GSheetHandler
+from fake_gspread import FakeClient
 
 def test_broker_ops():
     print("--- Testing Broker Operations ---")
@@ -50,24 +84,277 @@ def test_broker_ops():
     else:
         print(f"FAIL: {msg}")
 
+def test_trade_log_queue():
+    print("\n--- Testing Trade Log Write-Behind Queue ---")
+    class FlakySheet:
+        def __init__(self, fail_times):
+            self.fail_times = fail_times
+            self.batches = []
+        def log_trades(self, sheet_name, rows):
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                return False
+            self.batches.append(list(rows))
+            return True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = os.path.join(tmp, "spool.jsonl")
+        # Sheet down: rows are kept in the spool
+        q = TradeLogQueue(spool_path=spool, handler=FlakySheet(fail_times=99), flush_interval=60)
+        for i in range(5):
+            q.enqueue({"symbol": "2330.TW", "action": "現股買進", "price": np.float64(100 + i), "qty": np.int64(1000)})
+        assert not q.flush(timeout=5)
+        q.close()
+        with open(spool, encoding="utf-8") as f:
+            assert len(f.readlines()) == 5
+
+        # Next start: spooled rows go out in one batch after a retry
+        sheet = FlakySheet(fail_times=1)
+        q2 = TradeLogQueue(spool_path=spool, handler=sheet, flush_interval=60)
+        q2.enqueue({"symbol": "2317.TW", "action": "現股賣出", "price": 150, "qty": 2000})
+        q2.flush(timeout=5)
+        assert q2.flush(timeout=5)
+        assert len(sheet.batches) == 1 and len(sheet.batches[0]) == 6
+        assert [r[3] for r in sheet.batches[0]] == [100.0, 101.0, 102.0, 103.0, 104.0, 150]
+        q2.close()
+        with open(spool, encoding="utf-8") as f:
+            assert f.read() == ""
+
+        # No Sheets credentials: nothing is spooled and no writer is started
+        class NoSheet(FlakySheet):
+            def is_configured(self):
+                return False
+        q3 = TradeLogQueue(spool_path=spool, handler=NoSheet(fail_times=99), flush_interval=60)
+        q3.enqueue({"symbol": "2330.TW", "action": "現股買進", "price": 100, "qty": 1000})
+        assert q3.pending_count() == 0 and q3._thread is None and q3.flush(timeout=1)
+        # Credentials lost while running (connect() failed for good): the writer stops retrying
+        sheet = FlakySheet(fail_times=99)
+        q4 = TradeLogQueue(spool_path=spool, handler=sheet, flush_interval=60)
+        q4.enqueue({"symbol": "2330.TW", "action": "現股買進", "price": 100, "qty": 1000})
+        sheet.is_configured = lambda: False
+        assert not q4.flush(timeout=5)
+        q4._thread.join(timeout=5)
+        assert not q4._thread.is_alive() and q4.pending_count() == 1
+        q4.enqueue({"symbol": "2330.TW", "action": "現股買進", "price": 100, "qty": 1000})
+        assert q4.pending_count() == 1
+    print("PASS: Trades are spooled, retried and sent in one batch.")
+
+def test_gsheet_fake_backend():
+    print("\n--- Testing GSheetHandler on the Fake Sheets Backend ---")
+    handler = GSheetHandler(backend="fake")
+    handler.client = FakeClient(":memory:")
+    assert handler.is_configured()
+    assert not GSheetHandler(key_file=os.path.join(tempfile.gettempdir(), "no_such_key.json"), backend="google").is_configured()
+
+    for i in range(3):
+        assert handler.log_trade("Stock_Bot_Log", {"symbol": "2330.TW", "action": "現股買進", "price": 500 + i, "qty": 1000})
+    rows = handler.client.open("Stock_Bot_Log").sheet1.get_all_values()
+    assert rows[0][:3] == ["Date", "Symbol", "Action"] and len(rows) == 4
+
+    # Upserts: one ranged update per save once the row is known
+    assert handler.save_user_data("Stock_Bot_Log", "alice", {"balance": 1})
+    assert handler.save_user_data("Stock_Bot_Log", "bob", {"balance": 2})
+    calls = handler.client.calls
+    assert handler.save_user_data("Stock_Bot_Log", "alice", {"balance": 3})
+    assert handler.client.calls - calls == 1
+    assert handler.fetch_user_data("Stock_Bot_Log", "alice") == {"balance": 3}
+    assert handler.fetch_user_data("Stock_Bot_Log", "bob") == {"balance": 2}
+    assert len(handler.client.open("Stock_Bot_Log").worksheet("UserData").get_all_values()) == 3
+
+    # Quota errors fail the call and drop the cached handles
+    handler.client.error_rate = 1.0
+    assert not handler.log_trade("Stock_Bot_Log", {"symbol": "2330.TW"})
+    assert not handler._worksheets
+    print("PASS: Logging and upserts work against the fake backend.")
+
 def test_persistence():
     print("\n--- Testing Persistence ---")
-    broker = PaperBroker() # reset
-    broker.set_balance(5000)
-    broker.inventory = {"TEST": {"qty": 100, "cost": 10}}
-    watch = {"MyList": ["1111"]}
-    log = ["Log1"]
-    cfg = {"targets":["TEST"]}
-    
-    save_data(broker, watch, log, cfg)
-    
-    data = load_data()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp) # user_default.* files stay out of the repo
+            broker = PaperBroker() # reset
+            broker.set_balance(5000)
+            broker.inventory = {"TEST": {"qty": 100, "cost": 10}}
+            watch = {"MyList": ["1111"]}
+            log = ["Log1"]
+            cfg = {"targets":["TEST"]}
+            
+            save_data(broker, watch, log, cfg)
+            
+            data = load_data()
+        finally:
+            os.chdir(cwd)
+            data_manager._journals.clear()
     # Check
     if data['balance'] == 5000 and data['inventory']['TEST']['qty'] == 100:
         print("PASS: Save/Load Data Integrity Verified.")
     else:
         print("FAIL: Data mismatch.")
 
+def test_journal_persistence():
+    print("\n--- Testing Journaled Persistence ---")
+    cwd, client, every = os.getcwd(), gsheet_logger.client, data_manager.JOURNAL_COMPACT_EVERY
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp)
+            data_manager._journals.clear()
+            gsheet_logger.client = FakeClient(":memory:")
+
+            broker = PaperBroker(initial_balance=1000000)
+            watch = {"核心": ["2330.TW"], "暫存": ["2603.TW"]}
+            log = []
+            cfg = {"targets": ["2330.TW"], "sl_pct": 10.0}
+            save_data(broker, watch, log, cfg, username="journal") # First save: snapshot
+            snap_size = os.path.getsize("user_journal.json")
+
+            broker.buy("2330.TW", 500.0, 1000)
+            log.append("bought")
+            save_data(broker, watch, log, cfg, username="journal")
+            cfg["sl_pct"] = 5.0
+            del watch["暫存"]
+            save_data(broker, watch, log, cfg, username="journal")
+            save_data(broker, watch, log, cfg, username="journal") # No change: nothing written
+
+            with open("user_journal.journal.jsonl", encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f]
+            assert [e["seq"] for e in entries] == [2, 3]
+            assert len(entries[0]["tx"]) == 1 and "watchlists" not in entries[0]
+            assert entries[1]["bot_config"] == {"sl_pct": 5.0} and entries[1]["removed"] == {"watchlists": ["暫存"]}
+            assert os.path.getsize("user_journal.json") == snap_size
+
+            expected = {"balance": broker.balance, "inventory": broker.inventory,
+                        "transaction_history": broker.transaction_history,
+                        "watchlists": watch, "trade_log": log, "bot_config": cfg}
+            # Cloud: snapshot + the user's journal worksheet
+            data_manager._journals.clear()
+            assert json.loads(json.dumps(load_data("journal"))) == json.loads(json.dumps(expected))
+            # Local: snapshot + journal file
+            gsheet_logger.client.error_rate = 1.0
+            data_manager._journals.clear()
+            assert json.loads(json.dumps(load_data("journal"))) == json.loads(json.dumps(expected))
+
+            # Compaction folds the journal into the snapshot
+            gsheet_logger.client.error_rate = 0.0
+            data_manager.JOURNAL_COMPACT_EVERY = 2
+            for i in range(3):
+                log.append(f"line {i}")
+                save_data(broker, watch, log, cfg, username="journal")
+            with open("user_journal.json", encoding="utf-8") as f:
+                snap = json.load(f)
+            assert snap["trade_log"][:2] == ["bought", "line 0"] and snap["journal_seq"] > 3
+            # The cloud journal only keeps the rows since the last cloud snapshot
+            ws = gsheet_logger.client.open("Stock_Bot_Log").worksheet("Journal_journal")
+            assert len(ws.get_all_values()) - 1 == data_manager._journals["journal"]["cloud_since"] < 2
+            data_manager._journals.clear()
+            assert load_data("journal")["trade_log"] == log
+        finally:
+            os.chdir(cwd)
+            gsheet_logger.client = client
+            data_manager.JOURNAL_COMPACT_EVERY = every
+            data_manager._journals.clear()
+    print("PASS: Saves append deltas; snapshot + journal replay restores the state.")
+
+def test_persist_coordinator():
+    print("\n--- Testing Persist Coordinator ---")
+    cwd, client = os.getcwd(), gsheet_logger.client
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp)
+            data_manager._journals.clear()
+            gsheet_logger.client = FakeClient(":memory:")
+            coord = data_manager.PersistCoordinator(min_interval=0)
+
+            broker = PaperBroker(initial_balance=1000000)
+            watch, log, cfg = {"核心": ["2330.TW"]}, [], {"targets": []}
+            for i in range(10): # Bot cycle filling 10 symbols
+                broker.buy(f"{2330 + i}.TW", 10.0, 1000)
+                coord.mark_dirty(broker, watch, log, cfg, username="coord")
+            assert coord.flush("coord") and coord.saves == 1
+            assert not coord.flush("coord") # Nothing dirty
+            assert len(load_data("coord")["transaction_history"]) == 10
+
+            # Interval throttles regular flushes, force (logout) bypasses it
+            coord.min_interval = 3600
+            coord.mark_dirty(broker, watch, log, cfg, username="coord")
+            assert not coord.flush("coord") and coord.is_dirty("coord")
+            coord.flush_all()
+            assert coord.saves == 2 and not coord.is_dirty("coord")
+        finally:
+            os.chdir(cwd)
+            gsheet_logger.client = client
+            data_manager._journals.clear()
+    print("PASS: Ten marks coalesce into one save; interval and forced flush honored.")
+
+def test_user_directory():
+    print("\n--- Testing Cached User Directory ---")
+    cwd, client, directory = os.getcwd(), gsheet_logger.client, auth.user_directory
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp)
+            gsheet_logger.client = FakeClient(":memory:")
+            auth.user_directory = auth.UserDirectory(ttl=3600, miss_refresh=3600)
+
+            assert auth.register_user("dave", "pw")[0]
+            assert not auth.register_user("dave", "pw2")[0]
+            calls = gsheet_logger.client.calls
+            for _ in range(20):
+                assert auth.login_user("dave", "pw") and not auth.login_user("dave", "bad")
+            assert gsheet_logger.client.calls == calls # Served from the directory
+
+            # Stale copy is refetched (user registered by another instance)
+            gsheet_logger.register_user_db("Stock_Bot_Log", "erin", auth.hash_password("pw"))
+            assert not auth.login_user("erin", "pw")
+            auth.user_directory.miss_refresh = 0
+            assert auth.login_user("erin", "pw")
+        finally:
+            os.chdir(cwd)
+            gsheet_logger.client = client
+            auth.user_directory = directory
+    print("PASS: Logins hit the cached directory; registrations write through.")
+
+def test_sqlite_backend():
+    print("\n--- Testing SQLite Storage Backend ---")
+    backend, store = sqlite_store.STORAGE_BACKEND, sqlite_store._store
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            sqlite_store.STORAGE_BACKEND = "sqlite"
+            sqlite_store._store = sqlite_store.SQLiteStore(os.path.join(tmp, "test.db"))
+            data_manager._journals.clear()
+
+            ok, _ = auth.register_user("carol", "pw")
+            assert ok and not auth.register_user("carol", "pw2")[0]
+            assert auth.login_user("carol", "pw") and not auth.login_user("carol", "bad")
+
+            broker = PaperBroker(initial_balance=10000000)
+            watch = {"核心": ["2330.TW"], "暫存": []}
+            log, cfg = [], {"targets": ["2330.TW"], "strategies": {"2330.TW": "KD_Strategy"}}
+            assert save_data(broker, watch, log, cfg, username="carol")
+            broker.buy("2330.TW", 500.0, 2000)
+            broker.sell("2330.TW", 520.0, 1000)
+            log.append("filled")
+            watch["新清單"] = ["2454.TW"]
+            del watch["暫存"]
+            cfg["sl_pct"] = 7.5
+            assert save_data(broker, watch, log, cfg, username="carol")
+
+            conn = sqlite_store.get_store()._conn()
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("SELECT COUNT(*) FROM transactions WHERE username='carol'").fetchone()[0] == 2
+
+            data_manager._journals.clear()
+            data = load_data("carol")
+            assert data["balance"] == broker.balance
+            assert data["inventory"] == broker.inventory
+            assert data["transaction_history"] == broker.transaction_history
+            assert list(data["watchlists"]) == ["核心", "新清單"]
+            assert data["trade_log"] == log and data["bot_config"] == cfg
+            assert load_data("nobody") is None
+        finally:
+            sqlite_store.STORAGE_BACKEND, sqlite_store._store = backend, store
+            data_manager._journals.clear()
+    print("PASS: SQLite backend stores users and account state.")
+
 def test_strategy():
     print("\n--- Testing Strategy Logic ---")
     # Mock Data: Need Full OHLC for KD/BB
@@ -101,6 +388,375 @@ def test_strategy():
     else:
         print(f"FAIL: Signal not detected. Sig={sig}")
 
+def test_kd_vectorized():
+    print("\n--- Testing Vectorized KD ---")
+    rng = np.random.default_rng(1)
+    close = 100 + np.cumsum(rng.normal(0, 1, 500))
+    df = pd.DataFrame({'Close': close, 'High': close + 1, 'Low': close - 1, 'Open': close, 'Volume': 1000},
+                      index=pd.date_range('2022-01-01', periods=500))
+    df.iloc[100:110, df.columns.get_indexer(['High', 'Low', 'Close'])] = 100.0 # Flat range -> NaN RSV mid-series
+    df = calculate_indicators(df)
+
+    # Reference: the original recursive loop
+    k = d = 50
+    k_ref, d_ref = [], []
+    for rsv in df['RSV']:
+        if pd.isna(rsv):
+            k_ref.append(50); d_ref.append(50)
+        else:
+            k = (2/3) * k + (1/3) * rsv
+            d = (2/3) * d + (1/3) * k
+            k_ref.append(k); d_ref.append(d)
+
+    assert df['RSV'].isna().sum() > 8
+    assert np.allclose(df['K'], k_ref, rtol=0, atol=1e-9) and np.allclose(df['D'], d_ref, rtol=0, atol=1e-9)
+    print("PASS: Vectorized K/D matches the recursive loop.")
+
+def test_streaming_indicators():
+    print("\n--- Testing Streaming Indicators ---")
+    rng = np.random.default_rng(2)
+    close = 100 + np.cumsum(rng.normal(0, 1, 300))
+    df = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Volume': 1000},
+                      index=pd.date_range('2023-01-01', periods=300))
+    batch = calculate_indicators(df.copy())
+
+    stream = StreamingIndicators()
+    bars = df.to_dict('records')
+    for ts, bar in zip(df.index[:-1], bars[:-1]):
+        stream.update(ts, bar)
+    # Forming bar sent twice: the second version must replace the first
+    stream.update(df.index[-1], dict(bars[-1], Close=bars[-1]['Close'] + 5))
+    stream.update(df.index[-1], bars[-1])
+
+    curr, prev = stream.last_rows()
+    cols = ['MA5', 'MA20', 'RSI', 'DIF', 'DEM', 'MACD_Bar', 'BB_Up', 'BB_Low', 'K', 'D']
+    for col in cols:
+        assert np.isclose(curr[col], batch[col].iloc[-1], rtol=1e-9, atol=1e-9), col
+        assert np.isclose(prev[col], batch[col].iloc[-2], rtol=1e-9, atol=1e-9), col
+    print("PASS: Streaming indicators match calculate_indicators().")
+
+def test_backtest_vectorized():
+    print("\n--- Testing Vectorized Backtest ---")
+    rng = np.random.default_rng(3)
+    close = np.abs(100 + np.cumsum(rng.normal(0, 2, 800))) + 5
+    spread = rng.uniform(0.1, 2, 800)
+    df = pd.DataFrame({'Open': close, 'High': close + spread, 'Low': close - spread, 'Close': close, 'Volume': 1000},
+                      index=pd.date_range('2020-01-01', periods=800))
+
+    for strat in ["MA_Cross", "RSI_Strategy", "MACD_Strategy", "KD_Strategy", "Bollinger_Strategy"]:
+        engine = BacktestEngine(1000000)
+        eq_loop, tr_loop = engine.run_backtest(df, strat)
+        eq_vec, tr_vec = engine.run_backtest(df, strat, vectorized=True)
+        assert len(tr_loop) > 0, strat
+        pd.testing.assert_frame_equal(eq_loop, eq_vec)
+        pd.testing.assert_frame_equal(tr_loop, tr_vec)
+    print("PASS: Vectorized backtest matches the loop engine exactly.")
+
+def test_optimizer():
+    print("\n--- Testing Strategy Optimizer ---")
+    data = {}
+    for i, sym in enumerate(["2330.TW", "2317.TW", "2454.TW"]):
+        rng = np.random.default_rng(10 + i)
+        close = np.abs(100 + np.cumsum(rng.normal(0, 2, 300))) + 5
+        data[sym] = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Volume': 1000},
+                                 index=pd.date_range('2023-01-01', periods=300, tz='Asia/Taipei'))
+
+    progress = []
+    serial = optimize(data, max_workers=1)
+    pooled = optimize(data, max_workers=2, progress=lambda done, total: progress.append((done, total)))
+    pd.testing.assert_frame_equal(serial, pooled)
+    assert progress[-1] == (15, 15)
+
+    # Default thresholds reproduce a plain backtest
+    row = serial[(serial['Ticker'] == "2330.TW") & (serial['Strategy'] == "KD_Strategy")
+                 & (serial['Params'] == {"oversold": 20, "overbought": 80})].iloc[0]
+    engine = BacktestEngine(1000000)
+    kpis = engine.calculate_kpis(*engine.run_backtest(data["2330.TW"], "KD_Strategy"))
+    assert row['Total Return'] == kpis['Total Return']
+    assert set(best_by_ticker(serial)) == set(data)
+
+    # Shared blocks keep the dates whatever the index unit (pandas 3 parses to us)
+    for unit in ("ns", "us", "s"):
+        df = data["2330.TW"].set_axis(data["2330.TW"].index.as_unit(unit))
+        shm, spec = share_frame(df)
+        try:
+            pd.testing.assert_index_equal(_frame_from_spec(spec, shm).index, df.index)
+        finally:
+            shm.close()
+            shm.unlink()
+    print("PASS: Pooled optimizer matches serial run and plain backtests.")
+
+def test_bot_runner():
+    print("\n--- Testing Headless Bot Runner ---")
+    close = np.r_[np.linspace(100, 70, 59), 130.0] # MA5 crosses above MA20 on the last bar
+    df = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close, 'Volume': 1000},
+                      index=pd.date_range('2024-01-01', periods=60))
+    cwd, client = os.getcwd(), gsheet_logger.client
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp)
+            data_manager._journals.clear()
+            gsheet_logger.client = FakeClient(":memory:")
+            cfg = merge_bot_config({"targets": ["2330.TW"], "active": True})
+            save_data(PaperBroker(initial_balance=1000000), {}, [], cfg, username="frank")
+
+            save_data(PaperBroker(initial_balance=1000000), {}, [], merge_bot_config({}), username="grace")
+            assert active_bot_users() == ["frank"] # Only users with the bot on are visited
+
+            inbox = BotInbox(os.path.join(tmp, "inbox"))
+            runner = BotRunner(status_path=os.path.join(tmp, "status.json"),
+                               hub=MarketHub(fetch_many=lambda symbols, period, interval: {s: df for s in symbols}),
+                               streams=IndicatorStreams(), inbox=inbox)
+            runner.run_once()
+            data_manager._journals.clear()
+            data = load_data("frank")
+            assert data["inventory"]["2330.TW"]["qty"] == 1000 and len(data["trade_log"]) == 1
+            status = runner_status(runner.status_path)
+            assert status and list(status["users"]) == ["frank"] and status["users"]["frank"]["fills"] == 1
+
+            # Same bars again: the target is skipped without touching the indicators,
+            # and the cached state is reused (nothing changed on disk)
+            streams_seen, loads = runner.streams.get("2330.TW", "1d")[0].last_ts, runner.loads
+            assert runner.run_user("frank") == [] and runner._trackers["frank"].skipped == 1
+            assert runner.streams.get("2330.TW", "1d")[0].last_ts == streams_seen
+            assert runner.loads == loads
+
+            # Same bar, but other settings or another account state: evaluated again
+            tracker, state = runner._trackers["frank"], runner._states["frank"]
+            key = lambda cfg: tracker.bar_key("2330.TW", df, cfg, state["broker"])
+            assert not tracker.is_new("2330.TW", "1d", key(state["bot_config"]))
+            assert tracker.is_new("2330.TW", "1d", key(dict(state["bot_config"], sl_pct=1.0)))
+            assert tracker.is_new("2330.TW", "1d", key(dict(state["bot_config"], buy_qty={"2330.TW": 2000})))
+            state["broker"].balance += 1
+            assert tracker.is_new("2330.TW", "1d", key(state["bot_config"]))
+            state["broker"].balance -= 1
+
+            # Manual trade and config edit from a session go through the runner
+            trade_id = inbox.submit("frank", {"op": "trade", "side": "sell", "symbol": "2330.TW", "price": 130.0, "qty": 1000})
+            data_manager._journals.clear()
+            load_data("frank") # The session's view of the saved state
+            edit = pending_edits({"Tech": ["2454.TW"]}, [], dict(cfg, sl_pct=0.05), username="frank")
+            edit_id = inbox.submit("frank", {"op": "edit", "entry": edit})
+            runner.handle_commands()
+            assert inbox.wait("frank", trade_id, timeout=0)["ok"] and inbox.wait("frank", edit_id, timeout=0)["ok"]
+            assert inbox.pending_users() == [] and runner.loads == loads
+            data_manager._journals.clear()
+            data = load_data("frank")
+            assert data["inventory"]["2330.TW"]["qty"] == 0 and len(data["transaction_history"]) == 2
+            assert data["watchlists"] == {"Tech": ["2454.TW"]} and data["bot_config"]["sl_pct"] == 0.05
+
+            # A cancelled order is never filled; an order left too long is rejected, not filled late
+            buy = {"op": "trade", "side": "buy", "symbol": "2330.TW", "price": 130.0, "qty": 1000}
+            assert inbox.cancel("frank", inbox.submit("frank", buy))
+            late_id = inbox.submit("frank", buy)
+            assert inbox.take("frank", now=time.time() + 3600) == []
+            assert inbox.wait("frank", late_id, timeout=0) == {"ok": False, "msg": "expired"}
+            runner.handle_commands()
+            assert not inbox.cancel("frank", trade_id) # Already done: nothing left to cancel
+            assert runner._states["frank"]["broker"].inventory["2330.TW"]["qty"] == 0
+
+            # Bot switched off in the UI: the runner leaves the user alone
+            cfg["active"] = False
+            save_data(PaperBroker(initial_balance=1000000), {}, [], cfg, username="frank")
+            assert runner.run_user("frank") is None
+        finally:
+            os.chdir(cwd)
+            gsheet_logger.client = client
+            data_manager._journals.clear()
+    print("PASS: Runner trades active users from saved state and reports a heartbeat.")
+
+def test_market_hub():
+    print("\n--- Testing Market Data Hub ---")
+    calls = []
+    def fetch_many(tickers, period, interval):
+        calls.append(sorted(tickers))
+        return {t: pd.DataFrame({'Close': [1.0]}, index=pd.date_range('2024-01-01', periods=1)) for t in tickers if t != "GONE.TW"}
+
+    hub = MarketHub(fetch_many=fetch_many)
+    hub.subscribe("alice", ["2330.TW", "2317.TW"])
+    hub.subscribe("bob", ["2330.TW", "2454.TW", "GONE.TW"])
+    assert hub.subscriber_counts() == {"2330.TW": 2, "2317.TW": 1, "2454.TW": 1, "GONE.TW": 1}
+
+    a = hub.get_frames(["2330.TW", "2317.TW"])
+    b = hub.get_frames(["2330.TW", "2454.TW", "GONE.TW"])
+    # Alice's refresh brought Bob's tickers along; both get the same data
+    assert calls == [["2317.TW", "2330.TW", "2454.TW", "GONE.TW"]]
+    assert np.shares_memory(a["2330.TW"]['Close'].to_numpy(), b["2330.TW"]['Close'].to_numpy())
+    assert "GONE.TW" not in b
+    # An in-place edit by one subscriber stays in its own frame
+    a["2330.TW"].loc[a["2330.TW"].index[0], 'Close'] = -1.0
+    a["2330.TW"]['Extra'] = 0
+    assert b["2330.TW"]['Close'].iloc[0] == 1.0 and "Extra" not in b["2330.TW"]
+    assert hub.get_frames(["2330.TW"])["2330.TW"]['Close'].iloc[0] == 1.0
+
+    hub.unsubscribe("bob")
+    assert hub.subscriber_counts() == {"2330.TW": 1, "2317.TW": 1}
+    print("PASS: One download per refresh shared by all subscribers.")
+
+def test_instrumentation():
+    print("\n--- Testing Stage Instrumentation ---")
+    m = Metrics(window=100)
+    for ms in range(1, 101):
+        m.record("bot.fetch", ms / 1000)
+    try:
+        with m.span("bot.order"):
+            raise ValueError("no cash")
+    except ValueError:
+        pass
+    s = m.summary()
+    assert s["bot.fetch"]["count"] == 100 and abs(s["bot.fetch"]["p50"] - 0.051) < 1e-9
+    assert s["bot.fetch"]["p99"] == 0.1 and s["bot.order"]["errors"] == 1
+    assert s["bot.order"]["last_error"] == "ValueError: no cash"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metrics.txt")
+        assert m.export(path) and not m.export(path, min_interval=60)
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    assert 'tw_stage_seconds{stage="bot.fetch",quantile="0.5"} 0.051000' in text
+    assert 'tw_stage_errors_total{stage="bot.order"} 1' in text
+    print("PASS: Spans aggregate into percentiles and export as text.")
+
+def test_model_registry():
+    print("\n--- Testing Model Registry ---")
+    calls = []
+    def train(df):
+        calls.append(("train", len(df)))
+        return {"n": len(df)}
+    def update(state, df, new_bars):
+        calls.append(("update", new_bars))
+        return {"n": state["n"] + new_bars}
+
+    df = pd.DataFrame({'Close': np.arange(30.0)}, index=pd.date_range('2024-01-01', periods=30))
+    with tempfile.TemporaryDirectory() as tmp:
+        reg = ModelRegistry(model_dir=tmp, max_incremental=3, settled=lambda: True)
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:25], train, update) == ({"n": 25}, "miss")
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:25], train, update) == ({"n": 25}, "hit")
+        # Same last bar, revised close (a forming bar / an adjustment) -> full retrain
+        revised = df.iloc[:25].copy()
+        revised.iloc[-1, 0] += 1
+        assert reg.get_or_train("2330.TW", "xgb", revised, train, update)[1] == "miss"
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:25], train, update)[1] == "miss"
+        # Adjusted older bars plus new ones: not an incremental update
+        adjusted = df.iloc[:26] * 0.5
+        assert reg.get_or_train("2330.TW", "xgb", adjusted, train, update)[1] == "miss"
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:25], train, update)[1] == "miss"
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:27], train, update) == ({"n": 27}, "incremental")
+        # Other hyperparameters are another model
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:27], train, update, params={"d": 3})[1] == "miss"
+        # Past MAX_INCREMENTAL bars since the full fit -> full retrain
+        assert reg.get_or_train("2330.TW", "xgb", df.iloc[:29], train, update) == ({"n": 29}, "miss")
+        # Rewritten history (last trained bar no longer present) -> full retrain
+        shifted = df.iloc[:30].set_axis(pd.date_range('2023-01-01', periods=30))
+        assert reg.get_or_train("2330.TW", "xgb", shifted, train, update)[1] == "miss"
+        # State survives a new process (fresh registry on the same directory)
+        fresh = ModelRegistry(model_dir=tmp, settled=lambda: True)
+        assert fresh.get_or_train("2330.TW", "xgb", shifted, train, update)[1] == "hit"
+        # Unsettled data (market open): trained but not stored
+        unsettled = ModelRegistry(model_dir=tmp, settled=lambda: False)
+        assert unsettled.get_or_train("2330.TW", "xgb", shifted.iloc[:-1], train, update)[1] == "miss"
+        assert fresh.get_or_train("2330.TW", "xgb", shifted, train, update)[1] == "hit"
+    assert calls == [("train", 25), ("train", 25), ("train", 25), ("train", 26), ("train", 25), ("update", 2),
+                     ("train", 27), ("train", 29), ("train", 30), ("train", 29)]
+    assert reg.stats == {"hit": 1, "incremental": 1, "miss": 8}
+
+    # Sliding lookback window (prepare_data over now - period): the oldest bar
+    # drops out and every EWM feature changes, the raw bars stay the same
+    window = lambda start, end: df.iloc[start:end].assign(EMA=lambda d: d['Close'].ewm(span=5).mean())
+    calls.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        reg = ModelRegistry(model_dir=tmp, max_incremental=3, settled=lambda: True)
+        assert reg.get_or_train("2330.TW", "xgb", window(0, 20), train, update)[1] == "miss"
+        assert reg.get_or_train("2330.TW", "xgb", window(1, 21), train, update)[1] == "incremental"
+        assert reg.get_or_train("2330.TW", "xgb", window(2, 21), train, update)[1] == "hit"
+        assert reg.get_or_train("2330.TW", "xgb", window(3, 23), train, update)[1] == "incremental"
+    assert calls == [("train", 20), ("update", 1), ("update", 2)]
+    print("PASS: Hits, incremental updates and full retrains verified.")
+
+def test_batch_predict_plan():
+    print("\n--- Testing Batch Prediction Worker Plan ---")
+    # One worker per core, cores shared out as threads, never more workers than tickers
+    assert plan_workers(20, workers=0, cpus=8) == (8, 1)
+    assert plan_workers(2, workers=0, cpus=8) == (2, 4)
+    assert plan_workers(20, workers=3, cpus=8) == (3, 2)
+    assert plan_workers(1, workers=0, cpus=1) == (1, 1)
+    print("PASS: Workers x threads never exceed the cores.")
+
+def _prediction_engine():
+    """prediction_engine needs TensorFlow and Prophet: its tests are skipped without them."""
+    import pytest
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("prophet")
+    import prediction_engine
+    return prediction_engine
+
+def _feature_frame(features, periods=120):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(periods, len(features))), columns=features,
+                      index=pd.date_range('2023-01-02', periods=periods, freq='B'))
+    df['Close'] = 100 + rng.normal(size=periods).cumsum()
+    return df
+
+def test_xgboost_multi():
+    print("\n--- Testing Multi-Horizon XGBoost ---")
+    pe = _prediction_engine()
+    df = _feature_frame(pe.XGB_FEATURES)
+    model, results, scores, f_imp = pe.train_xgboost_multi(df, forecast_days=3)
+    # One column per horizon
+    assert model.predict(df.iloc[-2:][pe.XGB_FEATURES]).shape == (2, 3)
+    assert set(results) == set(scores) == {1, 2, 3} and set(f_imp) == set(pe.XGB_FEATURES)
+    # Each horizon is evaluated on train_xgboost()'s test rows
+    for h in (1, 2, 3):
+        single = pe.train_xgboost(df, horizon=h)[1]
+        assert results[h].index.equals(single.index) and results[h]['Actual'].equals(single['Actual'])
+    # Too short for the longest horizon
+    assert pe.train_xgboost_multi(df.iloc[:3], forecast_days=3)[0] is None
+    print("PASS: One model predicts every horizon on the single-horizon rows.")
+
+def test_cached_models():
+    print("\n--- Testing Incremental Model Updates ---")
+    pe = _prediction_engine()
+    df = _feature_frame(pe.XGB_FEATURES, periods=150)
+    df.index.name = 'Date'
+    with tempfile.TemporaryDirectory() as tmp:
+        reg = ModelRegistry(model_dir=tmp, settled=lambda: True)
+
+        # XGBoost: extra boosting rounds, and a full retrain when the update fails
+        assert pe.cached_xgboost_multi("T", df.iloc[:-2], 3, registry=reg)[-1] == "miss"
+        model, _, _, _, status = pe.cached_xgboost_multi("T", df.iloc[:-1], 3, registry=reg)
+        assert status == "incremental" and model.predict(df.iloc[-1:][pe.XGB_FEATURES]).shape == (1, 3)
+        def failing_update(*args, **kwargs):
+            raise ValueError("update failed")
+        update_xgboost_multi, pe.update_xgboost_multi = pe.update_xgboost_multi, failing_update
+        try:
+            assert pe.cached_xgboost_multi("T", df, 3, registry=reg)[-1] == "miss"
+        finally:
+            pe.update_xgboost_multi = update_xgboost_multi
+
+        # LSTM: fine-tuned on the new bar's sequence
+        res = pe.cached_lstm("T", df.iloc[:-1], forecast_days=2, seq_length=10, epochs=1, registry=reg)
+        assert res[-1] == "miss"
+        epochs = len(res[6].history['loss'])
+        res = pe.cached_lstm("T", df, forecast_days=2, seq_length=10, epochs=1, registry=reg)
+        assert res[-1] == "incremental" and len(res[5]) == 2
+        assert len(res[6].history['loss']) == epochs + pe.LSTM_FINE_TUNE_EPOCHS
+
+        # Prophet: refit warm-started from the stored parameters
+        inits = []
+        train_prophet = pe.train_prophet
+        def recording_train(df, forecast_days=5, init=None):
+            inits.append(init)
+            return train_prophet(df, forecast_days, init)
+        pe.train_prophet = recording_train
+        try:
+            assert pe.cached_prophet("T", df.iloc[:-1], 2, registry=reg)[-1] == "miss"
+            _, future_prices, _, _, status = pe.cached_prophet("T", df, 2, registry=reg)
+        finally:
+            pe.train_prophet = train_prophet
+        assert status == "incremental" and len(future_prices) == 2
+        assert inits[0] is None and set(inits[1]) == {"k", "m", "sigma_obs", "delta", "beta"}
+    print("PASS: XGBoost, LSTM and Prophet update incrementally; failed updates retrain.")
+
 def test_risk_mgmt():
     print("\n--- Testing Risk Management (Simulation) ---")
     # Scenario: Long 2330 @ 1000. Curr Price 800. SL 10%.
@@ -158,9 +814,140 @@ def test_watchlist():
     else:
          print("FAIL: Delete List Failed.")
 
+def test_bar_store():
+    print("\n--- Testing Bar Store (Incremental Fetch) ---")
+    idx = pd.date_range(end=pd.Timestamp.now(tz="Asia/Taipei").normalize(), periods=40, freq="D")
+    full = pd.DataFrame({
+        'Open': np.arange(40.0), 'High': np.arange(40.0) + 1, 'Low': np.arange(40.0) - 1,
+        'Close': np.arange(40.0), 'Volume': [1000] * 40
+    }, index=idx)
+    calls = []
+
+    def fetch(period=None, start=None):
+        calls.append((period, start))
+        if start is None:
+            return full.iloc[:-1] # Last bar not yet published
+        out = full[full.index.date >= start].copy()
+        out.loc[out.index[-1], 'Close'] = 99.0 # Latest bar revised
+        return out
+
+    store = BarStore(tempfile.mkdtemp())
+    first = store.sync("TEST.TW", "1d", "1mo", fetch)
+    # Pretend the first download happened before the last close so the store re-checks
+    store.save("TEST.TW", "1d", store.load("TEST.TW", "1d"), {"period": "1mo", "fetched_at": "2000-01-03T10:00:00+08:00"})
+    second = store.sync("TEST.TW", "1d", "1mo", fetch)
+
+    assert calls[0] == ("1mo", None), calls
+    # From the bar before the last stored one: a settled overlap bar to compare
+    assert calls[1][0] is None and calls[1][1] == idx[-3].date(), calls
+    assert second.index[-1] == idx[-1] and second['Close'].iloc[-1] == 99.0
+    assert not second.index.duplicated().any()
+    assert not [f for f in os.listdir(store.store_dir) if f.endswith(".tmp")] # Temp files renamed away
+
+    # Many tickers: one download per request kind instead of one per ticker
+    batch_calls = []
+    def fetch_many(tickers, period=None, start=None):
+        batch_calls.append((sorted(tickers), period, start))
+        return {t: fetch(period=period, start=start) for t in tickers}
+    store.save("TEST.TW", "1d", store.load("TEST.TW", "1d"), {"period": "1mo", "fetched_at": "2000-01-03T10:00:00+08:00"})
+    frames = store.sync_many(["TEST.TW", "NEW1.TW", "NEW2.TW"], "1d", "1mo", fetch_many)
+    assert batch_calls == [(["NEW1.TW", "NEW2.TW"], "1mo", None), (["TEST.TW"], None, idx[-2].date())], batch_calls
+    assert frames["TEST.TW"].equals(store.sync("TEST.TW", "1d", "1mo", fetch))
+    assert frames["NEW1.TW"].index[-1] == idx[-2]
+
+    # Dividend / split: yfinance adjusts the past prices, the overlap bar no
+    # longer matches and the whole history is downloaded again
+    def fetch_adjusted(period=None, start=None):
+        return fetch(period=period, start=start) * 0.9
+    store.save("TEST.TW", "1d", store.load("TEST.TW", "1d"), {"period": "1mo", "fetched_at": "2000-01-03T10:00:00+08:00"})
+    del calls[:]
+    adjusted = store.sync("TEST.TW", "1d", "1mo", fetch_adjusted)
+    assert calls == [(None, idx[-2].date()), ("1mo", None)], calls
+    assert np.allclose(adjusted['Close'].iloc[:-1], full['Close'].loc[adjusted.index[:-1]] * 0.9)
+    # Same in a batch (stored adjusted, fresh bars not)
+    store.save("TEST.TW", "1d", store.load("TEST.TW", "1d"), {"period": "1mo", "fetched_at": "2000-01-03T10:00:00+08:00"})
+    del batch_calls[:]
+    frames = store.sync_many(["TEST.TW"], "1d", "1mo", fetch_many)
+    assert batch_calls == [(["TEST.TW"], None, idx[-3].date()), (["TEST.TW"], "1mo", None)], batch_calls
+    assert frames["TEST.TW"]['Close'].iloc[0] == full['Close'].loc[frames["TEST.TW"].index[0]]
+    print(f"PASS: Incremental sync fetched from {idx[-3].date()}, {len(first)} -> {len(second)} bars.")
+
+def test_resample():
+    print("\n--- Testing Timeframe Resampling ---")
+    idx = pd.date_range("2024-01-02 09:00", "2024-01-02 13:29", freq="1min", tz="Asia/Taipei")
+    n = len(idx)
+    df = pd.DataFrame({
+        'Open': np.arange(n, dtype=float), 'High': np.arange(n) + 1.0,
+        'Low': np.arange(n) - 1.0, 'Close': np.arange(n) + 0.5, 'Volume': [1] * n
+    }, index=idx)
+
+    bars = resample_ohlcv(df, "60m")
+    first = bars.iloc[0]
+    assert len(bars) == 5 and bars.index[0].hour == 9
+    assert (first['Open'], first['High'], first['Low'], first['Close'], first['Volume']) == (0.0, 60.0, -1.0, 59.5, 60)
+    assert bars['Volume'].sum() == n
+    print(f"PASS: {n} x 1m bars -> {len(bars)} x 60m bars with OHLCV preserved.")
+
+    # Native 60m history before the 1m feed's first session, resampled bars after
+    native = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 10},
+                          index=pd.date_range("2023-12-28 09:00", "2024-01-02 13:00", freq="1h", tz="Asia/Taipei"))
+    spliced = splice_bars(native, bars)
+    assert spliced.index[0] == native.index[0] and spliced.index.is_monotonic_increasing
+    assert spliced.loc["2024-01-02"].equals(bars) and len(spliced) == len(native[native.index < "2024-01-02"]) + len(bars)
+
+    days = pd.date_range("2024-01-01", "2024-02-29", freq="B", tz="Asia/Taipei")
+    daily = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 10}, index=days)
+    weekly = resample_ohlcv(daily, "1wk")
+    monthly = resample_ohlcv(daily, "1mo")
+    assert all(d.weekday() == 0 for d in weekly.index)
+    assert list(monthly['Volume']) == [10 * 23, 10 * 21]
+    print("PASS: Weekly/Monthly bars built from daily bars.")
+
+def test_trading_calendar():
+    print("\n--- Testing TWSE Trading Calendar ---")
+    tz = tcal.TAIPEI
+    fri_open = datetime.datetime(2024, 3, 1, 10, 0, tzinfo=tz)
+    fri_night = datetime.datetime(2024, 3, 1, 20, 0, tzinfo=tz)
+    sat = datetime.datetime(2024, 3, 2, 12, 0, tzinfo=tz)
+    before_holiday = datetime.datetime(2026, 9, 24, 15, 0, tzinfo=tz) # Thu, Fri 9/25 is Mid-Autumn
+
+    assert tcal.is_market_open(fri_open) and not tcal.is_market_open(fri_night) and not tcal.is_market_open(sat)
+    assert tcal.next_session_open(sat) == datetime.datetime(2024, 3, 4, 9, 0, tzinfo=tz)
+    assert tcal.next_session_open(before_holiday) == datetime.datetime(2026, 9, 29, 9, 0, tzinfo=tz) # 9/28 is Teacher's Day
+    assert tcal.cache_ttl(60, fri_open) == 60
+    assert tcal.cache_ttl(60, sat) == (datetime.datetime(2024, 3, 4, 9, 0, tzinfo=tz) - sat).total_seconds()
+    assert tcal.cache_epoch(60, fri_night) == tcal.cache_epoch(60, sat)
+    assert tcal.is_data_settled(fri_night, sat) and not tcal.is_data_settled(fri_open, sat)
+    print("PASS: Sessions, holidays and calendar-aware TTLs verified.")
+
 if __name__ == "__main__":
     test_broker_ops()
+    test_trade_log_queue()
+    test_gsheet_fake_backend()
     test_persistence()
+    test_journal_persistence()
+    test_persist_coordinator()
+    test_user_directory()
+    test_sqlite_backend()
     test_strategy()
+    test_kd_vectorized()
+    test_streaming_indicators()
+    test_backtest_vectorized()
+    test_optimizer()
+    test_bot_runner()
+    test_market_hub()
+    test_instrumentation()
+    test_model_registry()
+    test_batch_predict_plan()
     test_risk_mgmt()
     test_watchlist()
+    test_bar_store()
+    test_resample()
+    test_trading_calendar()
+    # Need TensorFlow and Prophet: report the skip and finish the run without them
+    import pytest
+    for test in (test_xgboost_multi, test_cached_models):
+        try:
+            test()
+        except pytest.skip.Exception as e:
+            print(f"SKIP: {test.__name__} ({e})")
@@ -0,0 +1,202 @@
+import atexit
+import json
+import os
+import threading
+import time
+from gsheet_handler import gsheet_logger, format_trade_row
+
+# Write-behind queue for the Google Sheets trade log.
+# PaperBroker enqueues a row and returns immediately; a background thread
+# sends the rows in batches with append_rows(). Pending rows are kept in a
+# local JSONL spool so they survive a crash or restart and are sent on the
+# next start. Without a Sheets backend (no credentials) nothing is queued.
+
+SPOOL_PATH = os.environ.get("TRADE_LOG_SPOOL", os.path.join("data_cache", "trade_log_spool.jsonl"))
+
+
+def _json_default(o):
+    # numpy scalars (prices/quantities coming from DataFrames)
+    if hasattr(o, "item"):
+        return o.item()
+    return str(o)
+
+
+class TradeLogQueue:
+    def __init__(self, sheet_name="Stock_Bot_Log", spool_path=SPOOL_PATH, handler=None,
+                 batch_size=100, flush_interval=2.0, max_backoff=60.0, max_pending=10000):
+        self.sheet_name = sheet_name
+        self.spool_path = spool_path
+        self.handler = handler or gsheet_logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+
+        self._pending = self._load_spool()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._flush_requested = False
+        self._attempts = 0 # Completed send attempts (flush() waits on this)
+        self._failures = 0 # Consecutive failed attempts (backoff)
+        self._sending = 0  # Rows at the head of _pending currently being sent
+        self._disabled = False
+
+        # Rows left over from a previous run go out right away
+        if self._pending and self._configured():
+            with self._cond:
+                self._ensure_worker()
+
+    def _configured(self):
+        is_configured = getattr(self.handler, "is_configured", None)
+        return is_configured is None or is_configured()
+
+    # --- Spool ---
+    def _load_spool(self):
+        if not os.path.exists(self.spool_path):
+            return []
+        rows = []
+        try:
+            with open(self.spool_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        rows.append(json.loads(line))
+        except Exception as e:
+            print(f"Trade Log Spool Read Error: {e}")
+        return rows
+
+    def _append_spool(self, row):
+        d = os.path.dirname(self.spool_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def _rewrite_spool(self):
+        tmp = self.spool_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row in self._pending:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.spool_path)
+
+    # --- Producer side ---
+    def enqueue(self, trade_data):
+        """Queues one trade (same dict as GSheetHandler.log_trade). Never blocks on the network."""
+        if self._disabled:
+            return
+        if not self._configured():
+            # No backend: retrying forever would only grow the spool
+            self._disabled = True
+            print("Trade Log Queue Disabled: no Google Sheets credentials")
+            return
+        row = json.loads(json.dumps(format_trade_row(trade_data), default=_json_default))
+        with self._cond:
+            self._pending.append(row)
+            if len(self._pending) > self.max_pending:
+                # Drop a tenth of the backlog at once so the spool rewrite stays amortized
+                dropped = max(1, self.max_pending // 10)
+                del self._pending[self._sending:self._sending + dropped]
+                print(f"Trade Log Queue Full: dropped {dropped} oldest rows")
+                try:
+                    self._rewrite_spool()
+                except Exception as e:
+                    print(f"Trade Log Spool Write Error: {e}")
+            else:
+                try:
+                    self._append_spool(row)
+                except Exception as e:
+                    print(f"Trade Log Spool Write Error: {e}")
+            self._ensure_worker()
+            # First row wakes the idle worker (starts the flush timer); a full batch goes now
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self, timeout=10.0):
+        """
+        Asks the worker to send now and waits until the queue is empty or one
+        send attempt has finished. Returns True if nothing is left pending.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            if not self._pending or self._disabled:
+                return not self._pending
+            self._ensure_worker()
+            start = self._attempts
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending and self._attempts == start:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return not self._pending
+
+    # --- Worker ---
+    def _ensure_worker(self):
+        # Called with self._cond held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="trade-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Idle: sleep until a row arrives instead of waking every flush_interval
+                self._cond.wait_for(lambda: self._stopping or self._pending)
+                if self._stopping:
+                    return
+                if self._failures:
+                    delay = min(self.max_backoff, self.flush_interval * (2 ** self._failures))
+                else:
+                    delay = self.flush_interval
+                # Wake on timer, full batch or flush(); flush() overrides the backoff
+                self._cond.wait_for(lambda: self._stopping or self._flush_requested
+                                    or (not self._failures and len(self._pending) >= self.batch_size), timeout=delay)
+                if self._stopping:
+                    return
+                self._flush_requested = False
+                batch = self._pending[:self.batch_size]
+                self._sending = len(batch)
+            if not batch:
+                continue
+
+            ok = False
+            try:
+                ok = self.handler.log_trades(self.sheet_name, batch)
+            except Exception as e:
+                print(f"Trade Log Flush Error: {e}")
+
+            with self._cond:
+                if ok:
+                    # Rows enqueued meanwhile stay behind the sent batch
+                    del self._pending[:len(batch)]
+                    self._failures = 0
+                    try:
+                        self._rewrite_spool()
+                    except Exception as e:
+                        print(f"Trade Log Spool Write Error: {e}")
+                else:
+                    self._failures += 1
+                    # e.g. connect() found no credentials: stop retrying, the spool waits for the next start
+                    self._disabled = not self._configured()
+                self._sending = 0
+                self._attempts += 1
+                self._cond.notify_all()
+                if self._disabled:
+                    return
+
+    def close(self, timeout=5.0):
+        """Final flush (one attempt) and worker shutdown; unsent rows stay in the spool."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+# Global Instance
+trade_log_queue = TradeLogQueue()
+atexit.register(trade_log_queue.close)
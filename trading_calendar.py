@@ -0,0 +1,132 @@
+import datetime
+
+# TWSE trading calendar: regular session 09:00-13:30 (Asia/Taipei), Mon-Fri,
+# closed on the exchange holidays below.
+
+TAIPEI = datetime.timezone(datetime.timedelta(hours=8))
+
+SESSION_OPEN = datetime.time(9, 0)
+SESSION_CLOSE = datetime.time(13, 30)
+
+# Quotes keep changing for a while after the bell (closing auction results,
+# delayed yfinance feed), so caches stay short-lived until this time.
+SETTLE_TIME = datetime.time(14, 30)
+
+# Market closures announced by TWSE (update every year from the TWSE calendar).
+# Typhoon closures are not predictable; add them with add_holidays().
+TWSE_HOLIDAYS = {
+    # 2025
+    datetime.date(2025, 1, 1),
+    datetime.date(2025, 1, 23), datetime.date(2025, 1, 24),
+    datetime.date(2025, 1, 27), datetime.date(2025, 1, 28), datetime.date(2025, 1, 29),
+    datetime.date(2025, 1, 30), datetime.date(2025, 1, 31),
+    datetime.date(2025, 2, 28),
+    datetime.date(2025, 4, 3), datetime.date(2025, 4, 4),
+    datetime.date(2025, 5, 1),
+    datetime.date(2025, 5, 30),
+    datetime.date(2025, 9, 29),
+    datetime.date(2025, 10, 6),
+    datetime.date(2025, 10, 10),
+    datetime.date(2025, 10, 24),
+    datetime.date(2025, 12, 25),
+    # 2026
+    datetime.date(2026, 1, 1),
+    datetime.date(2026, 2, 12), datetime.date(2026, 2, 13),
+    datetime.date(2026, 2, 16), datetime.date(2026, 2, 17), datetime.date(2026, 2, 18),
+    datetime.date(2026, 2, 19), datetime.date(2026, 2, 20),
+    datetime.date(2026, 2, 27),
+    datetime.date(2026, 4, 3), datetime.date(2026, 4, 6),
+    datetime.date(2026, 5, 1),
+    datetime.date(2026, 6, 19),
+    datetime.date(2026, 9, 25),
+    datetime.date(2026, 9, 28),
+    datetime.date(2026, 10, 9),
+    datetime.date(2026, 10, 26),
+    datetime.date(2026, 12, 25),
+}
+
+
+def add_holidays(dates):
+    """Registers extra closures (e.g. typhoon days)."""
+    TWSE_HOLIDAYS.update(dates)
+
+
+def now_taipei():
+    return datetime.datetime.now(TAIPEI)
+
+
+def _as_taipei(now):
+    if now is None:
+        return now_taipei()
+    if now.tzinfo is None:
+        return now.replace(tzinfo=TAIPEI)
+    return now.astimezone(TAIPEI)
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in TWSE_HOLIDAYS
+
+
+def is_market_open(now=None):
+    """True during the regular session (09:00-13:30 on a trading day)."""
+    now = _as_taipei(now)
+    return is_trading_day(now.date()) and SESSION_OPEN <= now.time() < SESSION_CLOSE
+
+
+def is_market_active(now=None):
+    """True from the open until quotes have settled after the close."""
+    now = _as_taipei(now)
+    return is_trading_day(now.date()) and SESSION_OPEN <= now.time() < SETTLE_TIME
+
+
+def next_session_open(now=None):
+    """Start of the next session strictly after `now`."""
+    now = _as_taipei(now)
+    day = now.date()
+    if now.time() >= SESSION_OPEN:
+        day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, SESSION_OPEN, tzinfo=TAIPEI)
+
+
+def last_settle_time(now=None):
+    """Most recent moment the market data settled (SETTLE_TIME of the last session)."""
+    now = _as_taipei(now)
+    day = now.date()
+    if now.time() < SETTLE_TIME:
+        day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, SETTLE_TIME, tzinfo=TAIPEI)
+
+
+def cache_ttl(open_ttl, now=None):
+    """
+    Seconds market data may be cached: `open_ttl` while the market is active,
+    otherwise until the next session opens.
+    """
+    now = _as_taipei(now)
+    if is_market_active(now):
+        return open_ttl
+    return max(open_ttl, (next_session_open(now) - now).total_seconds())
+
+
+def cache_epoch(open_ttl, now=None):
+    """
+    Cache key that changes every `open_ttl` seconds while the market is active
+    and stays fixed until the next open otherwise. Pass it as an extra argument
+    to st.cache_data functions to get calendar-aware expiry.
+    """
+    now = _as_taipei(now)
+    if is_market_active(now):
+        return f"open-{int(now.timestamp() // open_ttl)}"
+    return f"closed-{next_session_open(now).isoformat()}"
+
+
+def is_data_settled(fetched_at, now=None):
+    """True if data fetched at `fetched_at` cannot have changed since (market idle)."""
+    now = _as_taipei(now)
+    if is_market_active(now):
+        return False
+    return _as_taipei(fetched_at) >= last_settle_time(now)
@@ -3,60 +3,149 @@ import requests
 import yfinance as yf
 import datetime
 import streamlit as st
+from bar_store import bar_store, INTRADAY_MAX_DAYS, period_days
+from resampler import base_interval, resample_ohlcv, splice_bars
+from trading_calendar import cache_epoch
 
-@st.cache_data(ttl=60)
-def get_stock_data(ticker, period="1y", interval="1d"):
+def _download_ohlcv(ticker, interval="1d", period=None, start=None):
     """
     Robust wrapper for yfinance download.
     Handles MultiIndex columns (ticker levels) and ensures clean OHLCV format.
+    Pass either `period` (full download) or `start` (incremental download).
     """
-    try:
-        # Download
+    # Download
+    if start is not None:
+        df = yf.download(ticker, start=start, interval=interval, progress=False)
+    else:
         df = yf.download(ticker, period=period, interval=interval, progress=False)
-        
-        if df.empty:
-            return df
-            
-        # Handle MultiIndex Columns (feature of yf 0.2+)
-        # If columns are (Price, Ticker), drop the Ticker level
-        if isinstance(df.columns, pd.MultiIndex):
-            # Attempt to flatten or drop level
-            # Check if levels > 1
-            if df.columns.nlevels > 1:
-                df.columns = df.columns.droplevel(1) # Drop Ticker level
-        
-        # Ensure standard columns exist
-        needed = ['Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in df.columns for col in needed):
-            pass
-            
-        # Ensure numeric
-        for col in needed:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        df = df.dropna()
-        
-        # --- TIMEZONE FIX ---
-        # yfinance returns UTC. Convert to Asia/Taipei
-        if df.index.tz is None:
-             # Assume UTC if naive, or localize? yfinance usually returns tz-aware UTC
-             try:
-                 df.index = df.index.tz_localize('UTC')
-             except:
-                 pass # Already aware?
-                 
-        try:
-             df.index = df.index.tz_convert('Asia/Taipei')
-        except:
-             pass 
-
+    
+    if df.empty:
         return df
         
+    # Handle MultiIndex Columns (feature of yf 0.2+)
+    # If columns are (Price, Ticker), drop the Ticker level
+    if isinstance(df.columns, pd.MultiIndex):
+        # Attempt to flatten or drop level
+        # Check if levels > 1
+        if df.columns.nlevels > 1:
+            df.columns = df.columns.droplevel(1) # Drop Ticker level
+    
+    return _clean_ohlcv(df)
+
+def _clean_ohlcv(df):
+    """Numeric OHLCV without NaN rows, indexed in Asia/Taipei time."""
+    # Ensure numeric
+    needed = ['Open', 'High', 'Low', 'Close', 'Volume']
+    for col in needed:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    
+    df = df.dropna()
+    
+    # --- TIMEZONE FIX ---
+    # yfinance returns UTC. Convert to Asia/Taipei
+    if df.index.tz is None:
+         # Assume UTC if naive, or localize? yfinance usually returns tz-aware UTC
+         try:
+             df.index = df.index.tz_localize('UTC')
+         except:
+             pass # Already aware?
+             
+    try:
+         df.index = df.index.tz_convert('Asia/Taipei')
+    except:
+         pass 
+
+    return df
+
+def _download_ohlcv_many(tickers, interval="1d", period=None, start=None):
+    """
+    One multi-ticker yfinance download split into {ticker: clean OHLCV frame}.
+    Tickers without data are omitted.
+    """
+    tickers = list(tickers)
+    if len(tickers) == 1:
+        df = _download_ohlcv(tickers[0], interval, period=period, start=start)
+        return {tickers[0]: df} if not df.empty else {}
+
+    if start is not None:
+        df = yf.download(tickers, start=start, interval=interval, progress=False, group_by="ticker")
+    else:
+        df = yf.download(tickers, period=period, interval=interval, progress=False, group_by="ticker")
+    if df.empty or not isinstance(df.columns, pd.MultiIndex):
+        return {}
+
+    out = {}
+    present = set(df.columns.get_level_values(0))
+    for t in tickers:
+        if t not in present:
+            continue
+        # Rows of other tickers' sessions are all-NaN for this one
+        sub = _clean_ohlcv(df[t].dropna(how="all").copy())
+        if not sub.empty:
+            out[t] = sub
+    return out
+
+# Market data caches expire on the TWSE calendar: every N seconds while the
+# market is active, and not until the next open after hours / on holidays.
+# The `epoch` argument (from trading_calendar.cache_epoch) is what rotates them.
+
+def get_stock_data(ticker, period="1y", interval="1d"):
+    """
+    Returns OHLCV bars for `period`, served from the local bar store.
+    Only the bars after the last stored timestamp are downloaded.
+    """
+    return _get_stock_data(ticker, period, interval, cache_epoch(60))
+
+@st.cache_data(max_entries=1000)
+def _get_stock_data(ticker, period, interval, epoch):
+    try:
+        return bar_store.sync(
+            ticker, interval, period,
+            lambda period=None, start=None: _download_ohlcv(ticker, interval, period=period, start=start)
+        )
     except Exception as e:
         print(f"Data Fetch Error {ticker}: {e}")
         return pd.DataFrame()
 
+def get_stock_data_batch(tickers, period="1y", interval="1d"):
+    """
+    {ticker: OHLCV bars} for many tickers. Bars missing from the bar store
+    are fetched with one multi-ticker download instead of one per ticker.
+    Not st.cache_data'd: the bots share the results through market_hub.
+    """
+    try:
+        return bar_store.sync_many(
+            list(dict.fromkeys(tickers)), interval, period,
+            lambda tickers, period=None, start=None: _download_ohlcv_many(tickers, interval, period=period, start=start)
+        )
+    except Exception as e:
+        print(f"Batch Data Fetch Error: {e}")
+        return {}
+
+def get_chart_data(ticker, period="6mo", interval="1d"):
+    """
+    Chart bars for any timeframe.
+    5m-60m bars are resampled from the stored 1m feed and weekly/monthly bars
+    from the stored daily feed, so switching timeframes is a local computation.
+    Periods longer than the 1m feed reaches back (60m over 1mo) take the
+    older sessions from the native interval's stored bars.
+    """
+    return _get_chart_data(ticker, period, interval, cache_epoch(60))
+
+@st.cache_data(max_entries=200)
+def _get_chart_data(ticker, period, interval, epoch):
+    base = base_interval(interval)
+    df = get_stock_data(ticker, period=period, interval=base)
+    if base == interval:
+        return df
+    bars = resample_ohlcv(df, interval)
+    max_days = INTRADAY_MAX_DAYS.get(base)
+    if max_days is not None and period_days(period) > max_days:
+        # The 1m feed only reaches back max_days: older sessions come from the native feed
+        bars = splice_bars(get_stock_data(ticker, period=period, interval=interval), bars)
+    return bars
+
 def get_latest_price(ticker):
     """
     Returns the latest Close price as a scalar float.
@@ -84,109 +173,57 @@ def get_latest_price(ticker):
     except:
         return 0.0
 
-def get_realtime_quote(ticker):
+def _last_closes(df, tickers):
+    """Maps each ticker to its last non-NaN Close in a (multi-ticker) download."""
+    if df.empty:
+        return {}
+    if isinstance(df.columns, pd.MultiIndex):
+        closes = df['Close']
+    else:
+        closes = df[['Close']].rename(columns={'Close': tickers[0]})
+    
+    out = {}
+    for t in closes.columns:
+        s = pd.to_numeric(closes[t], errors='coerce').dropna()
+        if not s.empty:
+            out[t] = float(s.iloc[-1])
+    return out
+
+def get_price_snapshot(tickers):
     """
-    Returns a dict with: 'price', 'change', 'pct', 'time_str'
-    Uses 1m data for latest price, and Daily data for Previous Close.
+    Returns {ticker: last price} for many tickers at once.
+    One multi-ticker 1m download, plus one daily download for any ticker
+    without intraday bars (e.g. before the open). Missing tickers are omitted.
     """
-    try:
-        # 1. Get History (Daily) - Primary
-        df_d = get_stock_data(ticker, period="1mo", interval="1d")
-        
-        # 2. Get History (Hourly) - Fallback for recent gaps (common in yfinance)
-        df_h = get_stock_data(ticker, period="5d", interval="60m")
-        
-        # Setup Timezone & Dates
-        try:
-             now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=8)))
-             today_date = now.date()
-        except:
-             today_date = datetime.date.today()
-
-        def get_last_close_before_today(df, scan_date):
-            if df.empty: return None, None
-            # Check TZ
-            if df.index.tz is None: 
-                try: df.index = df.index.tz_localize('UTC').tz_convert('Asia/Taipei')
-                except: pass
-            else:
-                try: df.index = df.index.tz_convert('Asia/Taipei')
-                except: pass
-                
-            mask = df.index.date < scan_date
-            df_past = df[mask]
-            
-            if not df_past.empty:
-                return df_past.index[-1].date(), float(df_past['Close'].iloc[-1])
-            return None, None
+    return _get_price_snapshot(tuple(sorted(set(tickers))), cache_epoch(30))
 
-        # Candidate 1: Daily
-        d_date, d_price = get_last_close_before_today(df_d, today_date)
+@st.cache_data(max_entries=200)
+def _get_price_snapshot(tickers, epoch):
+    tickers = sorted(set(tickers))
+    if not tickers:
+        return {}
         
-        # Candidate 2: Hourly
-        h_date, h_price = get_last_close_before_today(df_h, today_date)
+    prices = {}
+    try:
+        df = yf.download(tickers, period="1d", interval="1m", progress=False)
+        prices.update(_last_closes(df, tickers))
         
-        # DECISION: Pick the most recent one
-        prev_close = 0.0
+        missing = [t for t in tickers if t not in prices]
+        if missing:
+            df = yf.download(missing, period="5d", interval="1d", progress=False)
+            prices.update(_last_closes(df, missing))
+    except Exception as e:
+        print(f"Price Snapshot Error: {e}")
         
-        if d_date and h_date:
-            if h_date > d_date:
-                prev_close = h_price # Hourly is newer (Daily gap)
-            else:
-                prev_close = d_price # Daily is same or newer (prefer Daily for accuracy)
-        elif d_date:
-            prev_close = d_price
-        elif h_date:
-            prev_close = h_price
-        else:
-            # No past data? Fallback to Open
-            if not df_d.empty: prev_close = float(df_d['Open'].iloc[0])
+    return prices
 
-        # 2. Get Intraday (for Current Price & Time)
-        # Use history(1d) as it is most reliable for Close, even if slightly delayed vs fast_info
-        # fast_info often returns -1 or stale data after hours
-        
-        curr_price = 0.0
-        time_str = "N/A"
-        
-        # Try fetching 1 minute data for today first
-        df_m = get_stock_data(ticker, period="1d", interval="1m")
-        
-        if not df_m.empty:
-            curr_price = float(df_m['Close'].iloc[-1])
-            time_str = df_m.index[-1].strftime("%Y-%m-%d %H:%M")
-        else:
-            # Fallback to Daily history (reliable 5d)
-            if not df_d.empty:
-                curr_price = float(df_d['Close'].iloc[-1])
-                time_str = df_d.index[-1].strftime("%Y-%m-%d (已收盤)")
-                
-        # Double check against fast_info ONLY if we have no valid price yet or it seems wild
-        # But actually history() is usually better.
-        # If curr_price is 0, try fast_info
-        if curr_price == 0:
-             fi = t.fast_info.get('last_price', -1)
-             if fi > 0: 
-                 curr_price = fi
-                 time_str = "Realtime (FastInfo)"
-        
-        # 3. Calculate Change
-        if prev_close > 0:
-            chg = curr_price - prev_close
-            pct = (chg / prev_close) * 100
-        else:
-            chg = 0; pct = 0
-            
-        return {
-            "price": curr_price,
-            "change": chg,
-            "pct": pct,
-            "time": time_str,
-            "prev_close": prev_close
-        }
-    except Exception as e:
-        print(f"Quote Error: {e}")
-        return {"price": 0, "change": 0, "pct": 0, "time": "Error"}
+def get_realtime_quote(ticker):
+    """
+    Returns a dict with: 'price', 'change', 'pct', 'time', 'prev_close'
+    Served by the shared quote engine (one 1m series + cached previous close).
+    """
+    from quote_engine import quote_engine
+    return quote_engine.get_quote(ticker)
 
 @st.cache_data(ttl=3600)
 def fetch_twse_institutional_data(stock_id, days=30):
@@ -239,12 +276,15 @@ def fetch_twse_institutional_data(stock_id, days=30):
 
 # --- Analysis Tools ---
 
-@st.cache_data(ttl=300)
 def get_top_movers_batch(top_n=10):
     """
     Fetches data for a broad list of key TWSE stocks to determine Top Gainers/Losers.
     Returns: (gainers_df, losers_df, volume_df)
     """
+    return _get_top_movers_batch(top_n, cache_epoch(300))
+
+@st.cache_data(max_entries=20)
+def _get_top_movers_batch(top_n, epoch):
     # Sample List of Key Stocks (Top ~100 by weight/popularity approx)
     # Includes Tech, Finance, FPC, Steel, Transport, ETFs
     targets = [
@@ -309,11 +349,14 @@ def get_top_movers_batch(top_n=10):
         print(f"Batch Mover Error: {e}")
         return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
-@st.cache_data(ttl=300)
 def get_sector_performance():
     """
     Approximates sector performance using key ETFs or Index Representatives.
     """
+    return _get_sector_performance(cache_epoch(300))
+
+@st.cache_data(max_entries=20)
+def _get_sector_performance(epoch):
     sectors = {
         "半導體": "2330.TW",
         "金融": "2881.TW",